@@ -0,0 +1,174 @@
+"""* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+*                                                                            *
+*                         Developed by Javier Bolanos                        *
+*                  https://github.com/javierbolanosllano                     *
+*                                                                            *
+*                      UAXSAT IV Project - 2024                              *
+*                   https://github.com/UAXSat/UAXSat                         *
+*                                                                            *
+* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
+
+# DBwriter.py
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the database could not be reached, as opposed to bad data
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError)
+
+class BatchedWriter:
+    """
+    Buffers telemetry rows in memory and writes them to PostgreSQL in batches.
+
+    Rows are dictionaries keyed by column name. They are flushed with a single
+    multi-row INSERT (execute_values) when `max_rows` rows are waiting or when
+    the oldest waiting row is `max_delay` seconds old, whichever comes first.
+    Connections come from a pool that is kept open for the life of the writer.
+    The pool is created on the first flush, so the writer can be started while
+    the database is down; rows are kept and written once it is reachable.
+    When a batch is rejected for its data, only the offending rows are dropped.
+
+    Parameters:
+    - table: Name of the table, including the schema if needed (string).
+    - columns: Columns to insert; every row must have these keys (list).
+    - max_rows: Number of buffered rows that triggers a flush (int).
+    - max_delay: Maximum time a row may wait in the buffer, in seconds (float).
+    - max_buffer: Rows kept while the database is unreachable; older rows are
+      dropped beyond this (int).
+    - connect_kwargs: Arguments for psycopg2.connect (host, dbname, user...).
+    """
+
+    def __init__(self, table, columns, max_rows=50, max_delay=1.0, max_buffer=10000,
+                 minconn=1, maxconn=2, **connect_kwargs):
+        self.pool = None
+        self.pool_args = (minconn, maxconn)
+        self.connect_kwargs = connect_kwargs
+        self.pool_lock = threading.Lock()
+        self.query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s"
+        self.template = "(" + ", ".join(f"%({column})s" for column in columns) + ")"
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_buffer = max_buffer
+
+        self.rows = []
+        self.deadline = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection from the pool (for DDL or one-off queries)."""
+        connection_pool = self._get_pool()
+        conn = connection_pool.getconn()
+        try:
+            yield conn
+        finally:
+            # Broken connections are discarded instead of returned to the pool
+            connection_pool.putconn(conn, close=bool(conn.closed))
+
+    def _get_pool(self):
+        """Returns the pool, connecting first if needed (OperationalError if the database is down)."""
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = pool.ThreadedConnectionPool(*self.pool_args, **self.connect_kwargs)
+                logger.info("Connected to PostgreSQL database.")
+            return self.pool
+
+    def add(self, row):
+        """Queues one row; it will be written on the next flush."""
+        with self.lock:
+            first = not self.rows
+            if first:
+                self.deadline = time.monotonic() + self.max_delay
+            self.rows.append(row)
+            full = len(self.rows) >= self.max_rows
+        # The flusher sleeps without a timeout while the buffer is empty, so it
+        # is woken up to start waiting for the new deadline
+        if first or full:
+            self.wakeup.set()
+
+    def _run(self):
+        while self.running:
+            with self.lock:
+                deadline = self.deadline
+                full = len(self.rows) >= self.max_rows
+            if deadline is not None and (full or time.monotonic() >= deadline):
+                self.flush()
+                continue
+            # Woken up early by add(); the state is checked again on every pass
+            timeout = None if deadline is None else deadline - time.monotonic()
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+
+    def flush(self):
+        """Writes every buffered row now. Returns the number of rows written."""
+        with self.lock:
+            rows, self.rows = self.rows, []
+            self.deadline = None
+        if not rows:
+            return 0
+
+        # A batch rejected for its data is split in halves until the bad rows
+        # are isolated, so only those are dropped
+        pending = [rows]            # Stack of batches, next one last
+        written = 0
+        while pending:
+            batch = pending.pop()
+            try:
+                self._insert(batch)
+                written += len(batch)
+            except CONNECTION_ERRORS as e:
+                # Connection problem: keep the rows not written yet and try again later
+                remaining = batch + [row for rest in reversed(pending) for row in rest]
+                logger.error(f"Error writing {len(remaining)} rows to PostgreSQL, will retry: {e}")
+                self._requeue(remaining)
+                break
+            except Exception as e:
+                if len(batch) == 1:
+                    # Bad data: retrying would fail forever, so the row is dropped
+                    logger.error(f"Error writing a row to PostgreSQL, row dropped: {e} {batch[0]}")
+                else:
+                    half = len(batch) // 2
+                    pending += [batch[half:], batch[:half]]
+
+        if written:
+            logger.info(f"{written} rows inserted into PostgreSQL.")
+        return written
+
+    def _insert(self, rows):
+        """Inserts the rows in one transaction (rolled back on error)."""
+        with self.connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    execute_values(cursor, self.query, rows, template=self.template,
+                                   page_size=len(rows))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _requeue(self, rows):
+        """Puts rows that failed to be written back at the front of the buffer."""
+        with self.lock:
+            self.rows = (rows + self.rows)[-self.max_buffer:]
+            self.deadline = time.monotonic() + self.max_delay
+
+    def close(self):
+        """Stops the background flusher, writes pending rows and closes the pool."""
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
@@ -1,22 +1,25 @@
 import os
 import time
 import json
-import csv
 import logging
 import sys
 import paho.mqtt.client as mqtt
-import psycopg2
 
 sys.path.append('../')  # Permite importar módulos de la carpeta vecinos
 
 # Import the modules to read the sensors
 from Software.Sensors.UVmodule import initialize_sensor as init_uv_sensor, read_sensor_data as read_uv_data
 from Software.Sensors.GPSmodule import GPSHandler
-from Software.Sensors.IMUmodule import initialize_sensor as init_icm_sensor, read_sensor_data as read_imu_data
+from Software.Sensors.IMUmodule import initialize_sensor as init_icm_sensor, IMUFifo
+from Software.Sensors.Attitudemodule import AttitudeEngine
+from Software.Sensors.MagCalibrationmodule import MagCalibration
 from Software.Sensors.DS18B20module import DallasSensor
 from Software.Sensors.BMPmodule import initialize_sensor as init_bmp_sensor, read_sensor_data as read_bmp_data
-from gpiozero import CPUTemperature
-from psutil import cpu_percent, virtual_memory
+from Software.Sensors.Schedulermodule import SamplingScheduler
+from Software.Sensors.Systemmodule import SystemSampler
+from Software.Sensors.I2Cbusmodule import close_buses
+from DBwriter import BatchedWriter
+from Recorder import FlightRecorder
 
 # Database configuration
 DB_HOST = 'localhost'
@@ -28,9 +31,26 @@ DB_PASSWORD = '4225'
 ## MQTT Configuration and interval between sensor readings
 broker = "localhost"
 port = 1883
-sensorReadingInterval = 2
+sensorReadingInterval = 1
 topic = "data"
 
+# Sampling rate of each sensor (Hz). Every sensor runs in its own thread, so the
+# frame rate is limited by the slowest sensor instead of the sum of all of them.
+SENSOR_RATES = {
+    "GPS"         : 1,
+    "IMU"         : 20,     # FIFO drain and attitude publish rate; the IMU itself samples at IMU_FIFO_RATE
+    "UV"          : 1,
+    "CPUTemp"     : 1,
+    "CPU Usage"   : 1,
+    "RAM Usage"   : 1,
+    "Temperature" : 1,
+}
+
+# IMU sampling rate (Hz) and magnetic declination (degrees, east positive) for the attitude
+IMU_FIFO_RATE = 225
+MAGNETIC_DECLINATION = 0.0
+MAG_CALIBRATION_PATH = os.path.expanduser('~/mag_calibration.npz')
+
 # GPS parameters
 BAUDRATE = 38400
 TIMEOUT = 1
@@ -41,46 +61,123 @@ HWID = "1546:01A9"
 logging.basicConfig(filename='/home/javil/error.log', level=logging.DEBUG,
                     format='%(asctime)s: %(levelname)s: %(message)s')
 
-# Initialize PostgreSQL connection
+# Columns of grafana_schema.sensor_data written for every frame
+DB_COLUMNS = (
+    'timestamp', 'cpu_temp', 'cpu_usage', 'ram_usage', 'latitude', 'longitude', 'altitude',
+    'heading_motion', 'roll', 'pitch', 'heading', 'nmea_sentence', 'acceleration', 'gyro',
+    'magnetic', 'uva', 'uvb', 'uvc', 'uv_temp', 'uv_gain', 'uv_integration_time', 'temperature',
+)
+
+# Rows are written in batches when DB_BATCH_ROWS are waiting or after DB_BATCH_DELAY seconds
+DB_BATCH_ROWS = 50
+DB_BATCH_DELAY = 5.0
+
+# On-board recording (see Recorder.py for the file format)
+RECORD_COLUMNS = (
+    ('timestamp', 'd'), ('cpu_temp', 'f'), ('cpu_usage', 'f'), ('ram_usage', 'f'),
+    ('latitude', 'd'), ('longitude', 'd'), ('altitude', 'f'), ('heading_motion', 'f'),
+    ('roll', 'f'), ('pitch', 'f'), ('heading', 'f'), ('nmea_sentence', '82s'),
+    ('acel_x', 'f'), ('acel_y', 'f'), ('acel_z', 'f'),
+    ('gyro_x', 'f'), ('gyro_y', 'f'), ('gyro_z', 'f'),
+    ('mag_x', 'f'), ('mag_y', 'f'), ('mag_z', 'f'),
+    ('att_roll', 'f'), ('att_pitch', 'f'), ('att_heading', 'f'),
+    ('quat_w', 'f'), ('quat_x', 'f'), ('quat_y', 'f'), ('quat_z', 'f'),
+    ('uva', 'f'), ('uvb', 'f'), ('uvc', 'f'), ('uv_temp', 'f'),
+    ('uv_gain', 'H'), ('uv_integration_time', 'H'),
+    ('temperature_0', 'f'), ('temperature_1', 'f'), ('temperature_2', 'f'), ('temperature_3', 'f'),
+)
+RECORD_CHUNK_ROWS = 60              # One write per minute at 1 Hz
+RECORD_MAX_BYTES = 32 * 1024 * 1024
+RECORD_MAX_AGE = 3600               # New file every hour
+RECORD_FSYNC_INTERVAL = 60
+
+# Initialize the PostgreSQL batched writer
 def connect_to_db():
+    writer = BatchedWriter(
+        'grafana_schema.sensor_data', DB_COLUMNS,
+        max_rows=DB_BATCH_ROWS,
+        max_delay=DB_BATCH_DELAY,
+        host=DB_HOST,
+        port=DB_PORT,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD
+    )
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        logging.info("Connected to PostgreSQL database.")
-        return conn
+        # The writer connects on first use; connect now so that the table can
+        # be reset and an unreachable database is reported at start-up
+        with writer.connection():
+            pass
+        return writer
     except Exception as e:
         logging.error(f"Error connecting to PostgreSQL database: {e}")
+        writer.close()
         return None
 
-def insert_sensor_data(conn, data):
-    try:
-        with conn.cursor() as cursor:
-            query = """
-                INSERT INTO grafana_schema.sensor_data (
-                    timestamp, cpu_temp, cpu_usage, ram_usage, latitude, longitude, altitude,
-                    heading_motion, roll, pitch, heading, nmea_sentence, acceleration, gyro,
-                    magnetic, uva, uvb, uvc, uv_temp, temperature
-                ) VALUES (
-                    %(timestamp)s, %(cpu_temp)s, %(cpu_usage)s, %(ram_usage)s, %(latitude)s, %(longitude)s, %(altitude)s,
-                    %(heading_motion)s, %(roll)s, %(pitch)s, %(heading)s, %(nmea_sentence)s, %(acceleration)s, %(gyro)s,
-                    %(magnetic)s, %(uva)s, %(uvb)s, %(uvc)s, %(uv_temp)s, %(temperature)s
-                )
-            """
-            cursor.execute(query, data)
-            conn.commit()
-            logging.info("Sensor data inserted into PostgreSQL database.")
-    except psycopg2.Error as e:
-        conn.rollback()  # Rollback the transaction if an error occurs
-        logging.error(f"Error inserting data into PostgreSQL database: {e.pgerror}")
-        logging.error(f"Error details: {e.diag.message_primary}")
-    except Exception as e:
-        conn.rollback()  # Rollback the transaction if a non-psycopg2 error occurs
-        logging.error(f"Unexpected error inserting data: {e}")
+def build_db_row(sensor_data):
+    """Maps a frame from read_sensors() to a row of grafana_schema.sensor_data."""
+    dallas = sensor_data.get('Temperature')
+    return {
+        'timestamp': time.strftime("%y-%m-%d %H:%M:%S", time.localtime()),
+        'cpu_temp': sensor_data.get('CPUTemp'),
+        'cpu_usage': sensor_data.get('CPU Usage'),
+        'ram_usage': sensor_data.get('RAM Usage'),
+        'latitude': sensor_data.get('Latitude'),
+        'longitude': sensor_data.get('Longitude'),
+        'altitude': sensor_data.get('Altitude'),
+        'heading_motion': sensor_data.get('Heading of Motion'),
+        'roll': sensor_data.get('Roll'),
+        'pitch': sensor_data.get('Pitch'),
+        'heading': sensor_data.get('Heading'),
+        'nmea_sentence': sensor_data.get('NMEA Sentence'),
+        'acceleration': json.dumps(sensor_data.get('Acceleration')),
+        'gyro': json.dumps(sensor_data.get('Gyro')),
+        'magnetic': json.dumps(sensor_data.get('Magnetic')),
+        'uva': sensor_data.get('UVA'),
+        'uvb': sensor_data.get('UVB'),
+        'uvc': sensor_data.get('UVC'),
+        'uv_temp': sensor_data.get('UV Temp'),
+        'uv_gain': sensor_data.get('UV Gain'),
+        'uv_integration_time': sensor_data.get('UV Integration Time'),
+        # The column holds a single value: mean of the DS18B20 probes
+        'temperature': sum(dallas.values()) / len(dallas) if dallas else None,
+    }
+
+def build_record_row(sensor_data):
+    """Maps a frame from read_sensors() to the typed columns of RECORD_COLUMNS."""
+    row = {
+        'timestamp': time.time(),
+        'cpu_temp': sensor_data.get('CPUTemp'),
+        'cpu_usage': sensor_data.get('CPU Usage'),
+        'ram_usage': sensor_data.get('RAM Usage'),
+        'latitude': sensor_data.get('Latitude'),
+        'longitude': sensor_data.get('Longitude'),
+        'altitude': sensor_data.get('Altitude'),
+        'heading_motion': sensor_data.get('Heading of Motion'),
+        'roll': sensor_data.get('Roll'),
+        'pitch': sensor_data.get('Pitch'),
+        'heading': sensor_data.get('Heading'),
+        'nmea_sentence': sensor_data.get('NMEA Sentence'),
+        'uva': sensor_data.get('UVA'),
+        'uvb': sensor_data.get('UVB'),
+        'uvc': sensor_data.get('UVC'),
+        'uv_temp': sensor_data.get('UV Temp'),
+        'uv_gain': sensor_data.get('UV Gain'),
+        'uv_integration_time': sensor_data.get('UV Integration Time'),
+        'att_roll': sensor_data.get('Attitude Roll'),
+        'att_pitch': sensor_data.get('Attitude Pitch'),
+        'att_heading': sensor_data.get('Attitude Heading'),
+    }
+    quaternion = sensor_data.get('Quaternion') or (None,) * 4
+    row.update(zip(('quat_w', 'quat_x', 'quat_y', 'quat_z'), quaternion))
+    for prefix, key in (('acel', 'Acceleration'), ('gyro', 'Gyro'), ('mag', 'Magnetic')):
+        vector = sensor_data.get(key) or (None, None, None)
+        row.update(zip((f'{prefix}_x', f'{prefix}_y', f'{prefix}_z'), vector))
+    # DS18B20 probes in order of their 1-Wire ID
+    dallas = sensor_data.get('Temperature') or {}
+    for i, sensor_id in enumerate(sorted(dallas)[:4]):
+        row[f'temperature_{i}'] = dallas[sensor_id]
+    return row
 
 def reset_sensor_data_table(conn):
     try:
@@ -108,6 +205,8 @@ def reset_sensor_data_table(conn):
                     uvb FLOAT,
                     uvc FLOAT,
                     uv_temp FLOAT,
+                    uv_gain INTEGER,
+                    uv_integration_time INTEGER,
                     temperature FLOAT
                 )
             """)
@@ -117,11 +216,7 @@ def reset_sensor_data_table(conn):
         conn.rollback()
         logging.error(f"Error resetting sensor data table: {e}")
 
-def initialize_csv_folder():
-    """Create the folder to save the CSV files if it doesn't exist."""
-    if not os.path.exists(csv_folder):
-        os.makedirs(csv_folder)
-        logging.info(f"Carpeta '{csv_folder}' creada.")
+sensor_status = {}
 
 def log_status(sensor_name, status):
     """
@@ -130,37 +225,128 @@ def log_status(sensor_name, status):
     Parameters:
     - sensor_name: Name of the sensor (string).
     - status: Sensor status ('OK' or 'Disconnected') (string).
+
+    Only changes of status are logged, so that fast sensors don't flood the log.
     """
+    if sensor_status.get(sensor_name) == status:
+        return
+    sensor_status[sensor_name] = status
     status_message = f"{sensor_name}: {status}"
     if status == "OK":
         logging.info(status_message)
     else:
         logging.warning(status_message)
 
+## Sensor registry
+class SensorRegistry:
+    """
+    Keeps one open handle per sensor for the whole life of the process.
+
+    Each sensor is registered with the function that initialises it. The handle
+    is created on first use and reused on every cycle; it is only discarded
+    (and re-initialised on the next cycle) after a read fails.
+    """
+
+    def __init__(self):
+        self.factories = {}
+        self.handles = {}
+
+    def register(self, name, factory):
+        """Registers the function used to initialise the sensor `name`."""
+        self.factories[name] = factory
+
+    def get(self, name):
+        """Returns the open handle for `name`, initialising it if needed."""
+        handle = self.handles.get(name)
+        if handle is None:
+            logging.debug(f"Initialising {name}...")
+            handle = self.factories[name]()
+            self.handles[name] = handle
+        return handle
+
+    def invalidate(self, name):
+        """Drops the handle for `name` so that it is re-initialised on next use."""
+        self.handles.pop(name, None)
+
+    def read(self, name, reader):
+        """Reads the sensor with `reader(handle)`, invalidating the handle on error."""
+        try:
+            return reader(self.get(name))
+        except Exception:
+            self.invalidate(name)
+            raise
+
+# Loaded once: it keeps improving for as long as the process runs, even if the IMU is re-initialised
+mag_calibration = MagCalibration(MAG_CALIBRATION_PATH)
+
+# The IMU is read through its FIFO: every sample goes through the attitude
+# filter, and the last one is published along with the attitude
+def init_imu_attitude():
+    fifo = IMUFifo(init_icm_sensor(), IMU_FIFO_RATE, calibration=mag_calibration)
+    fifo.start()
+    # The last values published, repeated while the FIFO has no new samples
+    return fifo, AttitudeEngine(declination=MAGNETIC_DECLINATION), {'values': None}
+
+def read_imu_attitude(handle):
+    """Drains the FIFO; an empty drain (no new samples yet) returns the previous values or None."""
+    fifo, engine, last = handle
+    samples = fifo.read()
+    if len(samples) == 0:
+        return last['values']
+    attitude = engine.update(samples)
+    sample = samples[-1]
+    last['values'] = sample['accel'].tolist(), sample['gyro'].tolist(), sample['mag'].tolist(), attitude
+    return last['values']
+
+# The DS18B20 probes convert in a background thread; reads return the cached temperatures
+def init_dallas_sensor():
+    dallas = DallasSensor()
+    dallas.start(interval=1 / SENSOR_RATES["Temperature"])
+    return dallas
+
+# CPU, RAM and temperature come from one sampler thread; reads return its last snapshot
+def init_system_sampler():
+    sampler = SystemSampler(interval=1 / SENSOR_RATES["CPU Usage"])
+    sampler.start()
+    return sampler
+
+sensors = SensorRegistry()
+sensors.register("UV Sensor", init_uv_sensor)
+sensors.register("IMU Sensor", init_imu_attitude)
+sensors.register("DallasSensor", init_dallas_sensor)
+sensors.register("System", init_system_sampler)
+
 ## Functions to read the sensors
 # UV Sensor
 def read_uv_sensor():
     try:
-        sensor = init_uv_sensor()
-        data = read_uv_data(sensor)
+        data = sensors.read("UV Sensor", read_uv_data)
+        if data is None:
+            # Overflow: the sensor answered, so the handle is still valid
+            log_status("UV Sensor", "Overflow")
+            return (None,) * 6
         log_status("UV Sensor", "OK")
-        return data['UVA'], data['UVB'], data['UVC'], data['temp']
+        # Gain and integration time (ms) chosen by the auto-ranger: needed to scale the counts
+        return (data['UVA'], data['UVB'], data['UVC'], data['UV Temp'],
+                data['UV Gain'], data['UV Integration Time'])
     except Exception as e:
         log_status("UV Sensor", "Disconnected")
         logging.error(f"Error reading UV Sensor: {e}")
-        return None, None, None, None
+        return (None,) * 6
 
 # ICM20948 Sensor
 def read_imu_sensor():
     try:
-        sensor = init_icm_sensor()
-        data = read_imu_data(sensor)
+        values = sensors.read("IMU Sensor", read_imu_attitude)
+        if values is None:
+            # Started but no sample in the FIFO yet: not an error
+            return None, None, None, None
         log_status("IMU Sensor", "OK")
-        return data['acceleration'], data['gyro'], data['magnetic']
+        return values
     except Exception as e:
         log_status("IMU Sensor", "Disconnected")
         logging.error(f"Error reading IMU Sensor: {e}")
-        return None, None, None
+        return None, None, None, None
     
 # BMP3XX Sensor
 # def read_bmp3xx_sensor():
@@ -177,12 +363,13 @@ def read_imu_sensor():
 # Dallas Sensor
 def read_dallas_sensor():
     try:
-        sensor = DallasSensor()
-        sensor_info = sensor.get_sensor_info()
+        sensor_info = sensors.read("DallasSensor", DallasSensor.get_sensor_info)
         if sensor_info:
             log_status("DallasSensor", "OK")
             return sensor_info
         else:
+            # No recent reading from any probe: rescan the 1-Wire bus
+            sensors.get("DallasSensor").refresh()
             log_status("DallasSensor", "Disconnected")
             return None
     except Exception as e:
@@ -194,7 +381,7 @@ def read_dallas_sensor():
 def read_CPU():
     """Reads the CPU temperature."""
     try:
-        cpu = CPUTemperature().temperature
+        cpu = sensors.read("System", SystemSampler.get)["Temperature (°C)"]
         log_status("CPUTemperature", "OK")
         return cpu
     except Exception as e:
@@ -206,7 +393,7 @@ def read_CPU():
 def read_CPU_usage():
     """Reads the CPU usage."""
     try:
-        cpu = cpu_percent(interval=1)
+        cpu = sensors.read("System", SystemSampler.get)["CPU Usage (%)"]
         log_status("CPU Usage", "OK")
         return cpu
     except Exception as e:
@@ -218,7 +405,7 @@ def read_CPU_usage():
 def read_RAM_usage():
     """Reads the RAM usage."""
     try:
-        ram = virtual_memory().percent
+        ram = sensors.read("System", SystemSampler.get)["RAM Usage (%)"]
         log_status("RAM Usage", "OK")
         return ram
     except Exception as e:
@@ -229,16 +416,9 @@ def read_RAM_usage():
 # GPS Sensor
 def read_gps_sensor(gps_reader):
     try:
-        if not gps_reader.gps or not gps_reader.serial_port:
-            # Try to reconnect to the GPS
-            logging.debug("Attempting to reconnect to GPS...")
-            gps_reader = GPSHandler(BAUDRATE, TIMEOUT, description=DESCRIPTION, hwid=HWID)
-            if not gps_reader.gps or not gps_reader.serial_port:
-                log_status("GPS Sensor", "Disconnected")
-                return None, None, None, None, None, None, None, None
-
+        # GPSprogram() reconnects by itself, reopening the cached port
         data = gps_reader.GPSprogram()
-        if data:
+        if data and "Error" not in data:
             log_status("GPS Sensor", "OK")
             return data['Latitude'], data['Longitude'], data['Altitude'], data['Heading of Motion'], data['Roll'], data['Pitch'], data['Heading'], data['NMEA Sentence']
         else:
@@ -260,17 +440,34 @@ def prepare_sensor_data(readings):
             sensors_data[sensor] = None
     return sensors_data
 
+## Sampling scheduler
+def create_scheduler(gps_parser):
+    """Registers every sensor in a SamplingScheduler with its own rate."""
+    scheduler = SamplingScheduler()
+    scheduler.add("GPS", lambda: read_gps_sensor(gps_parser), SENSOR_RATES["GPS"])
+    scheduler.add("IMU", read_imu_sensor, SENSOR_RATES["IMU"])
+    # scheduler.add("BMP", read_bmp3xx_sensor, SENSOR_RATES["BMP"])
+    scheduler.add("UV", read_uv_sensor, SENSOR_RATES["UV"])
+    scheduler.add("CPUTemp", read_CPU, SENSOR_RATES["CPUTemp"])
+    scheduler.add("CPU Usage", read_CPU_usage, SENSOR_RATES["CPU Usage"])
+    scheduler.add("RAM Usage", read_RAM_usage, SENSOR_RATES["RAM Usage"])
+    scheduler.add("Temperature", read_dallas_sensor, SENSOR_RATES["Temperature"])
+    return scheduler
+
 ## Read all the sensors
-def read_sensors(gps_parser):
-    latitude, longitude, altitude, headingMotion, roll, pitch, heading, nmea = read_gps_sensor(gps_parser)
-    acceleration, gyro, magnetic = read_imu_sensor()
-    # pressure, temperature, bmp_altitude = read_bmp3xx_sensor()
-    uva, uvb, uvc, uv_temp = read_uv_sensor()
+def read_sensors(scheduler):
+    """Assembles a frame from the latest sample of every sensor."""
+    latest = scheduler.snapshot()
+    latitude, longitude, altitude, headingMotion, roll, pitch, heading, nmea = latest["GPS"] or (None,) * 8
+    acceleration, gyro, magnetic, attitude = latest["IMU"] or (None,) * 4
+    attitude = attitude or {}
+    # pressure, temperature, bmp_altitude = latest["BMP"] or (None,) * 3
+    uva, uvb, uvc, uv_temp, uv_gain, uv_integration_time = latest["UV"] or (None,) * 6
 
     readings = {
-        "CPUTemp"           : read_CPU(),
-        "CPU Usage"         : read_CPU_usage(),
-        "RAM Usage"         : read_RAM_usage(),
+        "CPUTemp"           : latest["CPUTemp"],
+        "CPU Usage"         : latest["CPU Usage"],
+        "RAM Usage"         : latest["RAM Usage"],
         "Latitude"          : latitude,
         "Longitude"         : longitude,
         "Altitude"          : altitude,
@@ -282,6 +479,10 @@ def read_sensors(gps_parser):
         "Acceleration"      : acceleration,
         "Gyro"              : gyro,
         "Magnetic"          : magnetic,
+        "Attitude Roll"     : attitude.get('roll'),
+        "Attitude Pitch"    : attitude.get('pitch'),
+        "Attitude Heading"  : attitude.get('heading'),
+        "Quaternion"        : attitude.get('quaternion'),
         # "Pressure"        : pressure,
         # "BMP Temp"        : temperature,
         # "BMP Altitude"    : bmp_altitude,
@@ -289,34 +490,12 @@ def read_sensors(gps_parser):
         "UVB"               : uvb,
         "UVC"               : uvc,
         "UV Temp"           : uv_temp,
-        "Temperature"       : read_dallas_sensor(),
+        "UV Gain"           : uv_gain,
+        "UV Integration Time": uv_integration_time,
+        "Temperature"       : latest["Temperature"],
     }
     return prepare_sensor_data(readings)
 
-## Save the data to a CSV file
-def save_json_to_csv(json_data, csv_file_path):
-    # Parse the JSON data
-    try:
-        data = json.loads(json_data)
-
-        # Check if the CSV file already exists
-        file_exists = os.path.isfile(csv_file_path)
-
-        with open(csv_file_path, mode='a', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=data.keys())
-
-            # If the file doesn't exist, write the header
-            if not file_exists:
-                writer.writeheader()
-
-            # Write the data
-            writer.writerow(data)
-
-        logging.info(f"Data appended to {csv_file_path} successfully.")
-
-    except Exception as e:
-        logging.error(f"Error saving data to CSV: {e}")
-
 ## MQTT Callbacks
 def on_connect(client, userdata, flags, reason_code, properties=None):
     if reason_code == 0:
@@ -331,22 +510,21 @@ if __name__ == "__main__":
     try:
         logging.info("Starting sensor data collection script.")
 
-        # Generate unique CSV file name
-        current_time = time.strftime("%H%M%S", time.localtime())
+        # On-board recording, one folder per day
         current_date = time.strftime("%d%m%Y", time.localtime())
-
-        home_folder = os.path.expanduser('~')
-        csv_folder = os.path.join(home_folder, 'CSV', current_date)
-
-        # Ensure the CSV folder exists; create it if it doesn't
-        if not os.path.exists(csv_folder):
-            os.makedirs(csv_folder)
-
-        csv_filename = f"data_{current_time}.csv"
-        csv_file_path = os.path.join(csv_folder, csv_filename)
+        record_folder = os.path.join(os.path.expanduser('~'), 'Recordings', current_date)
+        recorder = FlightRecorder(record_folder, RECORD_COLUMNS,
+                                  chunk_rows=RECORD_CHUNK_ROWS,
+                                  max_bytes=RECORD_MAX_BYTES,
+                                  max_age=RECORD_MAX_AGE,
+                                  fsync_interval=RECORD_FSYNC_INTERVAL)
 
         gps_parser = GPSHandler(BAUDRATE, TIMEOUT, description=DESCRIPTION, hwid=HWID)
 
+        # Start sampling every sensor in the background
+        scheduler = create_scheduler(gps_parser)
+        scheduler.start()
+
         # MQTT Client
         client = mqtt.Client()
         client.on_connect = on_connect
@@ -355,15 +533,17 @@ if __name__ == "__main__":
         client.loop_start()
 
         # Database Connection
-        db_conn = connect_to_db()
+        db_writer = connect_to_db()
 
         # Reset the sensor_data table
-        if db_conn:
-            reset_sensor_data_table(db_conn)
+        if db_writer:
+            with db_writer.connection() as conn:
+                reset_sensor_data_table(conn)
 
+        next_frame = time.monotonic()
         while True:
             logging.debug("Reading sensor data...")
-            sensor_data = read_sensors(gps_parser)
+            sensor_data = read_sensors(scheduler)
             sensorDataJSON = json.dumps(sensor_data)
 
             if sensorDataJSON:
@@ -376,47 +556,37 @@ if __name__ == "__main__":
                 else:
                     logging.error(f"Failed to send message to topic {topic}")
 
-                # Save the JSON data to CSV
-                logging.debug(f"Saving data to CSV: {sensorDataJSON}")
-                save_json_to_csv(sensorDataJSON, csv_file_path)
-                logging.info(f"Data saved to {csv_filename} successfully.")
-
-                # Insert data into PostgreSQL
-                if db_conn:
-                    data_to_insert = {
-                        'timestamp': time.strftime("%y-%m-%d %H:%M:%S", time.localtime()),
-                        'cpu_temp': sensor_data.get('CPUTemp'),
-                        'cpu_usage': sensor_data.get('CPU Usage'),
-                        'ram_usage': sensor_data.get('RAM Usage'),
-                        'latitude': sensor_data.get('Latitude'),
-                        'longitude': sensor_data.get('Longitude'),
-                        'altitude': sensor_data.get('Altitude'),
-                        'heading_motion': sensor_data.get('Heading of Motion'),
-                        'roll': sensor_data.get('Roll'),
-                        'pitch': sensor_data.get('Pitch'),
-                        'heading': sensor_data.get('Heading'),
-                        'nmea_sentence': sensor_data.get('NMEA Sentence'),
-                        'acceleration': json.dumps(sensor_data.get('Acceleration')),
-                        'gyro': json.dumps(sensor_data.get('Gyro')),
-                        'magnetic': json.dumps(sensor_data.get('Magnetic')),
-                        'uva': sensor_data.get('UVA'),
-                        'uvb': sensor_data.get('UVB'),
-                        'uvc': sensor_data.get('UVC'),
-                        'uv_temp': sensor_data.get('UV Temp'),
-                        'temperature': sensor_data.get('Temperature')
-                    }
-                    insert_sensor_data(db_conn, data_to_insert)
+                # Record the frame on board
+                recorder.add(build_record_row(sensor_data))
+
+                # Queue the row for the next batched insert into PostgreSQL
+                if db_writer:
+                    db_writer.add(build_db_row(sensor_data))
             else:
                 logging.error("Error preparing sensor data.")
 
-            time.sleep(sensorReadingInterval)
+            # Sleep only what is left of the interval
+            next_frame += sensorReadingInterval
+            time.sleep(max(0, next_frame - time.monotonic()))
 
     except KeyboardInterrupt:
         logging.info("Program stopped by the user.")
     except Exception as e:
         logging.error(f"Unexpected error while publishing data: {e}")
     finally:
+        if 'scheduler' in locals():
+            scheduler.stop(timeout=2)
+        if 'gps_parser' in locals():
+            gps_parser.close()
+        if mag_calibration.calibrated:
+            try:
+                mag_calibration.save()
+            except OSError as e:
+                logging.error(f"Error saving magnetometer calibration: {e}")
+        close_buses()
+        if 'recorder' in locals():
+            recorder.close()
         client.loop_stop()
         client.disconnect()
-        if db_conn:
-            db_conn.close()
\ No newline at end of file
+        if 'db_writer' in locals() and db_writer:
+            db_writer.close()
\ No newline at end of file
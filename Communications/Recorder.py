@@ -0,0 +1,185 @@
+"""* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+*                                                                            *
+*                         Developed by Javier Bolanos                        *
+*                  https://github.com/javierbolanosllano                     *
+*                                                                            *
+*                      UAXSAT IV Project - 2024                              *
+*                   https://github.com/UAXSat/UAXSat                         *
+*                                                                            *
+* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
+
+# Recorder.py
+#
+# On-board flight recorder: typed, fixed-size records written in chunks.
+#
+# File format (.rec):
+#   MAGIC            8 bytes   b'UAXREC1\n'
+#   HEADER_LENGTH    u32 LE    length of the JSON header
+#   HEADER           JSON      {"columns": [[name, struct format], ...],
+#                               "record_format": "<...", "record_size": n,
+#                               "created": unix time}
+#   RECORDS          record_size bytes each, little-endian, no padding
+#
+# Missing numeric values are stored as NaN, missing text as empty bytes. A
+# record cut short by a power loss is ignored when reading. A whole flight can
+# be loaded with read_recording() or, with numpy, with
+#     numpy.fromfile(path, dtype=numpy_dtype(header), offset=data_offset)
+import os
+import time
+import json
+import math
+import struct
+import logging
+import itertools
+
+MAGIC = b'UAXREC1\n'
+_LENGTH = struct.Struct('<I')
+
+class FlightRecorder:
+    """
+    Writes rows (dicts keyed by column name) to .rec files in `folder`.
+
+    Rows are packed into fixed-size records and buffered; the buffer is written
+    with a single write() every `chunk_rows` rows, and the file is fsync'd at
+    most once every `fsync_interval` seconds. A new file is started when the
+    current one reaches `max_bytes` or is `max_age` seconds old.
+
+    Parameters:
+    - folder: Folder for the recordings; created if it doesn't exist (string).
+    - columns: Sequence of (name, struct format) pairs; numeric formats
+      ('f', 'd', 'i'...) or 'Ns' for fixed-length text (list).
+    - prefix: Start of the file names, followed by the start time (string).
+    - chunk_rows: Rows buffered before each write (int).
+    - max_bytes: Size that triggers a new file (int).
+    - max_age: Seconds after which a new file is started (float).
+    - fsync_interval: Minimum seconds between fsyncs; 0 fsyncs every chunk (float).
+    """
+
+    def __init__(self, folder, columns, prefix='data', chunk_rows=50, max_bytes=64 * 1024 * 1024,
+                 max_age=3600, fsync_interval=10):
+        self.folder = folder
+        self.columns = tuple(columns)
+        self.names = tuple(name for name, _ in self.columns)
+        self.record = struct.Struct('<' + ''.join(fmt for _, fmt in self.columns))
+        self.text = {name for name, fmt in self.columns if fmt.endswith('s')}
+        # Value recorded when a column is missing from a row
+        self.missing = {name: b'' if name in self.text else math.nan if fmt in ('f', 'd', 'e') else 0
+                        for name, fmt in self.columns}
+        self.prefix = prefix
+        self.chunk_rows = chunk_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync_interval = fsync_interval
+
+        self.buffer = []
+        self.file = None
+        self.path = None
+        os.makedirs(folder, exist_ok=True)
+
+    def _open(self):
+        """Starts a new recording file and writes its header."""
+        # Never append to an existing recording: a second header in the middle
+        # of a file breaks the record stream. Names only have one-second
+        # resolution, so a counter is added when the name is taken
+        base = os.path.join(self.folder, time.strftime(f"{self.prefix}_%Y%m%d_%H%M%S"))
+        for attempt in itertools.count():
+            self.path = f"{base}.rec" if attempt == 0 else f"{base}_{attempt}.rec"
+            try:
+                self.file = open(self.path, 'xb', buffering=0)
+                break
+            except FileExistsError:
+                continue
+        header = json.dumps({
+            'columns': [list(column) for column in self.columns],
+            'record_format': self.record.format,
+            'record_size': self.record.size,
+            'created': time.time(),
+        }).encode('utf-8')
+        self.file.write(MAGIC + _LENGTH.pack(len(header)) + header)
+        self.size = len(MAGIC) + _LENGTH.size + len(header)
+        self.opened = time.monotonic()
+        self.last_sync = self.opened
+        logging.info(f"Recording to {self.path}")
+
+    def add(self, row):
+        """Buffers one row; missing columns are recorded as NaN, 0 or empty text."""
+        values = []
+        for name in self.names:
+            value = row.get(name)
+            if value is None:
+                value = self.missing[name]
+            elif name in self.text:
+                value = value.encode('utf-8', 'replace')
+            values.append(value)
+        try:
+            self.buffer.append(self.record.pack(*values))
+        except struct.error as e:
+            logging.error(f"Row not recorded, bad value: {e}")
+            return
+        if len(self.buffer) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self, sync=False):
+        """Writes the buffered records; fsyncs if due or if `sync` is True."""
+        if not self.buffer:
+            return
+        if self.file is None:
+            self._open()
+
+        chunk = b''.join(self.buffer)
+        self.buffer = []
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+        now = time.monotonic()
+        if sync or now - self.last_sync >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self.last_sync = now
+
+        if self.size >= self.max_bytes or now - self.opened >= self.max_age:
+            self._close_file()
+
+    def _close_file(self):
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        logging.info(f"Recording {self.path} closed ({self.size} bytes).")
+
+    def close(self):
+        """Writes pending records and closes the current file."""
+        self.flush(sync=True)
+        if self.file is not None:
+            self._close_file()
+
+def read_header(file):
+    """Reads the header of an open .rec file. Returns (header, data_offset)."""
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a flight recording")
+    (length,) = _LENGTH.unpack(file.read(_LENGTH.size))
+    header = json.loads(file.read(length))
+    return header, len(MAGIC) + _LENGTH.size + length
+
+def read_recording(path):
+    """
+    Loads a whole .rec file. Returns (column names, list of record tuples);
+    text columns are returned as str and NaN values as None.
+    """
+    with open(path, 'rb') as file:
+        header, _ = read_header(file)
+        data = file.read()
+    record = struct.Struct(header['record_format'])
+    names = [name for name, _ in header['columns']]
+    text = [i for i, (_, fmt) in enumerate(header['columns']) if fmt.endswith('s')]
+
+    usable = len(data) - len(data) % record.size   # Drop a truncated last record
+    rows = []
+    for values in record.iter_unpack(memoryview(data)[:usable]):
+        values = [None if isinstance(v, float) and math.isnan(v) else v for v in values]
+        for i in text:
+            values[i] = values[i].rstrip(b'\0').decode('utf-8', 'replace')
+        rows.append(tuple(values))
+    return names, rows
+
+def numpy_dtype(header):
+    """numpy dtype matching the records described by `header`."""
+    return [(name, '<' + (f"S{fmt[:-1]}" if fmt.endswith('s') else fmt)) for name, fmt in header['columns']]
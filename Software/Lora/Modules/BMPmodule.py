@@ -10,12 +10,12 @@
 
 # BMPmodule.py
 import time
-import board
 import adafruit_bmp3xx
+from Modules.I2Cbusmodule import get_i2c, PRIORITY_BMP
 
 # Funci  n para inicializar el sensor BMP
 def initialize_sensor():
-    i2c = board.I2C()
+    i2c = get_i2c(PRIORITY_BMP)    # Bus compartido con el IMU y el sensor UV
     bmp = adafruit_bmp3xx.BMP3XX_I2C(i2c)
     
     bmp.pressure_oversampling = 8
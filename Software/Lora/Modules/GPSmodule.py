@@ -9,10 +9,22 @@
 * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
 
 # GPSmodule.py
+#
+# La conexión con el GPS se abre una sola vez y se reutiliza en cada llamada a
+# get_GPS_data(). El puerto se guarda por su ruta estable de /dev/serial/by-id,
+# así que para reconectar basta con volver a abrirlo sin enumerar los puertos.
+import os
 import serial
 from serial.tools import list_ports
 from ublox_gps import UbloxGps
 
+BY_ID_DIR = '/dev/serial/by-id'
+
+# Conexión abierta con el GPS
+_gps = None
+_serial_port = None
+_port_path = None
+
 def find_gps_port(description=None, hwid=None):
     ports = list_ports.comports()
     for port in ports:
@@ -22,43 +34,70 @@ def find_gps_port(description=None, hwid=None):
             return port.device
     raise Exception("GPS port not found")
 
+def stable_path(device):
+    """ Devuelve el enlace de /dev/serial/by-id del dispositivo, o el propio dispositivo """
+    try:
+        target = os.path.realpath(device)
+        for name in os.listdir(BY_ID_DIR):
+            link = os.path.join(BY_ID_DIR, name)
+            if os.path.realpath(link) == target:
+                return link
+    except OSError:
+        pass
+    return device
+
 def initialize_gps(port, baudrate, timeout):
     serial_port = serial.Serial(port, baudrate=baudrate, timeout=timeout)
     gps = UbloxGps(serial_port)
     return gps, serial_port
 
+def close_gps():
+    """ Cierra la conexión con el GPS (se vuelve a abrir en la siguiente lectura) """
+    global _gps, _serial_port
+    if _gps is not None:
+        _gps.stop()
+    if _serial_port is not None:
+        _serial_port.close()
+    _gps = _serial_port = None
+
 def get_GPS_data(baudrate=38400, timeout=1, hwid="1546:01A9", description=None):
     """
-    Esta función inicializa el GPS, extrae los datos y los devuelve en forma de tupla.
+    Esta función lee los datos del GPS y los devuelve en forma de tupla.
     """
+    global _gps, _serial_port, _port_path
     try:
-        # Encontrar el puerto del GPS
-        port = find_gps_port(description, hwid)
-
-        # Inicializar el GPS
-        gps, serial_port = initialize_gps(port, baudrate, timeout)
+        if _gps is None:
+            # Solo se buscan los puertos si la ruta guardada ya no existe
+            if not (_port_path and os.path.exists(_port_path)):
+                _port_path = stable_path(find_gps_port(description, hwid))
+            _gps, _serial_port = initialize_gps(_port_path, baudrate, timeout)
 
-        # Obtener datos GPS
-        geo = gps.geo_coords()
-        veh = gps.veh_attitude()
-        stream_nmea = gps.stream_nmea()
-        hp_geo = gps.hp_geo_coords()
+        # Obtener datos GPS (None si el GPS no ha respondido a alguna petición)
+        geo = _gps.geo_coords()
+        veh = _gps.veh_attitude()
+        stream_nmea = _gps.stream_nmea(wait_for_nmea=False)
+        hp_geo = _gps.hp_geo_coords()
 
         # Devuelve los datos como una tupla
         return (
-            geo.lat,                # Latitude
-            geo.lon,                # Longitude
-            geo.height / 1000,      # Altitude
-            geo.headMot,            # Heading of Motion
-            veh.roll,               # Roll
-            veh.pitch,              # Pitch
-            veh.heading,            # Heading
-            stream_nmea,            # NMEA Sentence
-            hp_geo.latHp,           # High Precision Latitude
-            hp_geo.lonHp,           # High Precision Longitude
-            hp_geo.heightHp / 1000  # High Precision Altitude
+            geo.lat if geo else None,                       # Latitude
+            geo.lon if geo else None,                       # Longitude
+            geo.height / 1000 if geo else None,             # Altitude
+            geo.headMot if geo else None,                   # Heading of Motion
+            veh.roll if veh else None,                      # Roll
+            veh.pitch if veh else None,                     # Pitch
+            veh.heading if veh else None,                   # Heading
+            stream_nmea,                                    # NMEA Sentence
+            hp_geo.latHp if hp_geo else None,               # High Precision Latitude
+            hp_geo.lonHp if hp_geo else None,               # High Precision Longitude
+            hp_geo.heightHp / 1000 if hp_geo else None      # High Precision Altitude
         )
 
+    except (serial.SerialException, OSError) as e:
+        # Puerto perdido: cerrarlo para no dejar descriptores abiertos y reconectar en la siguiente llamada
+        close_gps()
+        return (None, None, None, None, None, None, None, None, None, None, None, f"Error: {str(e)}")
+
     except Exception as e:
         # En caso de error, devuelve una tupla con None y el mensaje de error
         return (None, None, None, None, None, None, None, None, None, None, None, f"Error: {str(e)}")
@@ -10,12 +10,29 @@
 
 # IMUmodule.py
 import time
-import board
+import math
+import struct
 import adafruit_icm20x
+from Modules.I2Cbusmodule import get_i2c, write_message, read_message, PRIORITY_IMU
+
+_REG_BANK_SEL = 0x7F
+_ACCEL_XOUT_H = 0x2D
+
+# Bloque contiguo leído en una transacción: ACCEL_XOUT..GYRO_ZOUT y TEMP_OUT (big
+# endian) seguidos de EXT_SLV_SENS_DATA_00..05, el magnetómetro (little endian)
+_ACCEL_GYRO_TEMP = struct.Struct('>7h')
+_MAG_DATA = struct.Struct('<3h')
+_DATA_BLOCK_SIZE = _ACCEL_GYRO_TEMP.size + _MAG_DATA.size
+
+IMU_KEYS = ("ACELX", "ACELY", "ACELZ", "GIROX", "GIROY", "GIROZ", "MAGX", "MAGY", "MAGZ")
+
+_MAG_UT_PER_LSB = 0.15
+_RAD_PER_DEG = math.pi / 180
 
 # Funci  n para inicializar el sensor ICM
 def initialize_sensor():
-    i2c = board.I2C()  # Utiliza board.SCL y board.SDA por defecto
+    # Bus compartido con prioridad máxima: la FIFO se vacía antes que las lecturas del BMP o del UV
+    i2c = get_i2c(PRIORITY_IMU)
     icm = adafruit_icm20x.ICM20948(i2c)
     return icm
 
@@ -31,19 +48,81 @@ def read_gyro(icm):
 def read_magnetic(icm):
     return icm.magnetic
 
+# Factores de conversión de las cuentas en bruto a m/s^2, rad/s y uT
+def scale_factors(icm):
+    accel = adafruit_icm20x.G_TO_ACCEL / adafruit_icm20x.AccelRange.lsb[icm.accelerometer_range]
+    gyro = _RAD_PER_DEG / adafruit_icm20x.GyroRange.lsb[icm.gyro_range]
+    return accel, gyro, _MAG_UT_PER_LSB
+
+class IMUReader:
+    """
+    Lectura rápida del ICM20948: acelerómetro, giroscopio, temperatura y
+    magnetómetro están en registros contiguos (ACCEL_XOUT_H..EXT_SLV_SENS_DATA_05),
+    así que se leen en una sola transferencia I2C a un buffer reutilizable y se
+    convierten con factores de escala precalculados.
+
+    Si se cambia el rango del acelerómetro o del giroscopio hay que llamar a
+    refresh_scales().
+    """
+
+    def __init__(self, icm):
+        self.icm = icm
+        self.bank_buffer = bytes((_REG_BANK_SEL, 0))
+        self.obuffer = bytes((_ACCEL_XOUT_H,))
+        self.ibuffer = bytearray(_DATA_BLOCK_SIZE)
+        # Selección del banco, registro inicial y lectura del bloque en un solo
+        # ioctl I2C_RDWR, preparado una vez (adafruit_icm20x puede haber dejado
+        # seleccionado otro banco)
+        self.i2c = icm.i2c_device.i2c
+        address = icm.i2c_device.device_address
+        self.transaction = self.i2c.prepare([write_message(address, self.bank_buffer),
+                                             write_message(address, self.obuffer),
+                                             read_message(address, self.ibuffer)])
+        self.refresh_scales()
+
+    def refresh_scales(self):
+        self.accel_scale, self.gyro_scale, self.mag_scale = scale_factors(self.icm)
+
+    def read(self):
+        """ Devuelve (ax, ay, az, gx, gy, gz, mx, my, mz) en m/s^2, rad/s y uT """
+        self.i2c.run(self.transaction)
+        ax, ay, az, gx, gy, gz, _ = _ACCEL_GYRO_TEMP.unpack_from(self.ibuffer)
+        mx, my, mz = _MAG_DATA.unpack_from(self.ibuffer, _ACCEL_GYRO_TEMP.size)
+        a, g, m = self.accel_scale, self.gyro_scale, self.mag_scale
+        return (ax * a, ay * a, az * a, gx * g, gy * g, gz * g, mx * m, my * m, mz * m)
+
+# Función para inicializar el lector rápido (una transacción I2C por muestra)
+def initialize_reader():
+    return IMUReader(initialize_sensor())
+
+# Devuelve los 9 valores como tupla (mismo orden que IMU_KEYS) o None si hay error
+def read_sensor_values(reader):
+    try:
+        return reader.read()
+    except Exception as e:
+        print(f"Error reading the IMU: {e}")
+        return None
+
+# Acepta el sensor (ICM20948) o un IMUReader; devuelve un diccionario con IMU_KEYS
 def read_sensor_data(icm):
     try:
-        acceleration, gyro, magnetic = read_acceleration(icm), read_gyro(icm), read_magnetic(icm)
-        data = {
-            "ACELX": acceleration[0], "ACELY": acceleration[1], "ACELZ": acceleration[2],
-            "GIROX": gyro[0], "GIROY": gyro[1], "GIROZ": gyro[2],
-            "MAGX": magnetic[0], "MAGY": magnetic[1], "MAGZ": magnetic[2]
-        }
-        return data
+        reader = icm if isinstance(icm, IMUReader) else IMUReader(icm)
+        return dict(zip(IMU_KEYS, reader.read()))
     except Exception as e:
         print(f"Error reading the IMU: {e}")
         return None
 
+# Lector creado una vez: inicializar el ICM20948 en cada llamada lo reinicia y
+# lo configura de nuevo. Solo se vuelve a crear tras un error de I2C (OSError)
+_imu_reader = None
+
 def get_IMU_data():
-    imu = initialize_sensor()
-    return read_sensor_data(imu)
\ No newline at end of file
+    global _imu_reader
+    try:
+        if _imu_reader is None:
+            _imu_reader = initialize_reader()
+        return dict(zip(IMU_KEYS, _imu_reader.read()))
+    except OSError as e:
+        print(f"Error reading the IMU: {e}")
+        _imu_reader = None
+        return None
@@ -9,27 +9,161 @@
 * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
 
 # SYSTEMmodule
-import psutil
+#
+# Métricas del sistema leídas en segundo plano. SystemSampler lee /proc/stat,
+# /proc/meminfo, statvfs y la zona térmica a su propio ritmo (los ficheros se
+# abren una vez y se vuelven a leer con pread) y guarda una foto de los
+# valores. El uso de CPU es la diferencia entre dos muestras, sin esperar el
+# segundo de psutil.cpu_percent(interval=1). get_system_data() devuelve la
+# última foto sin esperar.
+import os
+import time
+import threading
+
+PROC_STAT = '/proc/stat'
+PROC_MEMINFO = '/proc/meminfo'
+THERMAL_ZONE = '/sys/class/thermal/thermal_zone0/temp'
+READ_SIZE = 4096
+
+class SystemSampler:
+    """
+    Muestrea las métricas del sistema cada `interval` segundos en un hilo.
+
+    Parámetros:
+    - interval: Segundos entre muestras.
+    - disk_path: Punto de montaje del que se mide el disco.
+    - thermal_zone: Fichero de temperatura (miligrados); None si no hay.
+    """
+
+    def __init__(self, interval=1.0, disk_path='/', thermal_zone=THERMAL_ZONE):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.stat_fd = os.open(PROC_STAT, os.O_RDONLY)
+        self.meminfo_fd = os.open(PROC_MEMINFO, os.O_RDONLY)
+        try:
+            self.thermal_fd = os.open(thermal_zone, os.O_RDONLY) if thermal_zone else None
+        except OSError:
+            self.thermal_fd = None
+        self.last_cpu = None
+        self.read_cpu()     # Contadores desde el arranque: el primer uso se mide desde aquí
+        self.snapshot = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def read_cpu(self):
+        """
+        Porcentaje de uso de CPU desde la muestra anterior. None hasta que ha
+        pasado medio intervalo desde la primera lectura de los contadores: en
+        menos tiempo hay muy pocos ticks de reloj.
+        """
+        line = os.pread(self.stat_fd, 256, 0).split(b'\n', 1)[0]
+        # cpu user nice system idle iowait irq softirq steal (guest ya está incluido en user)
+        times = [int(value) for value in line.split()[1:9]]
+        idle = times[3] + times[4]
+        total = sum(times)
+        now = time.monotonic()
+        previous = self.last_cpu
+        if previous is None:
+            self.last_cpu = (idle, total, now)
+            return None
+        if now - previous[2] < self.interval / 2:
+            return None
+        self.last_cpu = (idle, total, now)
+        idle -= previous[0]
+        total -= previous[1]
+        return 100.0 * (total - idle) / total if total > 0 else None
+
+    def read_memory(self):
+        """ (usada, total) en bytes; usada = total - disponible """
+        data = os.pread(self.meminfo_fd, READ_SIZE, 0)
+        total = _meminfo_value(data, b'MemTotal:')
+        available = _meminfo_value(data, b'MemAvailable:')
+        return (total - available) * 1024, total * 1024
+
+    def read_disk(self):
+        """ (usado, total, porcentaje) del disco, como psutil.disk_usage() """
+        stat = os.statvfs(self.disk_path)
+        total = stat.f_blocks * stat.f_frsize
+        used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+        available = stat.f_bavail * stat.f_frsize
+        return used, total, 100.0 * used / (used + available) if used + available else 0.0
+
+    def read_temperature(self):
+        if self.thermal_fd is None:
+            return None
+        return int(os.pread(self.thermal_fd, 16, 0)) / 1000.0
+
+    def sample(self):
+        """ Toma una muestra de todas las métricas y actualiza la foto """
+        cpu = self.read_cpu()
+        ram_used, ram_total = self.read_memory()
+        disk_used, disk_total, disk_percent = self.read_disk()
+        try:
+            temperature = self.read_temperature()
+        except (OSError, ValueError):
+            temperature = None
+        snapshot = {
+            "CPU Usage (%)": cpu,
+            "RAM Usage (MB)": ram_used / (1024 ** 2),
+            "Total RAM (MB)": ram_total / (1024 ** 2),
+            "RAM Usage (%)": 100.0 * ram_used / ram_total if ram_total else None,
+            "Disk Usage (%)": disk_percent,
+            "Disk Usage (GB)": disk_used / (1024 ** 3),
+            "Total Disk (GB)": disk_total / (1024 ** 3),
+            "Temperature (°C)": temperature,
+            "Time": time.time(),
+        }
+        with self.lock:
+            self.snapshot = snapshot
+        return snapshot
+
+    def start(self):
+        """ Toma una primera muestra y sigue muestreando en segundo plano """
+        if self.thread is not None:
+            return
+        self.sample()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='SystemSampler', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except (OSError, ValueError) as e:
+                print(f"Error sampling system metrics: {e}")
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+        for fd in (self.stat_fd, self.meminfo_fd, self.thermal_fd):
+            if fd is not None:
+                os.close(fd)
+        self.stat_fd = self.meminfo_fd = self.thermal_fd = None
+
+    def get(self):
+        """ Devuelve la última foto de las métricas (sin esperar) """
+        with self.lock:
+            return dict(self.snapshot)
+
+def _meminfo_value(data, key):
+    """ Valor en kB de la línea `key` de /proc/meminfo """
+    start = data.index(key) + len(key)
+    return int(data[start:data.index(b'\n', start)].split()[0])
+
+# Muestreador compartido; se arranca en la primera llamada
+_sampler = None
 
 def get_system_data():
     """Recoge estadísticas del sistema de la Raspberry Pi."""
-    # Obtener las estadísticas del sistema
-    system_stats = {
-        "CPU Usage (%)": psutil.cpu_percent(interval=1),
-        "RAM Usage (MB)": psutil.virtual_memory().used / (1024 ** 2),
-        "Total RAM (MB)": psutil.virtual_memory().total / (1024 ** 2),
-        "Disk Usage (%)": psutil.disk_usage('/').percent,
-        "Disk Usage (GB)": psutil.disk_usage('/').used / (1024 ** 3),
-        "Total Disk (GB)": psutil.disk_usage('/').total / (1024 ** 3),
-    }
-    
-    # Obtener información de la temperatura del sistema
-    temp_sensors = psutil.sensors_temperatures()
-    if 'cpu_thermal' in temp_sensors:
-        # Acceder a la primera temperatura en la lista de sensores
-        cpu_temp = temp_sensors['cpu_thermal'][0].current
-        system_stats["Temperature (°C)"] = cpu_temp
-    else:
-        system_stats["Temperature (°C)"] = "N/A"  # No disponible si no hay datos
-
-    return system_stats
+    global _sampler
+    if _sampler is None:
+        _sampler = SystemSampler()
+        _sampler.start()
+    return _sampler.get()
@@ -10,7 +10,8 @@
 
 # e220.py
 import serial
-import time
+import queue
+import threading
 from gpiozero import DigitalOutputDevice, DigitalInputDevice
 
 # CONSTANTS
@@ -33,12 +34,23 @@ VID_PID_LIST = [
 # UART and other configurations
 UART_BAUDRATE = 9600
 
+# Tiempo máximo de espera a que AUX se active (s)
+AUX_TIMEOUT = 5
+
+class E220Timeout(Exception):
+    """ El pin AUX no se ha activado antes del tiempo límite """
+    pass
+
 class E220:
-    def __init__(self, m0_pin, m1_pin, aux_pin, uart_port):
+    def __init__(self, m0_pin, m1_pin, aux_pin, uart_port, aux_timeout=AUX_TIMEOUT):
         self.m0 = DigitalOutputDevice(m0_pin)
         self.m1 = DigitalOutputDevice(m1_pin)
         self.aux = DigitalInputDevice(aux_pin)
+        self.aux_timeout = aux_timeout
         self.uart = serial.Serial(uart_port, baudrate=UART_BAUDRATE, timeout=3)
+        self.lock = threading.RLock()  # Un solo envío o cambio de modo a la vez
+        self.reader = None
+        self.received = None
         
         # Establecer el modo inicial a normal
         self.set_mode(MODE_NORMAL)
@@ -48,20 +60,30 @@ class E220:
 
     def set_mode(self, mode):
         """ Establece el modo del módulo E220 """
-        self.m0.value = mode[0]
-        self.m1.value = mode[1]
-        self.wait_for_aux()  # Asegúrate de que el módulo esté listo
+        with self.lock:
+            self.m0.value = mode[0]
+            self.m1.value = mode[1]
+            self.wait_for_aux()  # Asegúrate de que el módulo esté listo
 
-    def wait_for_aux(self):
-        """ Espera a que el pin AUX esté alto """
-        while not self.aux.value:
-            print("Esperando que el pin AUX esté alto...")
-            time.sleep(0.1)  # Reduce el uso de CPU
+    def wait_for_aux(self, timeout=None):
+        """
+        Espera a que el pin AUX esté alto. La espera la despierta el flanco de
+        AUX (gpiozero), sin sondeo. Lanza E220Timeout si no se activa antes de
+        `timeout` segundos (por defecto, aux_timeout).
+        """
+        if timeout is None:
+            timeout = self.aux_timeout
+        if not self.aux.wait_for_active(timeout):
+            raise E220Timeout(f"El pin AUX no se ha activado en {timeout} s")
 
     def send_data(self, data):
-        """ Envía datos a través del puerto UART """
-        self.uart.write(data.encode('utf-8'))
-        self.wait_for_aux()  # Esperar hasta que AUX esté listo para el siguiente comando
+        """ Envía datos (str o bytes) a través del puerto UART """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.lock:
+            self.uart.write(data)
+            self.uart.flush()  # Esperar a que los bytes salgan del UART
+            self.wait_for_aux()  # Esperar hasta que AUX esté listo para el siguiente comando
 
     def receive_data(self):
         """ Recibe datos del puerto UART """
@@ -69,6 +91,62 @@ class E220:
             data = self.uart.read(self.uart.in_waiting).decode('utf-8')
             return data
 
+    def receive_bytes(self):
+        """ Recibe los bytes pendientes del puerto UART, sin decodificar """
+        if self.uart.in_waiting > 0:
+            return self.uart.read(self.uart.in_waiting)
+        return b''
+
+    def start_receiver(self, callback=None):
+        """
+        Lanza un hilo que recibe datos del UART en cuanto llegan.
+
+        El hilo queda bloqueado en serial.read() (sin consumir CPU) hasta que
+        llega un byte y entonces lee todo lo pendiente. Cada bloque de bytes se
+        pasa a `callback(data)` o, si no hay callback, se deja en una cola que
+        se consume con received_chunks().
+        """
+        if self.reader is not None:
+            return
+        self.received = queue.Queue()
+        self.callback = callback if callback is not None else self.received.put
+        self.uart.timeout = None  # Lectura bloqueante: el hilo duerme hasta que llegan datos
+        self.reader = threading.Thread(target=self._reader_loop, name="e220-reader", daemon=True)
+        self.reader.start()
+
+    def _reader_loop(self):
+        while self.reader is not None:
+            try:
+                data = self.uart.read(1)
+                waiting = self.uart.in_waiting
+                if waiting:
+                    data += self.uart.read(waiting)
+            except (serial.SerialException, OSError, TypeError) as e:
+                if self.reader is not None:
+                    print(f"Error al leer del UART: {e}")
+                break
+            if data:
+                self.callback(data)
+        self.received.put(None)  # Avisar a received_chunks() de que se ha parado
+
+    def received_chunks(self):
+        """ Generador que devuelve los bloques de bytes recibidos según llegan """
+        self.start_receiver()
+        while True:
+            data = self.received.get()
+            if data is None:
+                return
+            yield data
+
+    def stop_receiver(self):
+        """ Detiene el hilo lector """
+        reader, self.reader = self.reader, None
+        if reader is None:
+            return
+        self.uart.cancel_read()  # Desbloquea el serial.read() del hilo
+        reader.join(timeout=1)
+        self.uart.timeout = 3
+
     def sleep(self):
         """ Pone el módulo en modo de sueño """
         self.set_mode(MODE_SLEEP)
@@ -79,4 +157,5 @@ class E220:
 
     def close(self):
         """ Cierra el puerto UART """
+        self.stop_receiver()
         self.uart.close()
@@ -9,17 +9,31 @@
 * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
 
 # emiter.py
-import json
+import os
 import time
+import threading
 from serial.tools import list_ports
-from e220 import E220, MODE_NORMAL, AUX, M0, M1, VID_PID_LIST
+from e220 import E220, E220Timeout, MODE_NORMAL, AUX, M0, M1, VID_PID_LIST
+from telemetry import (TelemetryEncoder, FrameError, sensor_data_to_row, encode_frame,
+                       decode_frame, pack_frame)
+from spool import FrameSpool
 
 from Modules.IMUmodule import get_IMU_data
 from Modules.UVmodule import get_UV_data
 from Modules.BMPmodule import get_BMP_data
 from Modules.DS18B20module import get_DS18B20_data
 from Modules.GPSmodule import get_GPS_data
-from Modules.SYSTEMmodule import get_system_data
+from Modules.Systemmodule import get_system_data
+
+# Cada cuántas tramas se envía un keyframe completo (entre medias, solo deltas)
+KEYFRAME_INTERVAL = 10
+
+# Cola en disco entre la adquisición y el envío: si el enlace se cae, las tramas
+# se guardan aquí y se reenvían (las más antiguas) cuando vuelve
+SPOOL_PATH = os.path.expanduser('~/telemetry.spool')
+SPOOL_CAPACITY = 4096       # Tramas (~1 MB)
+ACQUISITION_INTERVAL = 1    # Segundos entre lecturas de los sensores
+RETRY_DELAY = 1             # Segundos de espera tras un envío fallido
 
 def find_serial_port(vendor_id, product_id):
     """Encuentra y devuelve el puerto serial para un dispositivo con el VID y PID dados."""
@@ -43,6 +57,40 @@ def get_all_sensor_data():
 
     return sensor_data
 
+def transmit_loop(lora_module, spool, stop_event):
+    """
+    Vacía la cola de tramas al ritmo del enlace. Primero la trama más reciente
+    (vista en directo) y, cuando no hay nada nuevo, las antiguas pendientes. Una
+    trama solo se da por enviada cuando el módulo la ha aceptado.
+    """
+    encoder = TelemetryEncoder(KEYFRAME_INTERVAL)
+    while not stop_event.is_set():
+        item = spool.next_frame(timeout=1)
+        if item is None:
+            continue
+        seq, payload = item
+
+        try:
+            _, row = decode_frame(payload)
+        except FrameError as e:
+            print(f"Trama {seq} corrupta en la cola, descartada: {e}")
+            spool.ack(seq)
+            continue
+
+        # Codificar como keyframe o delta (ver telemetry.py)
+        frame = pack_frame(encoder.encode(row))
+        try:
+            lora_module.send_data(frame)
+        except (E220Timeout, OSError) as e:
+            print(f"Error al enviar la trama {seq}, se reintentará: {e}")
+            # El receptor puede haber perdido el keyframe: empezar con uno nuevo
+            encoder = TelemetryEncoder(KEYFRAME_INTERVAL)
+            stop_event.wait(RETRY_DELAY)
+            continue
+
+        spool.ack(seq)
+        print(f"Trama {seq} enviada a tierra ({len(frame)} bytes, {len(spool)} pendientes).")
+
 def main():
     # Encontrar el puerto serial del módulo E220
     uart_port = None
@@ -64,28 +112,38 @@ def main():
         lora_module.set_mode(MODE_NORMAL)
         print("Módulo en modo de operación normal.")
 
-        while True:  # Bucle infinito para enviar mensajes
-            # Obtener todos los datos de los sensores
-            all_sensor_data = get_all_sensor_data()
+        spool = FrameSpool(SPOOL_PATH, SPOOL_CAPACITY)
+        print(f"Cola en disco {SPOOL_PATH}: {len(spool)} tramas pendientes.")
 
-            # Convertir los datos en formato JSON
-            all_sensor_data_json = json.dumps(all_sensor_data)
+        stop_event = threading.Event()
+        transmitter = threading.Thread(target=transmit_loop, args=(lora_module, spool, stop_event),
+                                       name="lora-transmitter", daemon=True)
+        transmitter.start()
 
-            # Imprimir los datos en formato JSON
-            print(f"{all_sensor_data_json}")
+        next_time = time.monotonic()
+        while True:  # Bucle infinito de adquisición
+            # Obtener todos los datos de los sensores
+            all_sensor_data = get_all_sensor_data()
+            print(f"{all_sensor_data}")
 
-            # Enviar los datos por LoRa
-            lora_module.send_data(all_sensor_data_json)
-            print("Datos enviados a tierra correctamente.")
+            # Guardar la trama completa en la cola; el transmisor la envía cuando
+            # el enlace lo permita
+            spool.put(encode_frame(sensor_data_to_row(all_sensor_data), 0))
 
-            # Pausa entre lecturas para evitar saturar la CPU
-            time.sleep(5)
+            # Mantener el ritmo de adquisición sin depender del de la radio
+            next_time = max(next_time + ACQUISITION_INTERVAL, time.monotonic())
+            time.sleep(max(0, next_time - time.monotonic()))
 
     except KeyboardInterrupt:
         print("KeyboardInterrupt: Saliendo del programa.")
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
+        if 'transmitter' in locals():
+            stop_event.set()
+            transmitter.join()
+        if 'spool' in locals():
+            spool.close()
         # Asegurarse de que el puerto serial se cierre correctamente
         if 'lora_module' in locals():
             lora_module.close()
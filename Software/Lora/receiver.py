@@ -1,9 +1,15 @@
 import time
 import json
 import logging
-import psycopg2
+import sys
+from datetime import datetime
 from serial.tools import list_ports
 from e220 import E220, MODE_NORMAL, AUX, M0, M1, VID_PID_LIST
+from telemetry import (FrameError, FrameParser, MissingKeyframe, TelemetryDecoder,
+                       LINK_BINARY, sensor_data_to_row)
+
+sys.path.append('../../')  # Permite importar módulos de la carpeta Communications
+from Communications.DBwriter import BatchedWriter
 
 # Configuración del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,92 +23,40 @@ def find_serial_port(vendor_id, product_id):
             return port.device
     return None
 
-def insert_data_to_db(data):
-    """Inserta los datos en la base de datos PostgreSQL"""
-    connection = None
-    cursor = None
+# Configuración de la base de datos
+DB_CONFIG = {
+    'database': "sensor_data",
+    'user': "cubesat",
+    'password': "cubesat",
+    'host': "localhost",
+    'port': "5432",
+}
+
+DB_COLUMNS = (
+    'acelx', 'acely', 'acelz', 'girox', 'giroy', 'giroz', 'magx', 'magy', 'magz',
+    'uva', 'uvb', 'uvc', 'uv_temp', 'cpu_usage', 'ram_usage', 'total_ram',
+    'disk_usage', 'disk_usage_gb', 'total_disk_gb', 'temperature',
+    'lat', 'lon', 'alt', 'headmot', 'roll', 'pitch', 'heading', 'nmea',
+    'lat_hp', 'lon_hp', 'alt_hp', 'gps_error', 'pressure', 'bmp_temperature', 'bmp_altitude', 'timestamp',
+)
+
+# Las filas se insertan en lotes de DB_BATCH_ROWS o cada DB_BATCH_DELAY segundos
+DB_BATCH_ROWS = 50
+DB_BATCH_DELAY = 2.0
+
+def build_db_row(row):
+    """Convierte una fila decodificada de una trama en una fila de la tabla sensor_readings"""
+    db_row = {column: row.get(column) for column in DB_COLUMNS}
+    if db_row['timestamp'] is not None:
+        db_row['timestamp'] = datetime.fromtimestamp(db_row['timestamp'])
+    return db_row
+
+def insert_data_to_db(db_writer, row):
+    """Encola los datos para la siguiente inserción por lotes en PostgreSQL"""
     try:
-        connection = psycopg2.connect(
-            database="sensor_data",
-            user="cubesat",
-            password="cubesat",
-            host="localhost",
-            port="5432"
-        )
-        cursor = connection.cursor()
-
-        # Consulta de inserción
-        insert_query = """
-        INSERT INTO sensor_readings (
-            acelx, acely, acelz, girox, giroy, giroz, magx, magy, magz,
-            uva, uvb, uvc, uv_temp, cpu_usage, ram_usage, total_ram,
-            disk_usage, disk_usage_gb, total_disk_gb, temperature,
-            lat, lon, alt, headmot, roll, pitch, heading, nmea,
-            lat_hp, lon_hp, alt_hp, gps_error, pressure, bmp_temperature, bmp_altitude, timestamp
-        ) VALUES (
-            %(acelx)s, %(acely)s, %(acelz)s, %(girox)s, %(giroy)s, %(giroz)s, %(magx)s, %(magy)s, %(magz)s,
-            %(uva)s, %(uvb)s, %(uvc)s, %(uv_temp)s, %(cpu_usage)s, %(ram_usage)s, %(total_ram)s,
-            %(disk_usage)s, %(disk_usage_gb)s, %(total_disk_gb)s, %(temperature)s,
-            %(lat)s, %(lon)s, %(alt)s, %(headmot)s, %(roll)s, %(pitch)s, %(heading)s, %(nmea)s,
-            %(lat_hp)s, %(lon_hp)s, %(alt_hp)s, %(gps_error)s, %(pressure)s, %(bmp_temperature)s, %(bmp_altitude)s, %(timestamp)s
-        )
-        """
-
-        # Preparar los datos para la inserción
-        gps_data = data.get('GPS', [{}])
-        gps_data = gps_data[0] if gps_data else {}
-
-        # Ejecutar la consulta de inserción
-        cursor.execute(insert_query, {
-            'acelx': data.get('IMU', {}).get('ACELX'),
-            'acely': data.get('IMU', {}).get('ACELY'),
-            'acelz': data.get('IMU', {}).get('ACELZ'),
-            'girox': data.get('IMU', {}).get('GIROX'),
-            'giroy': data.get('IMU', {}).get('GIROY'),
-            'giroz': data.get('IMU', {}).get('GIROZ'),
-            'magx': data.get('IMU', {}).get('MAGX'),
-            'magy': data.get('IMU', {}).get('MAGY'),
-            'magz': data.get('IMU', {}).get('MAGZ'),
-            'lat': gps_data.get('latitude', None),
-            'lon': gps_data.get('longitude', None),
-            'alt': gps_data.get('altitude', None),
-            'headmot': gps_data.get('heading_of_motion', None),
-            'roll': gps_data.get('roll', None),
-            'pitch': gps_data.get('pitch', None),
-            'heading': gps_data.get('heading', None),
-            'nmea': gps_data.get('nmea_sentence', None),
-            'lat_hp': gps_data.get('high_precision_latitude', None),
-            'lon_hp': gps_data.get('high_precision_longitude', None),
-            'alt_hp': gps_data.get('high_precision_altitude', None),
-            'gps_error': data.get('GPS', [None])[1] if len(data.get('GPS', [])) > 1 else None,
-            'pressure': data.get('BMP', {}).get('pressure'),
-            'bmp_temperature': data.get('BMP', {}).get('temperature'),
-            'bmp_altitude': data.get('BMP', {}).get('altitude'),
-            'uva': data.get('UV', {}).get('UVA'),
-            'uvb': data.get('UV', {}).get('UVB'),
-            'uvc': data.get('UV', {}).get('UVC'),
-            'uv_temp': data.get('UV', {}).get('UV Temp'),
-            'cpu_usage': data.get('System', {}).get('CPU Usage (%)'),
-            'ram_usage': data.get('System', {}).get('RAM Usage (MB)'),
-            'total_ram': data.get('System', {}).get('Total RAM (MB)'),
-            'disk_usage': data.get('System', {}).get('Disk Usage (%)'),
-            'disk_usage_gb': data.get('System', {}).get('Disk Usage (GB)'),
-            'total_disk_gb': data.get('System', {}).get('Total Disk (GB)'),
-            'temperature': data.get('System', {}).get('Temperature (°C)'),
-            'timestamp': data.get('timestamp')
-        })
-
-        # Confirmar los cambios en la base de datos
-        connection.commit()
-        logger.info("Datos insertados en la base de datos.")
-
-    except (psycopg2.Error, Exception) as error:
-        logger.error(f"Error al insertar en la base de datos: {error}")
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+        db_writer.add(build_db_row(row))
+    except Exception as error:
+        logger.error(f"Error al preparar los datos para la base de datos: {error}")
 
 def main():
     uart_port = None
@@ -118,42 +72,38 @@ def main():
     logger.info(f"Dispositivo encontrado en {uart_port}, inicializando el módulo E220...")
 
     lora_module = None
+    db_writer = None
     try:
+        db_writer = BatchedWriter('sensor_readings', DB_COLUMNS,
+                                  max_rows=DB_BATCH_ROWS, max_delay=DB_BATCH_DELAY, **DB_CONFIG)
         lora_module = E220(m0_pin=M0, m1_pin=M1, aux_pin=AUX, uart_port=uart_port)
         lora_module.set_mode(MODE_NORMAL)
 
         logger.info("Escuchando mensajes entrantes...")
 
-        buffer = ""  # Buffer para almacenar datos recibidos
-
-        while True:
-            received_message = lora_module.receive_data()
-            if received_message:
-                buffer += received_message  # Añadir datos recibidos al buffer
-
-                # Buscar el marcador de inicio y fin en el buffer
-                start_marker = "<<<"
-                end_marker = ">>>"
-
-                start_index = buffer.find(start_marker)
-                end_index = buffer.find(end_marker)
-
-                # Procesar solo si se encuentra un mensaje completo
-                if start_index != -1 and end_index != -1 and end_index > start_index:
-                    complete_message = buffer[start_index + len(start_marker):end_index]
-                    logger.info(f"Mensaje JSON recibido: {complete_message}")
-
-                    try:
-                        data_dict = json.loads(complete_message)
-                        insert_data_to_db(data_dict)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Error al decodificar JSON: {e}")
-                    except Exception as e:
-                        logger.error(f"Error inesperado al procesar el mensaje JSON: {e}")
-
-                    buffer = buffer[end_index + len(end_marker):]
-
-            time.sleep(0.25)
+        parser = FrameParser()        # Separa las tramas del flujo de bytes del UART
+        decoder = TelemetryDecoder()  # Reconstruye las tramas delta a partir del keyframe
+
+        # Los datos se entregan en cuanto llegan al UART; sin datos, el bucle
+        # queda bloqueado sin consumir CPU
+        for received in lora_module.received_chunks():
+            # Procesar todas las tramas completas recibidas (ver telemetry.py)
+            for kind, frame in parser.feed(received):
+                try:
+                    if kind == LINK_BINARY:
+                        seq, row = decoder.decode(frame)
+                        logger.info(f"Trama {seq} recibida ({len(frame)} bytes).")
+                    else:
+                        # Trama JSON '<<<...>>>' de emisores antiguos
+                        logger.info(f"Mensaje JSON recibido: {frame}")
+                        row = sensor_data_to_row(json.loads(frame))
+                    insert_data_to_db(db_writer, row)
+                except MissingKeyframe as e:
+                    logger.warning(f"Trama descartada hasta el siguiente keyframe: {e}")
+                except (FrameError, json.JSONDecodeError) as e:
+                    logger.error(f"Error al decodificar la trama: {e}")
+                except Exception as e:
+                    logger.error(f"Error inesperado al procesar la trama: {e}")
 
     except KeyboardInterrupt:
         logger.info("Recepción interrumpida por el usuario.")
@@ -163,6 +113,9 @@ def main():
         if lora_module:
             lora_module.close()
         logger.info("Puerto serial cerrado.")
+        if db_writer:
+            db_writer.close()
+            logger.info("Conexiones con la base de datos cerradas.")
         time.sleep(1)  # Espera para dar tiempo a que los hilos secundarios se cierren
 
 
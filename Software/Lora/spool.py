@@ -0,0 +1,152 @@
+"""* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+*                                                                            *
+*                         Developed by Javier Bolanos                        *
+*                  https://github.com/javierbolanosllano                     *
+*                                                                            *
+*                      UAXSAT IV Project - 2024                              *
+*                   https://github.com/UAXSat/UAXSat                         *
+*                                                                            *
+* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
+
+# spool.py
+#
+# Cola de tramas en disco (store-and-forward) entre la adquisición y el envío.
+#
+# El fichero es un buffer circular de `capacity` ranuras de SLOT_SIZE bytes. La
+# trama con número de secuencia `seq` se guarda en la ranura seq % capacity, así
+# que cuando la cola está llena se sobrescriben las tramas más antiguas.
+#
+# Ranura:
+#   CRC32 (u32) | SEQ (u32) | ESTADO (u8) | LEN (u8) | PAYLOAD (LEN bytes) | relleno
+#   El CRC32 cubre SEQ, LEN y PAYLOAD. Una ranura con el CRC incorrecto (vacía o
+#   escrita a medias durante un corte de alimentación) se ignora al abrir el
+#   fichero. ESTADO pasa de PENDING a SENT cuando la trama se ha transmitido.
+import os
+import zlib
+import struct
+import threading
+from collections import deque
+
+SLOT_HEADER = struct.Struct('<IIBB')
+MAX_PAYLOAD = 255
+SLOT_SIZE = 264     # SLOT_HEADER + MAX_PAYLOAD redondeado
+
+STATE_PENDING = 0
+STATE_SENT = 1
+_STATE_OFFSET = 8   # Posición de ESTADO dentro de la ranura
+
+class FrameSpool:
+    """
+    Cola acotada y persistente de tramas pendientes de enviar.
+
+    put() guarda una trama a la velocidad de los sensores. El transmisor pide
+    tramas con next_frame(), que alterna entre la más reciente (vista en
+    directo) y la más antigua pendiente (recuperar huecos de cobertura), y las
+    confirma con ack() cuando se han enviado. Las tramas no confirmadas se
+    conservan aunque el programa se reinicie.
+
+    Parámetros:
+    - path: Fichero de la cola (se crea si no existe).
+    - capacity: Número de tramas que caben en la cola.
+    - sync_every: Hacer fsync cada cuántas tramas nuevas (0 = nunca).
+    """
+
+    def __init__(self, path, capacity=4096, sync_every=10):
+        self.capacity = capacity
+        self.sync_every = sync_every
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size != capacity * SLOT_SIZE:
+            os.ftruncate(self.fd, capacity * SLOT_SIZE)
+
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.pending = deque()      # Secuencias pendientes, de la más antigua a la más nueva
+        self.next_seq = 0
+        self.last_live = -1         # Última trama enviada como "en directo"
+        self.unsynced = 0
+        self._recover()
+
+    def _recover(self):
+        """ Reconstruye la lista de tramas pendientes a partir del fichero """
+        data = os.pread(self.fd, self.capacity * SLOT_SIZE, 0)
+        pending = []
+        for offset in range(0, len(data), SLOT_SIZE):
+            crc, seq, state, length = SLOT_HEADER.unpack_from(data, offset)
+            payload = data[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length]
+            if crc != _slot_crc(seq, length, payload) or seq % self.capacity != offset // SLOT_SIZE:
+                continue
+            self.next_seq = max(self.next_seq, seq + 1)
+            if state == STATE_PENDING:
+                pending.append(seq)
+        # Descartar ranuras de vueltas anteriores del buffer circular
+        self.pending = deque(sorted(seq for seq in pending if seq > self.next_seq - 1 - self.capacity))
+        self.last_live = self.next_seq - 1
+
+    def put(self, payload):
+        """ Guarda una trama en la cola. Devuelve su número de secuencia """
+        if len(payload) > MAX_PAYLOAD:
+            raise ValueError(f'payload too large: {len(payload)} bytes')
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            header = SLOT_HEADER.pack(_slot_crc(seq, len(payload), payload), seq & 0xFFFFFFFF,
+                                      STATE_PENDING, len(payload))
+            os.pwrite(self.fd, header + payload, self._offset(seq))
+
+            # La ranura reutilizada contenía la trama más antigua
+            if self.pending and self.pending[0] <= seq - self.capacity:
+                self.pending.popleft()
+            self.pending.append(seq)
+
+            self.unsynced += 1
+            if self.sync_every and self.unsynced >= self.sync_every:
+                os.fsync(self.fd)
+                self.unsynced = 0
+            self.available.notify()
+        return seq
+
+    def next_frame(self, timeout=None):
+        """
+        Devuelve (seq, payload) de la siguiente trama a enviar, o None si no hay
+        ninguna pendiente tras esperar `timeout` segundos. Si hay una trama más
+        nueva que la última enviada en directo se devuelve esa; si no, la más
+        antigua pendiente.
+        """
+        with self.lock:
+            if not self.pending:
+                self.available.wait(timeout)
+                if not self.pending:
+                    return None
+            seq = self.pending[-1]
+            if seq > self.last_live:
+                self.last_live = seq
+            else:
+                seq = self.pending[0]
+            data = os.pread(self.fd, SLOT_SIZE, self._offset(seq))
+        length = data[SLOT_HEADER.size - 1]
+        return seq, data[SLOT_HEADER.size:SLOT_HEADER.size + length]
+
+    def ack(self, seq):
+        """ Marca como enviada la trama `seq` """
+        with self.lock:
+            try:
+                self.pending.remove(seq)
+            except ValueError:
+                return   # Ya confirmada o sobrescrita
+            os.pwrite(self.fd, bytes((STATE_SENT,)), self._offset(seq) + _STATE_OFFSET)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    def _offset(self, seq):
+        return (seq % self.capacity) * SLOT_SIZE
+
+    def close(self):
+        """ Vuelca la cola a disco y cierra el fichero """
+        with self.lock:
+            os.fsync(self.fd)
+            os.close(self.fd)
+
+def _slot_crc(seq, length, payload):
+    return zlib.crc32(payload, zlib.crc32(struct.pack('<IB', seq & 0xFFFFFFFF, length)))
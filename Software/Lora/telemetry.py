@@ -0,0 +1,575 @@
+"""* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+*                                                                            *
+*                         Developed by Javier Bolanos                        *
+*                  https://github.com/javierbolanosllano                     *
+*                                                                            *
+*                      UAXSAT IV Project - 2024                              *
+*                   https://github.com/UAXSat/UAXSat                         *
+*                                                                            *
+* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
+
+# telemetry.py
+#
+# Formato binario de las tramas de telemetría enviadas por el enlace LoRa.
+#
+# Trama en el UART:
+#   SYNC (2 bytes, 0xAA 0x55) | LEN (1 byte) | PAYLOAD (LEN bytes) | CRC16 (2 bytes)
+#   El CRC16-CCITT (little endian) se calcula sobre LEN + PAYLOAD.
+#
+# Payload de una trama completa (FRAME_FULL, keyframe), version 1:
+#   VERSION (u8) | TIPO (u8) | SEQ (u16) | BITMAP DE PRESENCIA | CAMPOS
+#   El bit i del bitmap (LSB primero) indica si el campo i de FIELDS está en la
+#   trama. Los campos presentes van en el orden de FIELDS, en little endian, como
+#   enteros en punto fijo (valor * escala). El campo de texto 'nmea' va al final
+#   como longitud (u8) + ASCII y solo se incluye si cabe en la trama.
+#
+# Payload de una trama delta (FRAME_DELTA):
+#   VERSION (u8) | TIPO (u8) | SEQ (u16) | SEQ DEL KEYFRAME (u16) |
+#   BITMAP DE PRESENCIA | BITMAP DE CAMBIOS | DELTAS
+#   Los valores se expresan respecto al último keyframe (no respecto a la trama
+#   anterior), así que perder una trama delta no afecta a las siguientes. Para
+#   cada campo presente y marcado en el bitmap de cambios se envía la diferencia
+#   con el keyframe como varint zig-zag (o el texto completo si es 'nmea'); los
+#   campos presentes sin cambios toman el valor del keyframe.
+import time
+import struct
+import binascii
+
+FRAME_VERSION = 1
+FRAME_FULL = 0x00
+FRAME_DELTA = 0x01
+
+SYNC = b'\xAA\x55'
+TEXT_START = b'<<<'     # Tramas de texto (JSON) de versiones anteriores del emisor
+TEXT_END = b'>>>'
+
+# Tipos de trama devueltos por FrameParser
+LINK_BINARY = 'binary'
+LINK_TEXT = 'text'
+MAX_FRAME_SIZE = 200                            # Sub-paquete del E220
+MAX_PAYLOAD_SIZE = MAX_FRAME_SIZE - len(SYNC) - 3  # LEN + CRC16
+MAX_NMEA_LENGTH = 82
+
+DALLAS_SLOTS = 4
+
+# (campo, formato struct, escala). El nombre del campo es la columna de la tabla
+# sensor_readings; 's' es texto.
+FIELDS = (
+    ('timestamp',       'I', 1),            # s (epoch)
+    ('acelx',           'h', 100),          # m/s^2
+    ('acely',           'h', 100),
+    ('acelz',           'h', 100),
+    ('girox',           'h', 1000),         # rad/s
+    ('giroy',           'h', 1000),
+    ('giroz',           'h', 1000),
+    ('magx',            'h', 10),           # uT
+    ('magy',            'h', 10),
+    ('magz',            'h', 10),
+    ('uva',             'I', 100),          # uW/cm^2
+    ('uvb',             'I', 100),
+    ('uvc',             'I', 100),
+    ('uv_temp',         'h', 100),          # °C
+    ('pressure',        'I', 100),          # hPa
+    ('bmp_temperature', 'h', 100),          # °C
+    ('bmp_altitude',    'i', 100),          # m
+    ('lat',             'i', 10**7),        # grados
+    ('lon',             'i', 10**7),
+    ('alt',             'i', 1000),         # m
+    ('headmot',         'H', 100),          # grados
+    ('roll',            'h', 100),
+    ('pitch',           'h', 100),
+    ('heading',         'H', 100),
+    ('lat_hp',          'q', 10**9),        # grados
+    ('lon_hp',          'q', 10**9),
+    ('alt_hp',          'i', 10000),        # m
+    ('cpu_usage',       'H', 100),          # %
+    ('ram_usage',       'I', 10),           # MB
+    ('total_ram',       'I', 10),
+    ('disk_usage',      'H', 100),          # %
+    ('disk_usage_gb',   'I', 1000),         # GB
+    ('total_disk_gb',   'I', 1000),
+    ('temperature',     'h', 100),          # °C (CPU)
+) + tuple(
+    (f'dallas_id_{i}', 'Q', 1) for i in range(DALLAS_SLOTS)    # Número de serie 1-Wire
+) + tuple(
+    (f'dallas_temp_{i}', 'h', 100) for i in range(DALLAS_SLOTS)  # °C
+) + (
+    ('nmea',            's', None),
+)
+
+FIELD_NAMES = tuple(name for name, _, _ in FIELDS)
+BITMAP_SIZE = (len(FIELDS) + 7) // 8
+
+_HEADER = struct.Struct('<BBH')
+_KEYSEQ = struct.Struct('<H')
+_LIMITS = {fmt: (-(1 << (8 * struct.calcsize(fmt) - 1)), (1 << (8 * struct.calcsize(fmt) - 1)) - 1)
+           if fmt.islower() else (0, (1 << (8 * struct.calcsize(fmt))) - 1)
+           for fmt in 'hHiIqQ'}
+
+# Claves de los diccionarios de emiter.get_all_sensor_data()
+_IMU_KEYS = ('ACELX', 'ACELY', 'ACELZ', 'GIROX', 'GIROY', 'GIROZ', 'MAGX', 'MAGY', 'MAGZ')
+_UV_KEYS = {'UVA': 'uva', 'UVB': 'uvb', 'UVC': 'uvc', 'UV Temp': 'uv_temp'}
+_BMP_KEYS = {'pressure': 'pressure', 'temperature': 'bmp_temperature', 'altitude': 'bmp_altitude'}
+_GPS_KEYS = ('lat', 'lon', 'alt', 'headmot', 'roll', 'pitch', 'heading', 'nmea',
+             'lat_hp', 'lon_hp', 'alt_hp')
+_SYSTEM_KEYS = {
+    'CPU Usage (%)': 'cpu_usage',
+    'RAM Usage (MB)': 'ram_usage',
+    'Total RAM (MB)': 'total_ram',
+    'Disk Usage (%)': 'disk_usage',
+    'Disk Usage (GB)': 'disk_usage_gb',
+    'Total Disk (GB)': 'total_disk_gb',
+    'Temperature (°C)': 'temperature',
+}
+
+class FrameError(Exception):
+    """ Trama de telemetría no válida o de una versión desconocida """
+    pass
+
+class MissingKeyframe(FrameError):
+    """ Trama delta cuyo keyframe no se ha recibido (se perdió por el enlace) """
+    pass
+
+def sensor_data_to_row(sensor_data, timestamp=None):
+    """
+    Convierte el diccionario de get_all_sensor_data() en una fila plana cuyas
+    claves son los campos de FIELDS.
+    """
+    row = dict.fromkeys(FIELD_NAMES)
+    row['timestamp'] = int(time.time() if timestamp is None else timestamp)
+
+    imu = sensor_data.get('IMU') or {}
+    for key in _IMU_KEYS:
+        row[key.lower()] = imu.get(key)
+
+    for group, keys in (('UV', _UV_KEYS), ('BMP', _BMP_KEYS), ('System', _SYSTEM_KEYS)):
+        values = sensor_data.get(group) or {}
+        for key, field in keys.items():
+            row[field] = values.get(key)
+
+    gps = sensor_data.get('GPS') or ()
+    for field, value in zip(_GPS_KEYS, gps):
+        row[field] = value
+
+    dallas = sensor_data.get('Dallas') or {}
+    for i, sensor_id in enumerate(sorted(dallas)[:DALLAS_SLOTS]):
+        row[f'dallas_id_{i}'] = dallas_id_to_int(sensor_id)
+        row[f'dallas_temp_{i}'] = dallas[sensor_id]
+
+    return row
+
+def dallas_id_to_int(sensor_id):
+    """ '28-0123456789ab' -> 0x280123456789ab """
+    family, serial = sensor_id.split('-', 1)
+    return (int(family, 16) << 48) | int(serial, 16)
+
+def int_to_dallas_id(value):
+    """ 0x280123456789ab -> '28-0123456789ab' """
+    return f'{value >> 48:02x}-{value & 0xFFFFFFFFFFFF:012x}'
+
+def _to_fixed(value, fmt, scale):
+    """ Convierte un valor a entero en punto fijo, o None si no es numérico """
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        return None
+    low, high = _LIMITS[fmt]
+    return min(max(round(value * scale), low), high)
+
+def row_to_fixed(row):
+    """ Convierte una fila a la lista de valores en punto fijo de FIELDS """
+    values = []
+    for name, fmt, scale in FIELDS:
+        value = row.get(name)
+        if fmt == 's':
+            values.append(value.encode('ascii', 'replace')[:MAX_NMEA_LENGTH]
+                          if isinstance(value, str) and value else None)
+        else:
+            values.append(_to_fixed(value, fmt, scale))
+    return values
+
+def fixed_to_row(values):
+    """ Inversa de row_to_fixed() """
+    row = {}
+    for (name, fmt, scale), value in zip(FIELDS, values):
+        if value is None:
+            row[name] = None
+        elif fmt == 's':
+            row[name] = value.decode('ascii', 'replace')
+        elif scale == 1:
+            row[name] = value
+        else:
+            row[name] = value / scale
+    return row
+
+def _encode_fields(values, bitmap, body):
+    """ Añade a `body` los campos numéricos presentes y marca sus bits """
+    fmt = ['<']
+    present = []
+    for i, ((_, field_fmt, _), value) in enumerate(zip(FIELDS, values)):
+        if value is not None and field_fmt != 's':
+            bitmap |= 1 << i
+            fmt.append(field_fmt)
+            present.append(value)
+    body += struct.pack(''.join(fmt), *present)
+    return bitmap
+
+def _append_text(values, bitmap, body, size):
+    """ Añade los campos de texto si caben en la trama """
+    for i, ((_, field_fmt, _), value) in enumerate(zip(FIELDS, values)):
+        if field_fmt == 's' and value is not None and size + len(body) + 1 + len(value) <= MAX_PAYLOAD_SIZE:
+            bitmap |= 1 << i
+            body.append(len(value))
+            body += value
+    return bitmap
+
+def encode_frame(row, seq):
+    """ Codifica una fila como payload binario completo (FRAME_FULL) """
+    return _encode_full(row_to_fixed(row), seq)
+
+def _encode_full(values, seq):
+    body = bytearray()
+    bitmap = _encode_fields(values, 0, body)
+    bitmap = _append_text(values, bitmap, body, _HEADER.size + BITMAP_SIZE)
+    return (_HEADER.pack(FRAME_VERSION, FRAME_FULL, seq & 0xFFFF)
+            + bitmap.to_bytes(BITMAP_SIZE, 'little') + body)
+
+def _decode_fields(payload, offset, bitmap):
+    """ Lee los campos marcados en `bitmap` a partir de `offset` """
+    values = [None] * len(FIELDS)
+    numeric = [i for i, (_, fmt, _) in enumerate(FIELDS) if bitmap >> i & 1 and fmt != 's']
+    fmt = '<' + ''.join(FIELDS[i][1] for i in numeric)
+    for i, value in zip(numeric, struct.unpack_from(fmt, payload, offset)):
+        values[i] = value
+    offset += struct.calcsize(fmt)
+    for i, (_, field_fmt, _) in enumerate(FIELDS):
+        if field_fmt == 's' and bitmap >> i & 1:
+            length = payload[offset]
+            values[i] = bytes(payload[offset + 1:offset + 1 + length])
+            offset += 1 + length
+    return values, offset
+
+def _decode_full(payload):
+    offset = _HEADER.size
+    bitmap = int.from_bytes(payload[offset:offset + BITMAP_SIZE], 'little')
+    values, _ = _decode_fields(payload, offset + BITMAP_SIZE, bitmap)
+    return values
+
+def decode_frame(payload):
+    """ Decodifica un payload binario completo (FRAME_FULL). Devuelve (seq, fila) """
+    try:
+        version, frame_type, seq = _HEADER.unpack_from(payload, 0)
+        if version != FRAME_VERSION or frame_type != FRAME_FULL:
+            raise FrameError(f'trama desconocida: versión {version}, tipo {frame_type}')
+        values = _decode_full(payload)
+    except (struct.error, IndexError) as e:
+        raise FrameError(f'trama truncada: {e}')
+    return seq, fixed_to_row(values)
+
+def _append_varint(body, value):
+    """ Añade un entero con signo como varint zig-zag (LEB128) """
+    value = (value << 1) ^ (value >> 63)
+    while value > 0x7F:
+        body.append((value & 0x7F) | 0x80)
+        value >>= 7
+    body.append(value)
+
+def _read_varint(payload, offset):
+    """ Lee un varint zig-zag. Devuelve (valor, nuevo offset) """
+    value = shift = 0
+    while True:
+        byte = payload[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (value >> 1) ^ -(value & 1), offset
+        shift += 7
+
+_DELTA_HEADER_SIZE = _HEADER.size + _KEYSEQ.size + 2 * BITMAP_SIZE
+
+def _encode_delta(values, key_values, seq, key_seq):
+    """ Codifica `values` como trama delta respecto a `key_values` """
+    presence = changed = 0
+    body = bytearray()
+    for i, ((_, fmt, _), value, key_value) in enumerate(zip(FIELDS, values, key_values)):
+        if value is None:
+            continue
+        presence |= 1 << i
+        if value == key_value:
+            continue
+        if fmt == 's':
+            # El texto va al final: solo se incluye si cabe en la trama
+            if _DELTA_HEADER_SIZE + len(body) + 1 + len(value) > MAX_PAYLOAD_SIZE:
+                presence &= ~(1 << i)
+                continue
+            changed |= 1 << i
+            body.append(len(value))
+            body += value
+        else:
+            changed |= 1 << i
+            _append_varint(body, value - (key_value or 0))
+    return (_HEADER.pack(FRAME_VERSION, FRAME_DELTA, seq & 0xFFFF) + _KEYSEQ.pack(key_seq)
+            + presence.to_bytes(BITMAP_SIZE, 'little') + changed.to_bytes(BITMAP_SIZE, 'little')
+            + body)
+
+def _decode_delta(payload, key_values):
+    """ Reconstruye los valores de una trama delta a partir del keyframe """
+    offset = _HEADER.size + _KEYSEQ.size
+    presence = int.from_bytes(payload[offset:offset + BITMAP_SIZE], 'little')
+    offset += BITMAP_SIZE
+    changed = int.from_bytes(payload[offset:offset + BITMAP_SIZE], 'little')
+    offset += BITMAP_SIZE
+    values = [None] * len(FIELDS)
+    for i, (_, fmt, _) in enumerate(FIELDS):
+        if not presence >> i & 1:
+            continue
+        if not changed >> i & 1:
+            values[i] = key_values[i]
+        elif fmt == 's':
+            length = payload[offset]
+            values[i] = bytes(payload[offset + 1:offset + 1 + length])
+            offset += 1 + length
+        else:
+            delta, offset = _read_varint(payload, offset)
+            values[i] = (key_values[i] or 0) + delta
+    return values
+
+class TelemetryEncoder:
+    """
+    Codificador keyframe + delta para el emisor.
+
+    Envía una trama completa cada `keyframe_interval` tramas y, entre medias,
+    tramas delta con solo los campos que han cambiado respecto a ese keyframe.
+    """
+
+    def __init__(self, keyframe_interval=10):
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self.key_values = None
+        self.key_seq = None
+        self.since_keyframe = 0
+
+    def encode(self, row, keyframe=False):
+        """ Codifica una fila y devuelve el payload (keyframe o delta) """
+        seq = self.seq
+        self.seq = (self.seq + 1) & 0xFFFF
+        values = row_to_fixed(row)
+
+        if not keyframe and self.key_values is not None and self.since_keyframe < self.keyframe_interval:
+            payload = _encode_delta(values, self.key_values, seq, self.key_seq)
+            # Si la trama delta no es más pequeña, es mejor empezar un keyframe nuevo
+            if len(payload) <= MAX_PAYLOAD_SIZE and len(payload) < len(_encode_full(values, seq)):
+                self.since_keyframe += 1
+                return payload
+
+        payload = _encode_full(values, seq)
+        # Guardar lo que realmente se ha enviado (el texto puede no haber cabido)
+        self.key_values = _decode_full(payload)
+        self.key_seq = seq
+        self.since_keyframe = 1
+        return payload
+
+class TelemetryDecoder:
+    """
+    Decodificador keyframe + delta para el receptor.
+
+    Guarda el último keyframe recibido. Las tramas delta que hacen referencia a
+    otro keyframe (porque se perdió) se descartan con MissingKeyframe hasta que
+    llega el siguiente keyframe.
+    """
+
+    def __init__(self):
+        self.key_values = None
+        self.key_seq = None
+
+    def decode(self, payload):
+        """ Decodifica un payload. Devuelve (seq, fila) """
+        try:
+            version, frame_type, seq = _HEADER.unpack_from(payload, 0)
+            if version != FRAME_VERSION:
+                raise FrameError(f'versión de trama desconocida: {version}')
+            if frame_type == FRAME_FULL:
+                values = _decode_full(payload)
+                self.key_values, self.key_seq = values, seq
+            elif frame_type == FRAME_DELTA:
+                key_seq, = _KEYSEQ.unpack_from(payload, _HEADER.size)
+                if self.key_values is None or key_seq != self.key_seq:
+                    raise MissingKeyframe(f'trama {seq}: falta el keyframe {key_seq}')
+                values = _decode_delta(payload, self.key_values)
+            else:
+                raise FrameError(f'tipo de trama desconocido: {frame_type}')
+        except (struct.error, IndexError) as e:
+            raise FrameError(f'trama truncada: {e}')
+        return seq, fixed_to_row(values)
+
+def dallas_from_row(row):
+    """ Devuelve {id: temperatura} de las sondas DS18B20 de una fila decodificada """
+    dallas = {}
+    for i in range(DALLAS_SLOTS):
+        sensor_id = row.get(f'dallas_id_{i}')
+        if sensor_id is not None:
+            dallas[int_to_dallas_id(sensor_id)] = row.get(f'dallas_temp_{i}')
+    return dallas
+
+def _crc(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+def pack_frame(payload):
+    """ Envuelve un payload con SYNC, longitud y CRC16 para enviarlo por el UART """
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise FrameError(f'payload demasiado grande: {len(payload)} bytes')
+    head = bytes((len(payload),)) + payload
+    return SYNC + head + _crc(head).to_bytes(2, 'little')
+
+class FrameParser:
+    """
+    Separa las tramas del flujo de bytes del UART de forma incremental.
+
+    Los bytes recibidos se copian una sola vez en un buffer preasignado y cada
+    byte se examina una sola vez en busca de delimitadores. feed() devuelve
+    todas las tramas completas de cada lectura como tuplas (tipo, datos):
+      - (LINK_BINARY, payload): trama binaria SYNC + LEN + payload + CRC16.
+      - (LINK_TEXT, texto): trama de texto antigua '<<<...>>>' (JSON). Solo se
+        decodifica como UTF-8 cuando está completa, así que los caracteres
+        partidos entre dos lecturas no dan problemas.
+    Los bytes basura, las tramas con CRC incorrecto y las tramas de texto que
+    superan `max_text_size` sin cerrarse se descartan y el parser se vuelve a
+    sincronizar con el siguiente delimitador.
+    """
+
+    def __init__(self, capacity=8192, max_text_size=4096):
+        if max_text_size >= capacity:
+            raise ValueError('max_text_size must be smaller than capacity')
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.max_text_size = max_text_size
+        self.start = 0          # Primer byte sin procesar
+        self.end = 0            # Fin de los datos recibidos
+        self.text_scan = None   # Donde seguir buscando '>>>' en una trama de texto abierta
+
+        # Estadísticas del enlace
+        self.discarded_bytes = 0
+        self.crc_errors = 0
+
+    def _store(self, data):
+        """ Copia `data` al buffer, compactándolo si hace falta """
+        capacity = len(self.buffer)
+        size = len(data)
+        if size > capacity:
+            self.discarded_bytes += (self.end - self.start) + size - capacity
+            data = data[-capacity:]
+            size = capacity
+            self.start = self.end = 0
+            self.text_scan = None
+        if self.end + size > capacity:
+            pending = self.end - self.start
+            if pending + size > capacity:
+                # No cabe: descartar lo más antiguo (ninguna trama válida es tan larga)
+                drop = pending + size - capacity
+                self.discarded_bytes += drop
+                self.start += drop
+                pending -= drop
+                self.text_scan = None
+            self.buffer[:pending] = self.view[self.start:self.end]
+            if self.text_scan is not None:
+                self.text_scan -= self.start
+            self.start, self.end = 0, pending
+        self.view[self.end:self.end + size] = data
+        self.end += size
+
+    def _binary_frame_at(self, pos, end):
+        """
+        Comprueba la trama binaria que empieza en `pos`. Devuelve el final de la
+        trama si es válida, 0 si aún está incompleta o -1 si no es válida.
+        """
+        buffer = self.buffer
+        if end - pos < 3:
+            return 0
+        length = buffer[pos + 2]
+        if length > MAX_PAYLOAD_SIZE:
+            return -1
+        frame_end = pos + 3 + length + 2
+        if frame_end > end:
+            return 0
+        crc = buffer[frame_end - 2] | buffer[frame_end - 1] << 8
+        if _crc(self.view[pos + 2:frame_end - 2]) != crc:
+            return -1
+        return frame_end
+
+    def feed(self, data):
+        """ Añade bytes recibidos y devuelve la lista de tramas completas """
+        if data:
+            self._store(data)
+        frames = []
+        buffer, start, end = self.buffer, self.start, self.end
+
+        while start < end:
+            if self.text_scan is not None:
+                # Trama de texto abierta: buscar solo en los bytes nuevos
+                close = buffer.find(TEXT_END, self.text_scan, end)
+                limit = end if close == -1 else close
+
+                # Una trama binaria válida antes del cierre significa que la
+                # trama de texto se cortó: abandonarla
+                sync = buffer.find(SYNC, self.text_scan, limit)
+                while sync != -1 and self._binary_frame_at(sync, end) <= 0:
+                    sync = buffer.find(SYNC, sync + 1, limit)
+                if sync != -1:
+                    self.discarded_bytes += sync - start
+                    start = sync
+                    self.text_scan = None
+                    continue
+
+                if close == -1:
+                    if end - start > self.max_text_size:
+                        # Trama sin cerrar demasiado larga: saltar su marcador
+                        self.discarded_bytes += len(TEXT_START)
+                        start += len(TEXT_START)
+                        self.text_scan = None
+                        continue
+                    # Volver a mirar los últimos bytes: pueden ser un delimitador
+                    # o una trama binaria partidos entre lecturas
+                    self.text_scan = max(start + len(TEXT_START), end - MAX_FRAME_SIZE)
+                    break
+                # Si hay otro '<<<' dentro, la trama anterior se cortó: usar el último
+                opening = buffer.rfind(TEXT_START, start, close)
+                self.discarded_bytes += opening - start
+                try:
+                    frames.append((LINK_TEXT, str(self.view[opening + len(TEXT_START):close], 'utf-8')))
+                except UnicodeDecodeError:
+                    self.discarded_bytes += close - opening
+                start = close + len(TEXT_END)
+                self.text_scan = None
+                continue
+
+            sync = buffer.find(SYNC, start, end)
+            text = buffer.find(TEXT_START, start, end)
+            if sync == -1 and text == -1:
+                # Conservar un posible delimitador partido entre lecturas
+                keep = max(start, end - len(TEXT_START) + 1)
+                self.discarded_bytes += keep - start
+                start = keep
+                break
+
+            if text != -1 and (sync == -1 or text < sync):
+                self.discarded_bytes += text - start
+                start = text
+                self.text_scan = start + len(TEXT_START)
+                continue
+
+            self.discarded_bytes += sync - start
+            start = sync
+            frame_end = self._binary_frame_at(start, end)
+            if frame_end == 0:
+                break
+            if frame_end > 0:
+                frames.append((LINK_BINARY, bytes(self.view[start + 3:frame_end - 2])))
+                start = frame_end
+            else:
+                # Trama no válida: resincronizar con el siguiente SYNC
+                self.crc_errors += 1
+                self.discarded_bytes += 1
+                start += 1
+
+        self.start = start
+        if start == end:
+            self.start = self.end = 0
+        return frames
@@ -0,0 +1,305 @@
+"""* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+*                                                                            *
+*               Developed by Javier Bolañs & Javier Lendinez                 *
+*                  https://github.com/javierbolanosllano                     *
+*                        https://github.com/JaviLendi                        *
+*                                                                            *
+*                      UAXSAT IV Project - 2024                              *
+*                   https://github.com/UAXSat/UAXSat                         *
+*                                                                            *
+* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
+
+# Attitudemodule.py
+#
+# Attitude estimation from the ICM20948 with a Madgwick MARG filter.
+#
+# Frames: the body frame is the accelerometer/gyro frame of the ICM20948 (z up
+# when the board lies flat). The earth frame is North-West-Up. Angles are
+# returned in degrees; heading is clockwise from north, tilt-compensated.
+import time
+import math
+import threading
+import numpy as np
+
+# The AK09916 magnetometer inside the ICM20948 has its Y and Z axes reversed
+# with respect to the accelerometer and gyro
+MAG_AXES = np.array((1.0, -1.0, -1.0))
+
+DEFAULT_BETA = 0.1  # Filter gain: higher trusts accel/mag more, lower trusts the gyro more
+
+class MadgwickFilter:
+    """
+    Madgwick gradient-descent orientation filter (MARG version, with the IMU
+    only version used when there is no magnetometer reading).
+
+    The quaternion q = (w, x, y, z) rotates body vectors into the earth frame.
+    """
+
+    def __init__(self, beta=DEFAULT_BETA):
+        self.beta = beta
+        self.q = (1.0, 0.0, 0.0, 0.0)
+
+    def initialise(self, accel, mag):
+        """Starts from the orientation given by gravity and the magnetic field."""
+        roll, pitch, heading = tilt_compensated_attitude(np.asarray(accel), np.asarray(mag))
+        self.q = euler_to_quaternion(float(roll), float(pitch), float(heading))
+
+    def update(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        """
+        One filter step. Gyro in rad/s, accel and mag already normalised
+        (a zero vector means "no reading"), dt in seconds.
+        """
+        q0, q1, q2, q3 = self.q
+
+        # Rate of change of the quaternion from the gyro
+        qDot1 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qDot2 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qDot3 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qDot4 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        if ax or ay or az:
+            if mx or my or mz:
+                s0, s1, s2, s3 = _marg_gradient(q0, q1, q2, q3, ax, ay, az, mx, my, mz)
+            else:
+                s0, s1, s2, s3 = _imu_gradient(q0, q1, q2, q3, ax, ay, az)
+            norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+            if norm:
+                qDot1 -= self.beta * s0 / norm
+                qDot2 -= self.beta * s1 / norm
+                qDot3 -= self.beta * s2 / norm
+                qDot4 -= self.beta * s3 / norm
+
+        q0 += qDot1 * dt
+        q1 += qDot2 * dt
+        q2 += qDot3 * dt
+        q3 += qDot4 * dt
+        norm = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        self.q = (q0 / norm, q1 / norm, q2 / norm, q3 / norm)
+
+    def update_batch(self, times, gyro, accel, mag):
+        """
+        Runs the filter over a block of n samples (arrays of shape (n, 3)).
+        `times` has n + 1 entries: the time of the sample before the block
+        followed by the time of each sample, so that sample i is integrated
+        over times[i + 1] - times[i]. Normalisation and time steps are computed
+        for the whole block with NumPy; the recursion itself is sequential.
+        """
+        accel = _normalise_rows(accel)
+        mag = _normalise_rows(mag)
+        dt = np.diff(times).tolist()
+        rows = np.hstack((gyro, accel, mag)).tolist()
+        for i, row in enumerate(rows):
+            if dt[i] > 0:
+                self.update(*row, dt[i])
+
+class AttitudeEngine:
+    """
+    Keeps the attitude up to date from blocks of IMU samples (the IMU_SAMPLE
+    arrays produced by IMUmodule.IMUFifo / stream_sensor_data).
+
+    update() consumes every sample at the IMU rate; the attitude is published
+    at whatever rate the caller reads it (latest()) or, with run(), every
+    1/rate_hz seconds.
+
+    Parameters:
+    - beta: Madgwick filter gain.
+    - declination: Magnetic declination in degrees (east positive), added to
+      the heading to give true north.
+    - mag_axes: Signs that align the magnetometer axes with the accelerometer.
+    - calibration: Optional object with an apply(mag) method (hard/soft-iron).
+    """
+
+    def __init__(self, beta=DEFAULT_BETA, declination=0.0, mag_axes=MAG_AXES, calibration=None):
+        self.filter = MadgwickFilter(beta)
+        self.declination = declination
+        self.mag_axes = np.asarray(mag_axes, dtype=float)
+        self.calibration = calibration
+        self.last_time = None
+        self.timestamp = None
+        self.lock = threading.Lock()
+
+    def update(self, samples):
+        """Runs the filter over a block of samples and returns the new attitude."""
+        if len(samples) == 0:
+            return self.latest()
+        mag = samples['mag'].astype(float)
+        if self.calibration is not None:
+            mag = self.calibration.apply(mag)
+        mag = mag * self.mag_axes
+        times = samples['time']
+        gyro = samples['gyro']
+        accel = samples['accel']
+
+        with self.lock:
+            if self.last_time is None:
+                # First block: start from the accel/mag attitude so the filter
+                # does not need to converge from the identity quaternion
+                self.filter.initialise(accel[0], mag[0])
+                self.last_time = times[0]
+            times = np.concatenate(((self.last_time,), times))
+            self.filter.update_batch(times, gyro, accel, mag)
+            self.last_time = times[-1]
+            self.timestamp = float(times[-1])
+        return self.latest()
+
+    def latest(self):
+        """Returns the current attitude as a dictionary (None before the first sample)."""
+        with self.lock:
+            if self.timestamp is None:
+                return None
+            q = self.filter.q
+            timestamp = self.timestamp
+        roll, pitch, heading = quaternion_to_euler(q)
+        return {
+            'time': timestamp,
+            'quaternion': q,
+            'roll': roll,
+            'pitch': pitch,
+            'heading': (heading + self.declination) % 360.0,
+        }
+
+    def run(self, stream, publish, rate_hz=10, stop_event=None):
+        """
+        Feeds every block from `stream` to the filter and calls
+        publish(attitude) every 1/rate_hz seconds.
+        """
+        period = 1.0 / rate_hz
+        next_publish = time.monotonic()
+        for samples in stream:
+            self.update(samples)
+            if stop_event is not None and stop_event.is_set():
+                break
+            now = time.monotonic()
+            if now >= next_publish:
+                publish(self.latest())
+                next_publish = max(next_publish + period, now)
+
+# Madgwick gradients
+# -----------------------------------------------------------------------------
+
+def _imu_gradient(q0, q1, q2, q3, ax, ay, az):
+    """Gradient of the accelerometer objective function."""
+    _2q0 = 2.0 * q0
+    _2q1 = 2.0 * q1
+    _2q2 = 2.0 * q2
+    _2q3 = 2.0 * q3
+    _4q0 = 4.0 * q0
+    _4q1 = 4.0 * q1
+    _4q2 = 4.0 * q2
+    _8q1 = 8.0 * q1
+    _8q2 = 8.0 * q2
+    q0q0 = q0 * q0
+    q1q1 = q1 * q1
+    q2q2 = q2 * q2
+    q3q3 = q3 * q3
+    s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+    s1 = _4q1 * q3q3 - _2q3 * ax + 4.0 * q0q0 * q1 - _2q0 * ay - _4q1 + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az
+    s2 = 4.0 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az
+    s3 = 4.0 * q1q1 * q3 - _2q1 * ax + 4.0 * q2q2 * q3 - _2q2 * ay
+    return s0, s1, s2, s3
+
+def _marg_gradient(q0, q1, q2, q3, ax, ay, az, mx, my, mz):
+    """Gradient of the accelerometer and magnetometer objective function."""
+    _2q0mx = 2.0 * q0 * mx
+    _2q0my = 2.0 * q0 * my
+    _2q0mz = 2.0 * q0 * mz
+    _2q1mx = 2.0 * q1 * mx
+    _2q0 = 2.0 * q0
+    _2q1 = 2.0 * q1
+    _2q2 = 2.0 * q2
+    _2q3 = 2.0 * q3
+    _2q0q2 = 2.0 * q0 * q2
+    _2q2q3 = 2.0 * q2 * q3
+    q0q0 = q0 * q0
+    q0q1 = q0 * q1
+    q0q2 = q0 * q2
+    q0q3 = q0 * q3
+    q1q1 = q1 * q1
+    q1q2 = q1 * q2
+    q1q3 = q1 * q3
+    q2q2 = q2 * q2
+    q2q3 = q2 * q3
+    q3q3 = q3 * q3
+
+    # Reference direction of the earth's magnetic field
+    hx = mx * q0q0 - _2q0my * q3 + _2q0mz * q2 + mx * q1q1 + _2q1 * my * q2 + _2q1 * mz * q3 - mx * q2q2 - mx * q3q3
+    hy = _2q0mx * q3 + my * q0q0 - _2q0mz * q1 + _2q1mx * q2 - my * q1q1 + my * q2q2 + _2q2 * mz * q3 - my * q3q3
+    _2bx = math.sqrt(hx * hx + hy * hy)
+    _2bz = -_2q0mx * q2 + _2q0my * q1 + mz * q0q0 + _2q1mx * q3 - mz * q1q1 + _2q2 * my * q3 - mz * q2q2 + mz * q3q3
+    _4bx = 2.0 * _2bx
+    _4bz = 2.0 * _2bz
+
+    s0 = (-_2q2 * (2.0 * q1q3 - _2q0q2 - ax) + _2q1 * (2.0 * q0q1 + _2q2q3 - ay)
+          - _2bz * q2 * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+          + (-_2bx * q3 + _2bz * q1) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+          + _2bx * q2 * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+    s1 = (_2q3 * (2.0 * q1q3 - _2q0q2 - ax) + _2q0 * (2.0 * q0q1 + _2q2q3 - ay)
+          - 4.0 * q1 * (1 - 2.0 * q1q1 - 2.0 * q2q2 - az)
+          + _2bz * q3 * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+          + (_2bx * q2 + _2bz * q0) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+          + (_2bx * q3 - _4bz * q1) * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+    s2 = (-_2q0 * (2.0 * q1q3 - _2q0q2 - ax) + _2q3 * (2.0 * q0q1 + _2q2q3 - ay)
+          - 4.0 * q2 * (1 - 2.0 * q1q1 - 2.0 * q2q2 - az)
+          + (-_4bx * q2 - _2bz * q0) * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+          + (_2bx * q1 + _2bz * q3) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+          + (_2bx * q0 - _4bz * q2) * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+    s3 = (_2q1 * (2.0 * q1q3 - _2q0q2 - ax) + _2q2 * (2.0 * q0q1 + _2q2q3 - ay)
+          + (-_4bx * q3 + _2bz * q1) * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+          + (-_2bx * q0 + _2bz * q2) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+          + _2bx * q1 * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+    return s0, s1, s2, s3
+
+# Utility functions
+# -----------------------------------------------------------------------------
+
+def _normalise_rows(vectors):
+    """Normalises each row; rows with zero norm (no reading) are left as zeros."""
+    vectors = np.asarray(vectors, dtype=float)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+def tilt_compensated_attitude(accel, mag):
+    """
+    Roll, pitch and heading in degrees from gravity and the magnetic field
+    (both in body axes, mag already aligned with the accelerometer). Works on
+    single vectors or on arrays of shape (n, 3).
+    """
+    ax, ay, az = np.moveaxis(np.asarray(accel, dtype=float), -1, 0)
+    mx, my, mz = np.moveaxis(np.asarray(mag, dtype=float), -1, 0)
+    roll = np.arctan2(ay, az)
+    pitch = np.arctan2(-ax, np.hypot(ay, az))
+
+    # Magnetic field projected onto the horizontal plane
+    sin_roll, cos_roll = np.sin(roll), np.cos(roll)
+    sin_pitch, cos_pitch = np.sin(pitch), np.cos(pitch)
+    xh = mx * cos_pitch + (my * sin_roll + mz * cos_roll) * sin_pitch
+    yh = my * cos_roll - mz * sin_roll
+    heading = np.degrees(np.arctan2(yh, xh)) % 360.0
+    # Pitch is returned nose-up positive, as in quaternion_to_euler()
+    return np.degrees(roll), -np.degrees(pitch), heading
+
+def tilt_compensated_heading(accel, mag):
+    """Heading in degrees (clockwise from magnetic north) from gravity and the magnetic field."""
+    return tilt_compensated_attitude(accel, mag)[2]
+
+def quaternion_to_euler(q):
+    """Returns (roll, pitch, heading) in degrees from a quaternion (w, x, y, z)."""
+    w, x, y, z = q
+    roll = math.atan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y))
+    pitch = math.asin(max(-1.0, min(1.0, 2.0 * (w * y - z * x))))
+    yaw = math.atan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+    # Yaw is counter-clockwise about the up axis; heading is clockwise
+    return math.degrees(roll), -math.degrees(pitch), (-math.degrees(yaw)) % 360.0
+
+def euler_to_quaternion(roll, pitch, heading):
+    """Inverse of quaternion_to_euler (angles in degrees)."""
+    r = math.radians(roll) / 2.0
+    p = -math.radians(pitch) / 2.0
+    y = -math.radians(heading) / 2.0
+    cr, sr = math.cos(r), math.sin(r)
+    cp, sp = math.cos(p), math.sin(p)
+    cy, sy = math.cos(y), math.sin(y)
+    return (cr * cp * cy + sr * sp * sy,
+            sr * cp * cy - cr * sp * sy,
+            cr * sp * cy + sr * cp * sy,
+            cr * cp * sy - sr * sp * cy)
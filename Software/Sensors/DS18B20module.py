@@ -10,19 +10,55 @@
 * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
 
 # DS18B20module.py
+#
+# A DS18B20 conversion takes up to 750 ms, and reading w1_slave starts one, so
+# reading N probes one after the other takes N x 750 ms. When the kernel offers
+# therm_bulk_read, a single "trigger" starts the conversion on every probe of
+# the bus at once and the next w1_slave read of each probe returns its result
+# without converting again. The probes are then read concurrently, and with
+# start() this happens in a background thread that keeps the latest
+# temperature of every probe (and its age) ready to be read without waiting.
+#
+# The list of probes is kept between cycles. It is rescanned when the kernel
+# announces a 1-Wire device being added or removed (uevents on a netlink
+# socket; sysfs does not generate inotify events) and, as a fallback, every
+# DISCOVERY_INTERVAL seconds. Each probe's w1_slave file is opened once and
+# read again with preadv() into a fixed buffer.
 import os
+import glob
 import time
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CONVERSION_TIME = 0.75      # Seconds, 12-bit resolution
+CONVERSION_POLL = 0.05
+DISCOVERY_INTERVAL = 30.0   # Seconds between rescans of the bus without uevents
+READ_SIZE = 128             # w1_slave is 2 lines of ~40 characters
+
+NETLINK_KOBJECT_UEVENT = 15
 
 class DallasSensor:
     BASE_DIR = '/sys/bus/w1/devices/'
 
     def __init__(self):
         self.sensors = self.detect_sensors()
+        self.bulk_files = glob.glob(os.path.join(self.BASE_DIR, 'w1_bus_master*', 'therm_bulk_read'))
+        self.last_scan = time.monotonic()
+        self.rescan_requested = False
+        self.uevents = open_uevent_socket()
+        self.files = {}             # {sensor_id: (fd, buffer)}
+        self.executor = None
+        self.cache = {}             # {sensor_id: (temperature, time.monotonic() of the reading)}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.interval = None
 
     def detect_sensors(self):
         """Detects and returns a list of Dallas DS18B20 sensor IDs."""
         try:
-            sensor_folders = [f for f in os.listdir(self.BASE_DIR) if f.startswith('28-')]
+            sensor_folders = sorted(f for f in os.listdir(self.BASE_DIR) if f.startswith('28-'))
             return sensor_folders
         except FileNotFoundError:
             print("1-Wire interface not found. Ensure 1-Wire is enabled and the sensor is properly connected.")
@@ -38,6 +74,19 @@ class DallasSensor:
             print(f"Sensor {sensor_id} data file not found.")
             return None
 
+    def _open(self, sensor_id):
+        """Opens the w1_slave file of a sensor once and keeps its descriptor and buffer."""
+        entry = self.files.get(sensor_id)
+        if entry is None:
+            fd = os.open(os.path.join(self.BASE_DIR, sensor_id, 'w1_slave'), os.O_RDONLY)
+            entry = self.files[sensor_id] = (fd, bytearray(READ_SIZE))
+        return entry
+
+    def _close(self, sensor_id):
+        entry = self.files.pop(sensor_id, None)
+        if entry is not None:
+            os.close(entry[0])
+
     def parse_temperature(self, raw_data):
         """Parses the temperature from the raw sensor data."""
         try:
@@ -52,32 +101,209 @@ class DallasSensor:
             print(f"Error parsing temperature: {e}")
         return None
 
-    def get_sensor_info(self):
-        """Returns a dictionary of sensor IDs and their temperatures."""
+    def read_temperature(self, sensor_id):
+        """Reads and parses the temperature of one sensor (None on error)."""
+        try:
+            fd, buffer = self._open(sensor_id)
+            # Reading sysfs from offset 0 runs the read again, like a new open()
+            length = os.preadv(fd, [buffer], 0)
+        except OSError as e:
+            print(f"Error reading sensor {sensor_id}: {e}")
+            self._close(sensor_id)
+            self.rescan_requested = True
+            return None
+        return parse_w1_slave(buffer, length)
+
+    def trigger_conversion(self):
+        """
+        Starts a conversion on every sensor at once through therm_bulk_read.
+        Returns False if no bus master supports it.
+        """
+        triggered = False
+        for bulk_file in self.bulk_files:
+            try:
+                with open(bulk_file, 'w') as f:
+                    f.write('trigger\n')
+                triggered = True
+            except OSError as e:
+                print(f"Error triggering bulk conversion on {bulk_file}: {e}")
+        return triggered
+
+    def wait_conversion(self, timeout=CONVERSION_TIME * 2):
+        """Waits until no bus master reports a conversion in progress (-1)."""
+        deadline = time.monotonic() + timeout
+        time.sleep(min(CONVERSION_TIME, timeout))
+        for bulk_file in self.bulk_files:
+            while time.monotonic() < deadline:
+                try:
+                    with open(bulk_file, 'r') as f:
+                        if f.read().strip() != '-1':
+                            break
+                except OSError:
+                    break
+                time.sleep(CONVERSION_POLL)
+
+    def hotplug_event(self):
+        """Returns True if the kernel announced 1-Wire devices added or removed."""
+        if self.uevents is None:
+            return False
+        event = False
+        while True:
+            try:
+                message = self.uevents.recv(8192)
+            except BlockingIOError:
+                return event
+            except OSError:
+                return event
+            if b'SUBSYSTEM=w1' in message:
+                event = True
+
+    def check_devices(self):
+        """Rescans the bus if requested, after a hotplug event or every DISCOVERY_INTERVAL."""
+        if (self.rescan_requested or self.hotplug_event()
+                or time.monotonic() - self.last_scan >= DISCOVERY_INTERVAL):
+            self._rescan()
+
+    def update(self):
+        """
+        Converts and reads every sensor and updates the cache. Returns a
+        dictionary of sensor IDs and the temperatures read in this cycle.
+        """
+        self.check_devices()
+        sensors = list(self.sensors)
+        if not sensors:
+            return {}
+        if self.trigger_conversion():
+            self.wait_conversion()
+        # Without bulk conversion every read converts on its own; they still overlap
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ds18b20')
+        temperatures = self.executor.map(self.read_temperature, sensors)
+
+        now = time.monotonic()
         info = {}
-        for sensor in self.sensors:
-            raw_data = self.read_sensor_data(sensor)
-            if raw_data:
-                temp = self.parse_temperature(raw_data)
-                if temp is not None:
-                    info[sensor] = temp
+        for sensor, temp in zip(sensors, temperatures):
+            if temp is not None:
+                info[sensor] = temp
+        with self.lock:
+            self.cache.update((sensor, (temp, now)) for sensor, temp in info.items())
         return info
 
+    def start(self, interval=1.0):
+        """Keeps converting and reading all the sensors every `interval` seconds in the background."""
+        if self.thread is not None:
+            return
+        self.interval = interval
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='DallasSensor', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.update()
+            except Exception as e:
+                print(f"Error reading DS18B20 sensors: {e}")
+            self.stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def stop(self):
+        """Stops the background thread."""
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        for sensor in list(self.files):
+            self._close(sensor)
+        if self.uevents is not None:
+            self.uevents.close()
+            self.uevents = None
+
+    def get_readings(self):
+        """Returns {sensor_id: (temperature, age in seconds)} from the cache."""
+        now = time.monotonic()
+        with self.lock:
+            return {sensor: (temp, now - timestamp) for sensor, (temp, timestamp) in self.cache.items()}
+
+    def get_sensor_info(self, max_age=None):
+        """
+        Returns a dictionary of sensor IDs and their temperatures. In the
+        background mode this is the cache (without waiting), leaving out
+        readings older than `max_age` seconds (default: three intervals);
+        otherwise all the sensors are converted and read now.
+        """
+        if self.thread is None:
+            return self.update()
+        if max_age is None:
+            max_age = 3 * self.interval + 2 * CONVERSION_TIME
+        return {sensor: temp for sensor, (temp, age) in self.get_readings().items() if age <= max_age}
+
     def refresh(self):
-        """Refresh the list of sensors and their data."""
-        self.sensors = self.detect_sensors()
+        """
+        Refresh the list of sensors and their data. The bus is rescanned at the
+        start of the next update(), so that no file is closed while being read.
+        """
+        self.rescan_requested = True
+        if self.thread is None:
+            self._rescan()
+
+    def _rescan(self):
+        self.rescan_requested = False
+        self.last_scan = time.monotonic()
+        sensors = self.detect_sensors()
+        if sensors != self.sensors:
+            print(f"1-Wire sensors: {sensors}")
+        self.sensors = sensors
+        for sensor in set(self.files) - set(sensors):
+            self._close(sensor)
+        self.bulk_files = glob.glob(os.path.join(self.BASE_DIR, 'w1_bus_master*', 'therm_bulk_read'))
+        with self.lock:
+            for sensor in set(self.cache) - set(self.sensors):
+                del self.cache[sensor]
 
     def __repr__(self):
         return f"DallasSensor(sensors={self.sensors})"
 
+def parse_w1_slave(buffer, length):
+    """
+    Parses the contents of w1_slave in `buffer` without decoding or splitting it:
+        72 01 4b 46 7f ff 0e 10 57 : crc=57 YES
+        72 01 4b 46 7f ff 0e 10 57 t=23125
+    Returns the temperature in degrees C, or None if the CRC check failed.
+    """
+    end_of_line = buffer.find(b'\n', 0, length)
+    if end_of_line < 0 or buffer.find(b'YES', 0, end_of_line) < 0:
+        return None
+    position = buffer.find(b't=', end_of_line, length)
+    if position < 0:
+        return None
+    try:
+        return int(buffer[position + 2:length]) / 1000.0
+    except ValueError:
+        return None
+
+def open_uevent_socket():
+    """Non-blocking socket that receives the kernel device uevents (None if not available)."""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, 1))
+        sock.setblocking(False)
+        return sock
+    except (AttributeError, OSError):
+        return None
+
 def main():
     dallas_sensor = DallasSensor()
+    dallas_sensor.start(interval=1.0)
     
     while True:
-        sensor_info = dallas_sensor.get_sensor_info()
+        sensor_info = dallas_sensor.get_readings()
         if sensor_info:
-            for sensor_id, temperature in sensor_info.items():
-                print(f"Sensor ID: {sensor_id}, Temperature: {temperature:.2f} °C")
+            for sensor_id, (temperature, age) in sensor_info.items():
+                print(f"Sensor ID: {sensor_id}, Temperature: {temperature:.2f} °C ({age:.1f} s ago)")
         else:
             print("No sensors found. Retrying in 5 seconds...")
         
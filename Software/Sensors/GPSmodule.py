@@ -8,90 +8,515 @@
 *                                                                            *
 * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
 
-
+# GPSmodule.py
+#
+# NEO-M9N driver. Instead of polling each UBX message (one blocking round trip
+# per message and cycle), the receiver is configured to output NAV-PVT,
+# NAV-HPPOSLLH and NAV-ATT with every navigation solution. A background thread
+# reads the port, parses the stream and keeps the latest message of each type,
+# so GPSprogram() only builds a snapshot and never waits on the serial port.
+#
+# The port carries UBX binary frames and NMEA text interleaved. StreamDemux
+# separates them in a single pass over the received bytes, validates each one
+# (UBX: Fletcher checksum, NMEA: XOR checksum) and dispatches typed messages
+# to the handlers subscribed to them.
+#
+# GPSPortManager finds the receiver once and remembers its stable
+# /dev/serial/by-id path, so reconnecting only reopens that path. The serial
+# ports are enumerated again only after a hotplug event (kernel/udev uevents
+# on a netlink socket) or, as a fallback, every PORT_RESCAN_INTERVAL seconds.
+import os
+import time
+import socket
+import struct
+import threading
+from collections import namedtuple
+from functools import reduce
+from itertools import accumulate
+from operator import xor
 import serial
 from serial.tools import list_ports
-from ublox_gps import UbloxGps
+
+UBX_SYNC = b'\xb5\x62'
+UBX_HEADER = struct.Struct('<BBH')      # class, id, payload length
+
+# Class/ID of the messages used
+UBX_ACK_NAK = (0x05, 0x00)
+UBX_ACK_ACK = (0x05, 0x01)
+UBX_CFG_MSG = (0x06, 0x01)
+UBX_CFG_VALSET = (0x06, 0x8A)
+UBX_NAV_PVT = (0x01, 0x07)
+UBX_NAV_HPPOSLLH = (0x01, 0x14)
+UBX_NAV_ATT = (0x01, 0x05)
+
+# CFG-MSGOUT keys (output rate per navigation solution) for the UART1 and USB ports
+MSGOUT_KEYS = {
+    UBX_NAV_PVT: (0x20910007, 0x20910009),
+    UBX_NAV_HPPOSLLH: (0x20910034, 0x20910036),
+    UBX_NAV_ATT: (0x20910020, 0x20910022),      # Only on receivers with sensor fusion
+}
+VALSET_LAYER_RAM = 0x01
+
+# Typed UBX messages: fields as in the u-blox interface description, raw units
+NavPVT = namedtuple('NavPVT', 'iTOW year month day hour min sec valid tAcc nano fixType flags flags2 numSV '
+                              'lon lat height hMSL hAcc vAcc velN velE velD gSpeed headMot sAcc headAcc '
+                              'pDOP flags3 headVeh magDec magAcc')
+NavHPPOSLLH = namedtuple('NavHPPOSLLH', 'version flags iTOW lon lat height hMSL lonHp latHp heightHp hMSLHp hAcc vAcc')
+NavATT = namedtuple('NavATT', 'iTOW version roll pitch heading accRoll accPitch accHeading')
+Ack = namedtuple('Ack', 'clsID msgID')
+
+UBX_TYPES = {
+    UBX_NAV_PVT: (struct.Struct('<IHBBBBBBIiBBBBiiiiIIiiiiiIIHH4xihH'), NavPVT),
+    UBX_NAV_HPPOSLLH: (struct.Struct('<B2xBIiiiibbbbII'), NavHPPOSLLH),
+    UBX_NAV_ATT: (struct.Struct('<IB3xiiiIII'), NavATT),
+    UBX_ACK_ACK: (struct.Struct('<BB'), Ack),
+    UBX_ACK_NAK: (struct.Struct('<BB'), Ack),
+}
+
+# NMEA sentence: talker ('GN', or '' for proprietary), type ('GGA', 'PUBX'...), fields after the address
+NMEASentence = namedtuple('NMEASentence', 'talker type fields raw')
+
+ACK_TIMEOUT = 1.0           # Seconds to wait for the answer to a configuration message
+SOLUTION_MAX_AGE = 3.0      # Seconds after which a stored solution is no longer reported
+MAX_NMEA_LENGTH = 100       # 82 in the standard; some u-blox high precision sentences are longer
+MAX_UBX_PAYLOAD = 4096      # Longest payload accepted for messages of unknown size
+
+# Message classes defined by the u-blox protocol (NAV, RXM, INF, ACK, CFG,
+# UPD, MON, AID, TIM, ESF, MGA, LOG, SEC, HNR, NAV2). A false sync in the noise
+# is dropped as soon as its header arrives if the class is unknown or, for the
+# messages in UBX_TYPES, if the length is not theirs, instead of holding back
+# the output until up to MAX_UBX_PAYLOAD bytes have arrived
+UBX_CLASSES = frozenset((0x01, 0x02, 0x04, 0x05, 0x06, 0x09, 0x0A, 0x0B, 0x0D, 0x10, 0x13, 0x21, 0x27, 0x28, 0x29))
+UBX_SIZES = {msg: decoder[0].size for msg, decoder in UBX_TYPES.items()}
+
+BY_ID_DIR = '/dev/serial/by-id'
+PORT_RESCAN_INTERVAL = 10.0     # Seconds between enumerations while the GPS is missing
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_GROUPS = 0x3             # Kernel (1) and udev (2) events; udev ones arrive once the by-id links exist
+
+def ubx_checksum(data):
+    """
+    8-bit Fletcher checksum of class, id, length and payload. CK_A is the sum
+    of the bytes and CK_B the sum of the running sums of CK_A, both computed
+    with built-ins instead of a Python loop per byte.
+    """
+    return bytes((sum(data) & 0xFF, sum(accumulate(data)) & 0xFF))
+
+def nmea_checksum(data):
+    """XOR of the bytes between '$' and '*', eight bytes at a time."""
+    pad = -len(data) % 8
+    words = struct.unpack(f'<{(len(data) + pad) // 8}Q', bytes(data) + bytes(pad))
+    value = reduce(xor, words, 0)
+    value ^= value >> 32
+    value ^= value >> 16
+    value ^= value >> 8
+    return value & 0xFF
+
+def ubx_frame(msg, payload=b''):
+    """Builds a UBX frame for msg = (class, id)."""
+    body = UBX_HEADER.pack(msg[0], msg[1], len(payload)) + payload
+    return UBX_SYNC + body + ubx_checksum(body)
+
+class StreamDemux:
+    """
+    Splits a byte stream into UBX frames and NMEA sentences.
+
+    feed() scans the new bytes once, keeping an incomplete message for the
+    next call. Valid messages are dispatched to the handlers subscribed with
+    subscribe(): UBX messages by (class, id) and NMEA sentences by type
+    ('GGA', 'RMC', 'PUBX'...). Known UBX messages (UBX_TYPES) are passed as
+    namedtuples and the rest as the payload bytes; NMEA sentences as
+    NMEASentence. Messages are only decoded if someone is subscribed to them.
+    default_ubx(msg, payload) and default_nmea(sentence) receive everything.
+    Frames that fail their checksum are counted in bad_ubx / bad_nmea.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.handlers = {}
+        self.default_ubx = None
+        self.default_nmea = None
+        self.bad_ubx = 0
+        self.bad_nmea = 0
+
+    def subscribe(self, key, handler):
+        self.handlers.setdefault(key, []).append(handler)
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        length = len(buffer)
+        position = 0
+        # Start of the next candidate of each kind, searched again only once passed
+        next_ubx = buffer.find(UBX_SYNC)
+        next_nmea = buffer.find(b'$')
+        while True:
+            if next_nmea >= 0 and (next_ubx < 0 or next_nmea < next_ubx):
+                start = next_nmea
+                # Sentences are ASCII, so none runs past the next UBX sync
+                bounded = 0 <= next_ubx < start + MAX_NMEA_LENGTH
+                end = buffer.find(b'\r\n', start + 1, next_ubx if bounded else start + MAX_NMEA_LENGTH)
+                if end < 0:
+                    if not bounded and length - start < MAX_NMEA_LENGTH:
+                        position = start            # Incomplete: wait for the rest
+                        break
+                    position = start + 1            # A '$' that does not start a sentence
+                elif self._nmea(buffer, start, end):
+                    position = end + 2
+                else:
+                    position = start + 1
+            elif next_ubx >= 0:
+                start = next_ubx
+                if length < start + 6:
+                    position = start
+                    break
+                msg_class, msg_id, size = UBX_HEADER.unpack_from(buffer, start + 2)
+                end = start + 8 + size
+                if (msg_class not in UBX_CLASSES or size > MAX_UBX_PAYLOAD
+                        or UBX_SIZES.get((msg_class, msg_id), size) != size):
+                    self.bad_ubx += 1
+                    position = start + 2
+                elif length < end:
+                    position = start
+                    break
+                elif ubx_checksum(buffer[start + 2:end - 2]) == buffer[end - 2:end]:
+                    self._ubx((msg_class, msg_id), buffer[start + 6:end - 2])
+                    position = end
+                else:
+                    self.bad_ubx += 1
+                    position = start + 2
+            else:
+                # Nothing left; keep a trailing 0xB5 that may start a sync
+                position = length - 1 if buffer.endswith(UBX_SYNC[:1]) else length
+                break
+            if 0 <= next_ubx < position:
+                next_ubx = buffer.find(UBX_SYNC, position)
+            if 0 <= next_nmea < position:
+                next_nmea = buffer.find(b'$', position)
+        del buffer[:position]
+
+    def _ubx(self, msg, payload):
+        handlers = self.handlers.get(msg)
+        if handlers:
+            decoder = UBX_TYPES.get(msg)
+            if decoder is not None and len(payload) == decoder[0].size:
+                message = decoder[1]._make(decoder[0].unpack(payload))
+            else:
+                message = bytes(payload)
+            for handler in handlers:
+                handler(message)
+        if self.default_ubx is not None:
+            self.default_ubx(msg, bytes(payload))
+
+    def _nmea(self, buffer, start, end):
+        """Validates and dispatches the sentence buffer[start:end]. Returns False if it is not valid."""
+        star = end - 3
+        if star <= start or buffer[star] != 0x2A:       # '*hh' before CR LF
+            self.bad_nmea += 1
+            return False
+        if buffer.find(b'$', start + 1, star) >= 0:
+            # Stray '$' before the real one: pairs of them cancel out in the
+            # XOR, so the checksum alone does not reject them. The sentence
+            # is tried again from the next '$'
+            self.bad_nmea += 1
+            return False
+        try:
+            if nmea_checksum(buffer[start + 1:star]) != int(buffer[star + 1:end], 16):
+                self.bad_nmea += 1
+                return False
+            raw = buffer[start:end].decode('ascii')
+        except (ValueError, UnicodeDecodeError):
+            self.bad_nmea += 1
+            return False
+
+        comma = raw.find(',')
+        address = raw[1:comma] if comma > 0 else raw[1:star - start]
+        talker, kind = ('', address) if address.startswith('P') else (address[:2], address[2:])
+        handlers = self.handlers.get(kind)
+        if handlers or self.default_nmea is not None:
+            sentence = NMEASentence(talker, kind, tuple(raw[comma + 1:star - start].split(',')) if comma > 0 else (), raw)
+            for handler in handlers or ():
+                handler(sentence)
+            if self.default_nmea is not None:
+                self.default_nmea(sentence)
+        return True
+
+class UbloxStream:
+    """
+    Background reader of a u-blox receiver.
+
+    start() launches a thread that reads the port and feeds a StreamDemux.
+    It keeps the last message of each of `messages` with the time it arrived
+    and the last NMEA sentence. configure_periodic() asks the receiver to
+    output the navigation messages with every solution.
+    """
+
+    def __init__(self, serial_port, messages=(UBX_NAV_PVT, UBX_NAV_HPPOSLLH, UBX_NAV_ATT)):
+        self.serial_port = serial_port
+        self.messages = {}          # {(class, id): (message, time.monotonic())}
+        self.nmea = None
+        self.demux = StreamDemux()
+        for msg in messages:
+            self.demux.subscribe(msg, lambda message, msg=msg: self._store(msg, message))
+        self.demux.subscribe(UBX_ACK_ACK, lambda ack: self._ack(ack, True))
+        self.demux.subscribe(UBX_ACK_NAK, lambda ack: self._ack(ack, False))
+        self.demux.default_nmea = self._handle_nmea
+        self.error = None
+        self.lock = threading.Lock()
+        self.acks = threading.Condition(self.lock)
+        self.ack_status = {}        # {(class, id) configured: True (ACK) / False (NAK)}
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='UbloxStream', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                chunk = self.serial_port.read(self.serial_port.in_waiting or 1)
+            except (serial.SerialException, OSError) as e:
+                self.error = e
+                return
+            if chunk:
+                self.demux.feed(chunk)
+
+    def _handle_nmea(self, sentence):
+        self.nmea = sentence.raw
+
+    def _store(self, msg, message):
+        with self.lock:
+            self.messages[msg] = (message, time.monotonic())
+
+    def _ack(self, ack, accepted):
+        with self.lock:
+            self.ack_status[(ack.clsID, ack.msgID)] = accepted
+            self.acks.notify_all()
+
+    def send_config(self, msg, payload, timeout=ACK_TIMEOUT):
+        """Sends a configuration message and waits for its ACK. Returns True (ACK), False (NAK) or None."""
+        with self.lock:
+            self.ack_status.pop(msg, None)
+        self.serial_port.write(ubx_frame(msg, payload))
+        with self.lock:
+            self.acks.wait_for(lambda: msg in self.ack_status, timeout)
+            return self.ack_status.get(msg)
+
+    def configure_periodic(self, messages=(UBX_NAV_PVT, UBX_NAV_HPPOSLLH, UBX_NAV_ATT), rate=1):
+        """
+        Enables the periodic output of `messages`, once every `rate` navigation
+        solutions. Uses CFG-VALSET (RAM layer) and falls back to the legacy
+        CFG-MSG if the receiver rejects it. Returns True if the receiver
+        acknowledged the configuration.
+        """
+        payload = struct.pack('<BBxx', 0, VALSET_LAYER_RAM)
+        for msg in messages:
+            for key in MSGOUT_KEYS[msg]:
+                payload += struct.pack('<IB', key, rate)
+        if self.send_config(UBX_CFG_VALSET, payload):
+            return True
+        return all([self.send_config(UBX_CFG_MSG, bytes((msg[0], msg[1], rate))) for msg in messages])
+
+    def latest(self, msg, max_age=SOLUTION_MAX_AGE):
+        """Returns the last `msg` received, or None if there is none recent."""
+        with self.lock:
+            entry = self.messages.get(msg)
+        if entry is None or time.monotonic() - entry[1] > max_age:
+            return None
+        return entry[0]
+
+class GPSPortManager:
+    """
+    Keeps track of the serial port of the GPS.
+
+    resolve() returns the stable path of the port. While that path exists no
+    enumeration is done; when it is missing the ports are enumerated again
+    only if a tty/usb device was added or removed since the last attempt, or
+    every PORT_RESCAN_INTERVAL seconds.
+    """
+
+    def __init__(self, description=None, hwid=None):
+        self.description = description
+        self.hwid = hwid
+        self.path = None
+        self.last_scan = None
+        self.uevents = open_uevent_socket()
+
+    def resolve(self):
+        if self.path and os.path.exists(self.path):
+            return self.path
+        hotplug = self.hotplug_event()
+        if not hotplug and self.last_scan is not None and time.monotonic() - self.last_scan < PORT_RESCAN_INTERVAL:
+            return None
+        self.last_scan = time.monotonic()
+        device = find_gps_port(self.description, self.hwid)
+        self.path = stable_path(device) if device else None
+        return self.path
+
+    def hotplug_event(self):
+        """Returns True if a serial or USB device was added or removed since the last call."""
+        if self.uevents is None:
+            return False
+        event = False
+        while True:
+            try:
+                message = self.uevents.recv(8192)
+            except OSError:         # BlockingIOError: nothing left
+                return event
+            if b'SUBSYSTEM=tty' in message or b'SUBSYSTEM=usb' in message:
+                event = True
+
+    def close(self):
+        if self.uevents is not None:
+            self.uevents.close()
+            self.uevents = None
+
+def find_gps_port(description=None, hwid=None):
+    """Enumerates the serial ports and returns the device of the GPS (None if not found)."""
+    for port in list_ports.comports():
+        if description and description in port.description:
+            return port.device
+        if hwid and hwid in port.hwid:
+            return port.device
+    return None
+
+def stable_path(device):
+    """Returns the /dev/serial/by-id link of `device` if there is one, otherwise `device`."""
+    try:
+        target = os.path.realpath(device)
+        for name in os.listdir(BY_ID_DIR):
+            link = os.path.join(BY_ID_DIR, name)
+            if os.path.realpath(link) == target:
+                return link
+    except OSError:
+        pass
+    return device
+
+def open_uevent_socket(groups=UEVENT_GROUPS):
+    """Non-blocking socket that receives device uevents (None if not available)."""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, groups))
+        sock.setblocking(False)
+        return sock
+    except (AttributeError, OSError):
+        return None
 
 class GPSHandler:
+    """
+    NEO-M9N on a serial port. The port is opened on creation if the GPS is
+    connected; otherwise, and whenever the connection is lost, GPSprogram()
+    reconnects (reopening the cached port path, without enumerating ports).
+    """
+
     def __init__(self, baudrate, timeout, description=None, hwid=None):
         self.baudrate = baudrate
         self.timeout = timeout
         self.description = description
         self.hwid = hwid
-        self.port = self.find_gps_port(description, hwid)
+        self.ports = GPSPortManager(description, hwid)
+        self.port = self.ports.resolve()
         self.serial_port = None
         self.gps = None
-        self.initialize_gps()
+        if self.port:
+            try:
+                self.initialize_gps()
+            except (serial.SerialException, OSError) as e:
+                print(f"Error opening the GPS: {e}")
 
     def find_gps_port(self, description, hwid):
-        ports = list_ports.comports()
-        for port in ports:
-            if description and description in port.description:
-                return port.device
-            if hwid and hwid in port.hwid:
-                return port.device
-        return None
+        return find_gps_port(description, hwid)
 
     def initialize_gps(self):
+        self.close()
+        self.port = self.ports.resolve()
         if not self.port:
             raise Exception("GPS port not found.")
-        self.serial_port = serial.Serial(self.port, baudrate=self.baudrate, timeout=self.timeout)
-        self.gps = UbloxGps(self.serial_port)
+        try:
+            self.serial_port = serial.Serial(self.port, baudrate=self.baudrate, timeout=self.timeout)
+        except (serial.SerialException, OSError):
+            self.ports.path = None      # Stale path: look for the GPS again
+            raise
+        self.gps = UbloxStream(self.serial_port)
+        self.gps.start()
+        if not self.gps.configure_periodic():
+            print("The GPS did not acknowledge the periodic output configuration.")
+
+    @property
+    def connected(self):
+        return (self.gps is not None and self.gps.running
+                and self.serial_port is not None and self.serial_port.is_open)
+
+    def close(self):
+        if self.gps is not None:
+            self.gps.stop()
+            self.gps = None
+        if self.serial_port is not None:
+            self.serial_port.close()
+            self.serial_port = None
 
     def GPSprogram(self):
-        if not self.gps or not self.serial_port or not self.serial_port.is_open:
+        if not self.connected:
             self.initialize_gps()  # Re-initialize GPS if not properly initialized
         try:
-            while True:
-                data = {
-                    'Latitude': None,
-                    'Longitude': None,
-                    'Altitude': None,
-                    'Heading of Motion': None,
-                    'Roll': None,
-                    'Pitch': None,
-                    'Heading': None,
-                    'NMEA Sentence': None,
-                }
-
-                geo = self.gps.geo_coords()
-                veh = self.gps.veh_attitude()
-                stream_nmea = self.gps.stream_nmea()
-                hp_geo = self.gps.hp_geo_coords()
-
-                if geo is not None:
-                    data['Latitude'] = geo.lat
-                    data['Longitude'] = geo.lon
-                    data['Altitude'] = geo.height/1000
-                    data['Heading of Motion'] = geo.headMot
-
-                if veh is not None:
-                    data['Roll'] = veh.roll
-                    data['Pitch'] = veh.pitch
-                    data['Heading'] = veh.heading
-
-                if stream_nmea is not None:
-                    data['NMEA Sentence'] = stream_nmea
-
-                if hp_geo is not None:
-                    data['Latitude'] = hp_geo.latHp
-                    data['Longitude'] = hp_geo.lonHp
-                    data['Altitude'] = hp_geo.heightHp/1000
-                
-                return data
-                    
+            data = {
+                'Latitude': None,
+                'Longitude': None,
+                'Altitude': None,
+                'Heading of Motion': None,
+                'Roll': None,
+                'Pitch': None,
+                'Heading': None,
+                'NMEA Sentence': None,
+            }
+
+            pvt = self.gps.latest(UBX_NAV_PVT)
+            hp_geo = self.gps.latest(UBX_NAV_HPPOSLLH)
+            att = self.gps.latest(UBX_NAV_ATT)
+
+            if pvt is not None:
+                data['Latitude'] = pvt.lat * 1e-7
+                data['Longitude'] = pvt.lon * 1e-7
+                data['Altitude'] = pvt.height / 1000
+                data['Heading of Motion'] = pvt.headMot * 1e-5
+
+            if att is not None:
+                data['Roll'] = att.roll * 1e-5
+                data['Pitch'] = att.pitch * 1e-5
+                data['Heading'] = att.heading * 1e-5
+
+            data['NMEA Sentence'] = self.gps.nmea
+
+            if hp_geo is not None and not hp_geo.flags & 0x01:     # invalidLlh
+                # Standard part in 1e-7 deg and mm, high precision part in 1e-9 deg and 0.1 mm
+                data['Latitude'] = hp_geo.lat * 1e-7 + hp_geo.latHp * 1e-9
+                data['Longitude'] = hp_geo.lon * 1e-7 + hp_geo.lonHp * 1e-9
+                data['Altitude'] = (hp_geo.height + hp_geo.heightHp * 0.1) / 1000
+
+            return data
+
         except (ValueError, IOError) as err:
             return {"Error": str(err)}
-        
+
 if __name__ == '__main__':
     import sys
     gps_handler = GPSHandler(baudrate=38400, timeout=1, description=None, hwid="1546:01A9")
     try:
         while True:
-            gps_handler.GPSprogram()  # Add a small delay to prevent CPU overuse
+            print(gps_handler.GPSprogram())
+            time.sleep(1)
     except Exception as e:
         print(f"An error occurred: {e}")
         sys.exit(1)
-    
-    
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+*                                                                            *
+*               Developed by Javier Bolañs & Javier Lendinez                 *
+*                  https://github.com/javierbolanosllano                     *
+*                        https://github.com/JaviLendi                        *
+*                                                                            *
+*                      UAXSAT IV Project - 2024                              *
+*                   https://github.com/UAXSat/UAXSat                         *
+*                                                                            *
+* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
+
+# I2Cbusmodule.py
+#
+# board.I2C() returns a new busio.I2C on every call, each with its own file
+# descriptor and its own lock, so sensors read from different threads can
+# interleave their transactions on the same wires. This module keeps a single
+# I2CBus per physical bus (/dev/i2c-N) and every sensor gets a client of it with
+# get_i2c(priority). Clients have the busio.I2C interface, so the Adafruit
+# drivers (through I2CDevice) use them unchanged.
+#
+# try_lock() waits for the bus instead of failing, and when several threads are
+# waiting the one with the lowest priority value gets it first (the IMU FIFO is
+# drained before a BMP or UV read). The lock is re-entrant, so a driver can keep
+# it across several transfers.
+#
+# Every transfer is a single I2C_RDWR ioctl on buffers passed to the kernel
+# without copies. transfer() takes any list of messages, also to different
+# addresses, and runs them back to back (repeated START, one STOP at the end);
+# prepare() builds the ioctl arguments once for a transfer that is repeated.
+import os
+import heapq
+import ctypes
+import itertools
+import threading
+from collections import namedtuple
+from fcntl import ioctl
+
+DEFAULT_BUS = 1
+
+I2C_RDWR = 0x0707       # Combined read/write transfer, one STOP only
+I2C_M_RD = 0x0001
+I2C_RDWR_MAX_MSGS = 42  # Messages per ioctl accepted by the kernel
+
+# Lower values are served first
+PRIORITY_IMU = 0
+PRIORITY_UV = 10
+PRIORITY_BMP = 20
+DEFAULT_PRIORITY = 10
+
+class _i2c_msg(ctypes.Structure):
+    _fields_ = [('addr', ctypes.c_uint16), ('flags', ctypes.c_uint16),
+                ('len', ctypes.c_uint16), ('buf', ctypes.POINTER(ctypes.c_uint8))]
+
+class _i2c_rdwr_ioctl_data(ctypes.Structure):
+    _fields_ = [('msgs', ctypes.POINTER(_i2c_msg)), ('nmsgs', ctypes.c_uint32)]
+
+Message = namedtuple('Message', 'address flags buffer start end')
+
+def write_message(address, buffer, start=0, end=None):
+    """Message that writes buffer[start:end] to `address`."""
+    return Message(address, 0, buffer, start, len(buffer) if end is None else end)
+
+def read_message(address, buffer, start=0, end=None):
+    """Message that reads from `address` into buffer[start:end]."""
+    return Message(address, I2C_M_RD, buffer, start, len(buffer) if end is None else end)
+
+def _c_buffer(message):
+    """ctypes view of the message buffer (a copy only for read-only data to write)."""
+    array_type = ctypes.c_uint8 * (message.end - message.start)
+    try:
+        return array_type.from_buffer(message.buffer, message.start)
+    except TypeError:
+        if message.flags & I2C_M_RD:
+            raise
+        return array_type.from_buffer_copy(message.buffer, message.start)
+
+class Transaction:
+    """Arguments of the I2C_RDWR ioctls of a list of messages, built once."""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.buffers = [_c_buffer(message) for message in self.messages]
+        self.requests = []
+        for first in range(0, len(self.messages), I2C_RDWR_MAX_MSGS):
+            chunk = range(first, min(first + I2C_RDWR_MAX_MSGS, len(self.messages)))
+            msgs = (_i2c_msg * len(chunk))()
+            for msg, i in zip(msgs, chunk):
+                message = self.messages[i]
+                msg.addr = message.address & 0x7F
+                msg.flags = message.flags
+                msg.len = message.end - message.start
+                msg.buf = ctypes.cast(self.buffers[i], ctypes.POINTER(ctypes.c_uint8))
+            request = _i2c_rdwr_ioctl_data(msgs, len(chunk))
+            self.requests.append((request, msgs))
+
+class I2CBus:
+    """
+    One physical I2C bus shared by every thread.
+
+    Parameters:
+    - bus_id: Number N of /dev/i2c-N.
+    """
+
+    def __init__(self, bus_id=DEFAULT_BUS):
+        self.bus_id = bus_id
+        try:
+            self.fd = os.open(f'/dev/i2c-{bus_id}', os.O_RDWR)
+        except FileNotFoundError:
+            raise RuntimeError(f"I2C bus #{bus_id} not found, check if it is enabled") from None
+        self.condition = threading.Condition()
+        self.owner = None
+        self.depth = 0
+        self.waiting = []       # Heap of (priority, arrival, thread)
+        self.arrivals = itertools.count()
+        self.transfers = 0
+
+    def acquire(self, priority=DEFAULT_PRIORITY):
+        """Waits for the bus; waiting threads get it in order of priority, then arrival."""
+        me = threading.get_ident()
+        with self.condition:
+            if self.owner == me:
+                self.depth += 1
+                return
+            if self.owner is not None or self.waiting:
+                ticket = (priority, next(self.arrivals), me)
+                heapq.heappush(self.waiting, ticket)
+                while self.owner is not None or self.waiting[0] is not ticket:
+                    self.condition.wait()
+                heapq.heappop(self.waiting)
+            self.owner = me
+            self.depth = 1
+
+    def release(self):
+        with self.condition:
+            if self.owner != threading.get_ident():
+                raise RuntimeError("I2C bus released by a thread that does not hold it")
+            self.depth -= 1
+            if self.depth == 0:
+                self.owner = None
+                self.condition.notify_all()
+
+    def prepare(self, messages):
+        """Returns a Transaction to run the messages with run(), possibly many times."""
+        return Transaction(messages)
+
+    def run(self, transaction, priority=DEFAULT_PRIORITY):
+        """Runs a prepared transaction (one ioctl per I2C_RDWR_MAX_MSGS messages)."""
+        self.acquire(priority)
+        try:
+            for request, _ in transaction.requests:
+                ioctl(self.fd, I2C_RDWR, request)
+            self.transfers += 1
+        finally:
+            self.release()
+
+    def transfer(self, messages, priority=DEFAULT_PRIORITY):
+        """Runs the messages back to back, with no other transfer in between."""
+        self.run(Transaction(messages), priority)
+
+    def scan(self):
+        """Returns the addresses that acknowledge a one-byte read (0x08..0x77)."""
+        found = []
+        buffer = bytearray(1)
+        for address in range(0x08, 0x78):
+            try:
+                self.transfer([read_message(address, buffer)])
+            except OSError:
+                continue
+            found.append(address)
+        return found
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __repr__(self):
+        return f"I2CBus(bus_id={self.bus_id})"
+
+class I2CClient:
+    """
+    busio.I2C interface to a shared I2CBus with a fixed priority, for the
+    Adafruit drivers (I2CDevice) and the sensor modules.
+    """
+
+    def __init__(self, bus, priority=DEFAULT_PRIORITY):
+        self.bus = bus
+        self.priority = priority
+
+    def try_lock(self):
+        """Waits until the bus is free (never fails, unlike busio.I2C)."""
+        self.bus.acquire(self.priority)
+        return True
+
+    def unlock(self):
+        self.bus.release()
+
+    def scan(self):
+        return self.bus.scan()
+
+    def writeto(self, address, buffer, *, start=0, end=None, stop=True):
+        self.bus.transfer([write_message(address, buffer, start, end)], self.priority)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None, stop=True):
+        self.bus.transfer([read_message(address, buffer, start, end)], self.priority)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None,
+                              in_start=0, in_end=None, stop=False):
+        self.bus.transfer([write_message(address, buffer_out, out_start, out_end),
+                           read_message(address, buffer_in, in_start, in_end)], self.priority)
+
+    def prepare(self, messages):
+        return self.bus.prepare(messages)
+
+    def run(self, transaction):
+        self.bus.run(transaction, self.priority)
+
+    def transfer(self, messages):
+        self.bus.transfer(messages, self.priority)
+
+    def deinit(self):
+        """The bus is shared; it is closed with close_buses()."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+def get_bus(bus_id=DEFAULT_BUS):
+    """Returns the I2CBus of /dev/i2c-<bus_id>, opening it on first use."""
+    with _buses_lock:
+        bus = _buses.get(bus_id)
+        if bus is None:
+            bus = _buses[bus_id] = I2CBus(bus_id)
+        return bus
+
+def get_i2c(priority=DEFAULT_PRIORITY, bus_id=DEFAULT_BUS):
+    """Replacement for board.I2C(): a client of the shared bus with the given priority."""
+    return I2CClient(get_bus(bus_id), priority)
+
+def close_buses():
+    with _buses_lock:
+        for bus in _buses.values():
+            bus.close()
+        _buses.clear()
+
+def main():
+    bus = get_bus()
+    print(f"Devices on /dev/i2c-{bus.bus_id}: {[hex(address) for address in bus.scan()]}")
+    close_buses()
+
+if __name__ == '__main__':
+    main()
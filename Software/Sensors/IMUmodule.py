@@ -11,12 +11,52 @@
 
 # IMUmodule.py
 import time
-import board
+import math
+import struct
+import numpy as np
 import adafruit_icm20x
+from Software.Sensors.I2Cbusmodule import get_i2c, write_message, read_message, PRIORITY_IMU
+
+# Registros del ICM20948 (banco de usuario 0)
+_REG_BANK_SEL = 0x7F
+_USER_CTRL = 0x03
+_FIFO_EN_1 = 0x66
+_FIFO_EN_2 = 0x67
+_FIFO_RST = 0x68
+_FIFO_MODE = 0x69
+_FIFO_COUNTH = 0x70
+_FIFO_R_W = 0x72
+_ACCEL_XOUT_H = 0x2D
+
+# Bloque contiguo leído en una transacción: ACCEL_XOUT..GYRO_ZOUT y TEMP_OUT (big
+# endian) seguidos de EXT_SLV_SENS_DATA_00..05, el magnetómetro (little endian)
+_ACCEL_GYRO_TEMP = struct.Struct('>7h')
+_MAG_DATA = struct.Struct('<3h')
+_DATA_BLOCK_SIZE = _ACCEL_GYRO_TEMP.size + _MAG_DATA.size
+
+IMU_KEYS = ("ACELX", "ACELY", "ACELZ", "GIROX", "GIROY", "GIROZ", "MAGX", "MAGY", "MAGZ")
+
+_USER_CTRL_FIFO_EN = 0x40
+_FIFO_EN_1_SLV_0 = 0x01         # Datos del esclavo 0 del maestro I2C (magnetómetro)
+_FIFO_EN_2_ACCEL_GYRO = 0x1E    # Acelerómetro y giroscopio X, Y, Z
+_FIFO_MODE_SNAPSHOT = 0x1F      # Con la FIFO llena no se escribe más (las muestras no se desalinean)
+_FIFO_SIZE = 512                # Bytes
+_FIFO_COUNT_MASK = 0x1FFF
+
+_MAG_UT_PER_LSB = 0.15
+_RAD_PER_DEG = math.pi / 180
+
+# Una muestra en la FIFO: acelerómetro y giroscopio (big endian) y los 9 bytes que
+# el maestro I2C lee del magnetómetro AK09916 (HX, HY, HZ little endian, TMPS, ST2...)
+FIFO_RECORD = np.dtype([('accel', '>i2', 3), ('gyro', '>i2', 3), ('mag', '<i2', 3), ('mag_status', 'u1', 3)])
+
+# Muestras decodificadas: tiempo (s, epoch), m/s^2, rad/s y uT, como las propiedades de adafruit_icm20x
+IMU_SAMPLE = np.dtype([('time', 'f8'), ('accel', 'f4', 3), ('gyro', 'f4', 3), ('mag', 'f4', 3)])
 
 # Función para inicializar el sensor ICM
 def initialize_sensor():
-    i2c = board.I2C()  # Utiliza board.SCL y board.SDA por defecto
+    # Bus compartido con prioridad máxima: la FIFO se vacía antes que las lecturas del BMP o del UV
+    i2c = get_i2c(PRIORITY_IMU)
     icm = adafruit_icm20x.ICM20948(i2c)
     return icm
 
@@ -32,10 +72,179 @@ def read_gyro(icm):
 def read_magnetic(icm):
     return icm.magnetic
 
+# Factores de conversión de las cuentas en bruto a m/s^2, rad/s y uT
+def scale_factors(icm):
+    accel = adafruit_icm20x.G_TO_ACCEL / adafruit_icm20x.AccelRange.lsb[icm.accelerometer_range]
+    gyro = _RAD_PER_DEG / adafruit_icm20x.GyroRange.lsb[icm.gyro_range]
+    return accel, gyro, _MAG_UT_PER_LSB
+
+class IMUReader:
+    """
+    Lectura rápida del ICM20948: acelerómetro, giroscopio, temperatura y
+    magnetómetro están en registros contiguos (ACCEL_XOUT_H..EXT_SLV_SENS_DATA_05),
+    así que se leen en una sola transferencia I2C a un buffer reutilizable y se
+    convierten con factores de escala precalculados.
+
+    Si se cambia el rango del acelerómetro o del giroscopio hay que llamar a
+    refresh_scales().
+    """
+
+    def __init__(self, icm):
+        self.icm = icm
+        self.bank_buffer = bytes((_REG_BANK_SEL, 0))
+        self.obuffer = bytes((_ACCEL_XOUT_H,))
+        self.ibuffer = bytearray(_DATA_BLOCK_SIZE)
+        # Selección del banco, registro inicial y lectura del bloque en un solo
+        # ioctl I2C_RDWR, preparado una vez (adafruit_icm20x puede haber dejado
+        # seleccionado otro banco)
+        self.i2c = icm.i2c_device.i2c
+        address = icm.i2c_device.device_address
+        self.transaction = self.i2c.prepare([write_message(address, self.bank_buffer),
+                                             write_message(address, self.obuffer),
+                                             read_message(address, self.ibuffer)])
+        self.refresh_scales()
+
+    def refresh_scales(self):
+        self.accel_scale, self.gyro_scale, self.mag_scale = scale_factors(self.icm)
+
+    def read(self):
+        """ Devuelve (ax, ay, az, gx, gy, gz, mx, my, mz) en m/s^2, rad/s y uT """
+        self.i2c.run(self.transaction)
+        ax, ay, az, gx, gy, gz, _ = _ACCEL_GYRO_TEMP.unpack_from(self.ibuffer)
+        mx, my, mz = _MAG_DATA.unpack_from(self.ibuffer, _ACCEL_GYRO_TEMP.size)
+        a, g, m = self.accel_scale, self.gyro_scale, self.mag_scale
+        return (ax * a, ay * a, az * a, gx * g, gy * g, gz * g, mx * m, my * m, mz * m)
+
+# Función para inicializar el lector rápido (una transacción I2C por muestra)
+def initialize_reader():
+    return IMUReader(initialize_sensor())
+
+# Devuelve los 9 valores como tupla (mismo orden que IMU_KEYS) o None si hay error
+def read_sensor_values(reader):
+    try:
+        return reader.read()
+    except Exception as e:
+        print(f"Error reading the IMU: {e}")
+        return None
+
+class IMUFifo:
+    """
+    Lectura del ICM20948 a través de su FIFO.
+
+    El sensor guarda cada muestra (acelerómetro, giroscopio y magnetómetro) en
+    la FIFO a la frecuencia elegida; read() la vacía con una sola lectura I2C y
+    decodifica todas las muestras a la vez en un array de NumPy (IMU_SAMPLE),
+    con la marca de tiempo de cada muestra. La FIFO tiene 512 bytes (24
+    muestras), así que hay que llamar a read() antes de que se llene: cada
+    ~100 ms a 225 Hz. Las veces que se llenó se cuentan en `overflows`.
+
+    Con `calibration` (MagCalibrationmodule.MagCalibration) las lecturas del
+    magnetómetro se usan para ajustar la calibración y se devuelven ya
+    calibradas.
+    """
+
+    def __init__(self, icm, rate_hz=225, calibration=None):
+        self.icm = icm
+        self.calibration = calibration
+        self.requested_rate = rate_hz
+        self.rate_hz = None
+        self.buffer = bytearray(_FIFO_SIZE - _FIFO_SIZE % FIFO_RECORD.itemsize)
+        self.overflows = 0
+        self.next_time = None
+
+    def _write(self, reg, value):
+        with self.icm.i2c_device as i2c:
+            i2c.write(bytes((reg, value)))
+
+    def _read(self, reg, buffer):
+        with self.icm.i2c_device as i2c:
+            i2c.write_then_readinto(bytes((reg,)), buffer)
+        return buffer
+
+    def _reset_fifo(self):
+        self._write(_FIFO_RST, 0x1F)
+        self._write(_FIFO_RST, 0x00)
+
+    def start(self):
+        """ Configura la frecuencia de muestreo y activa la FIFO """
+        icm = self.icm
+        # El mismo divisor para el giroscopio (1100 Hz) y el acelerómetro (1125 Hz)
+        divisor = min(255, max(0, round(1100 / self.requested_rate) - 1))
+        icm.gyro_data_rate_divisor = divisor
+        icm.accelerometer_data_rate_divisor = divisor
+        self.rate_hz = 1100 / (1 + divisor)
+        self.accel_scale, self.gyro_scale, self.mag_scale = scale_factors(icm)
+
+        self._write(_REG_BANK_SEL, 0)
+        user_ctrl = self._read(_USER_CTRL, bytearray(1))[0]
+        self._write(_USER_CTRL, user_ctrl & ~_USER_CTRL_FIFO_EN)
+        self._write(_FIFO_EN_1, _FIFO_EN_1_SLV_0)
+        self._write(_FIFO_EN_2, _FIFO_EN_2_ACCEL_GYRO)
+        self._write(_FIFO_MODE, _FIFO_MODE_SNAPSHOT)
+        self._reset_fifo()
+        self._write(_USER_CTRL, user_ctrl | _USER_CTRL_FIFO_EN)
+        self.next_time = time.time() + 1 / self.rate_hz
+
+    def stop(self):
+        """ Desactiva la FIFO """
+        self._write(_REG_BANK_SEL, 0)
+        user_ctrl = self._read(_USER_CTRL, bytearray(1))[0]
+        self._write(_USER_CTRL, user_ctrl & ~_USER_CTRL_FIFO_EN)
+        self._write(_FIFO_EN_1, 0)
+        self._write(_FIFO_EN_2, 0)
+
+    def read(self):
+        """ Vacía la FIFO y devuelve las muestras como array IMU_SAMPLE (puede estar vacío) """
+        now = time.time()
+        count = int.from_bytes(self._read(_FIFO_COUNTH, bytearray(2)), 'big') & _FIFO_COUNT_MASK
+        n = min(count, len(self.buffer)) // FIFO_RECORD.itemsize
+        full = count > _FIFO_SIZE - FIFO_RECORD.itemsize
+
+        if n:
+            self._read(_FIFO_R_W, memoryview(self.buffer)[:n * FIFO_RECORD.itemsize])
+        if full:
+            # Se han perdido muestras: se vacía la FIFO y se vuelve a sincronizar el tiempo
+            self.overflows += 1
+            self._reset_fifo()
+
+        raw = np.frombuffer(self.buffer, dtype=FIFO_RECORD, count=n)
+        samples = np.empty(n, dtype=IMU_SAMPLE)
+        samples['accel'] = raw['accel'] * self.accel_scale
+        samples['gyro'] = raw['gyro'] * self.gyro_scale
+        mag = raw['mag'] * self.mag_scale
+        if self.calibration is not None and n:
+            self.calibration.add(mag)
+            mag = self.calibration.apply(mag)
+        samples['mag'] = mag
+
+        # Las muestras están separadas 1/rate_hz. Se sigue el reloj del sensor y
+        # solo se reajusta a la hora del sistema si se desvía más de dos periodos.
+        period = 1 / self.rate_hz
+        last_time = self.next_time + (n - 1) * period
+        if full or abs(last_time - now) > 2 * period:
+            last_time = now
+        samples['time'] = last_time - period * np.arange(n - 1, -1, -1)
+        self.next_time = last_time + period
+        return samples
+
+# Genera bloques de muestras (arrays IMU_SAMPLE) leyendo la FIFO cada `interval` segundos
+def stream_sensor_data(icm, rate_hz=225, interval=0.05):
+    fifo = IMUFifo(icm, rate_hz)
+    fifo.start()
+    try:
+        while True:
+            time.sleep(interval)
+            samples = fifo.read()
+            if len(samples):
+                yield samples
+    finally:
+        fifo.stop()
+
+# Acepta el sensor (ICM20948) o un IMUReader; devuelve un diccionario con IMU_KEYS
 def read_sensor_data(icm):
     try:
-        acceleration, gyro, magnetic = read_acceleration(icm), read_gyro(icm), read_magnetic(icm)
-        return {"ACELX": acceleration[0], "ACELY": acceleration[1], "ACELZ": acceleration[2], "GIROX": gyro[0], "GIROY": gyro[1], "GIROZ": gyro[2], "MAGX": magnetic[0], "MAGY": magnetic[1], "MAGZ": magnetic[2]}
+        reader = icm if isinstance(icm, IMUReader) else IMUReader(icm)
+        return dict(zip(IMU_KEYS, reader.read()))
     except Exception as e:
         print(f"Error reading the IMU: {e}")
         return None
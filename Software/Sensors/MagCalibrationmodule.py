@@ -0,0 +1,294 @@
+"""* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+*                                                                            *
+*               Developed by Javier Bolañs & Javier Lendinez                 *
+*                  https://github.com/javierbolanosllano                     *
+*                        https://github.com/JaviLendi                        *
+*                                                                            *
+*                      UAXSAT IV Project - 2024                              *
+*                   https://github.com/UAXSat/UAXSat                         *
+*                                                                            *
+* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
+
+# MagCalibrationmodule.py
+#
+# Online hard/soft-iron calibration of the ICM20948 magnetometer.
+#
+# Raw readings lie on an ellipsoid (x - c)^T M (x - c) = 1: the centre c is the
+# hard-iron offset and M the soft-iron distortion. The calibration maps them
+# onto a sphere of the same mean radius with W (x - c), W = r * sqrtm(M).
+#
+# Samples are kept in a bounded reservoir split into direction bins, so a long
+# time spent in one orientation cannot push out the rest of the sphere.
+# Directions are taken from the fitted offset or, before the first fit, from
+# the midpoint of the smallest and largest reading on each axis (the hard-iron
+# offset can be larger than the field itself). The reservoir is binned again
+# whenever that centre may have moved. The fit
+# is a single least-squares solve over the reservoir, repeated every
+# `refit_every` new samples. With too few directions for a full ellipsoid only
+# the offset is fitted (sphere). The calibration and the reservoir are saved to
+# disk, so the heading is usable from start-up and the fit keeps improving
+# across runs.
+import os
+import time
+import logging
+import numpy as np
+
+DEFAULT_PATH = os.path.expanduser('~/mag_calibration.npz')
+
+# Direction bins: equal-area bands in z times sectors in azimuth
+ELEVATION_BINS = 6
+AZIMUTH_BINS = 12
+
+FIT_NONE = 0
+FIT_SPHERE = 1
+FIT_ELLIPSOID = 2
+
+# Smallest ratio between the singular values of a fit that is accepted. Lower
+# values mean the samples leave some parameter unconstrained, e.g. the vertical
+# offset when the sensor has only turned about the vertical (the sphere limit
+# needs about 8 degrees of tilt, the ellipsoid one about 20)
+SPHERE_MIN_CONDITION = 0.1
+ELLIPSOID_MIN_CONDITION = 0.02
+
+class MagCalibration:
+    """
+    Magnetometer calibration that improves itself while the sensor is used.
+
+    add(mag) stores new raw readings and refits when due; apply(mag) returns
+    calibrated readings. Both take arrays of shape (n, 3) or (3,) and work on
+    whole blocks with NumPy.
+
+    Parameters:
+    - path: File where the calibration is saved and loaded from; None to keep
+      it in memory only.
+    - capacity: Number of samples kept for the fit.
+    - refit_every: New samples between fits.
+    - min_bins_sphere: Direction bins needed to fit the offset only.
+    - min_bins_ellipsoid: Direction bins needed to fit offset and soft-iron.
+    - max_residual: Largest RMS relative error of a fit that is accepted.
+    - save_interval: Minimum seconds between writes of the file.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, capacity=2160, refit_every=450, min_bins_sphere=8,
+                 min_bins_ellipsoid=30, max_residual=0.05, save_interval=60):
+        self.path = path
+        self.bins = ELEVATION_BINS * AZIMUTH_BINS
+        self.per_bin = max(1, capacity // self.bins)
+        self.refit_every = refit_every
+        self.min_bins_sphere = min_bins_sphere
+        self.min_bins_ellipsoid = min_bins_ellipsoid
+        self.max_residual = max_residual
+        self.save_interval = save_interval
+
+        # Reservoir: per_bin slots per bin, filled as a ring buffer
+        self.samples = np.zeros((self.bins, self.per_bin, 3))
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        self.low = np.full(3, np.inf)       # Extents of the readings, per axis
+        self.high = np.full(3, -np.inf)
+
+        # Current calibration
+        self.offset = np.zeros(3)
+        self.matrix = np.eye(3)
+        self.kind = FIT_NONE
+        self.residual = None
+
+        self.pending = 0
+        self.last_save = 0.0
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    @property
+    def calibrated(self):
+        return self.kind != FIT_NONE
+
+    def centre(self):
+        """Point the directions of the readings are measured from."""
+        if self.calibrated or not np.all(np.isfinite(self.low)):
+            return self.offset
+        return (self.low + self.high) * 0.5
+
+    def apply(self, mag):
+        """Returns the calibrated readings, W (mag - offset)."""
+        return (np.asarray(mag, dtype=float) - self.offset) @ self.matrix.T
+
+    def add(self, mag):
+        """Adds raw readings to the reservoir and refits if enough are new."""
+        mag = np.asarray(mag, dtype=float).reshape(-1, 3)
+        mag = mag[np.any(mag != 0.0, axis=1)]       # Zeros: no magnetometer data
+        if len(mag) == 0:
+            return False
+
+        np.minimum(self.low, mag.min(axis=0), out=self.low)
+        np.maximum(self.high, mag.max(axis=0), out=self.high)
+        self._store(mag)
+
+        self.pending += len(mag)
+        if self.pending >= self.refit_every:
+            self.pending = 0
+            return self.fit()
+        return False
+
+    def _store(self, mag):
+        """Puts readings in the ring buffer of their direction bin."""
+        bins = self._direction_bins(mag)
+        order = np.argsort(bins, kind='stable')
+        bins = bins[order]
+        # Position of each sample among the new ones of its bin
+        first = np.searchsorted(bins, bins, side='left')
+        rank = np.arange(len(bins)) - first
+        slots = (self.counts[bins] + rank) % self.per_bin
+        self.samples[bins, slots] = mag[order]
+        np.add.at(self.counts, bins, 1)
+
+    def _rebin(self):
+        """Sorts the reservoir again into the direction bins seen from centre()."""
+        data = self.reservoir()
+        self.samples = np.zeros_like(self.samples)
+        self.counts = np.zeros_like(self.counts)
+        if len(data):
+            self._store(data)
+
+    def _direction_bins(self, mag):
+        """Direction bin of each reading, seen from centre()."""
+        v = mag - self.centre()
+        norm = np.linalg.norm(v, axis=1)
+        norm[norm == 0] = 1.0
+        z = v[:, 2] / norm
+        elevation = np.minimum(((z + 1.0) * 0.5 * ELEVATION_BINS).astype(int), ELEVATION_BINS - 1)
+        azimuth = ((np.arctan2(v[:, 1], v[:, 0]) + np.pi) * (AZIMUTH_BINS / (2 * np.pi))).astype(int)
+        azimuth = np.minimum(azimuth, AZIMUTH_BINS - 1)
+        return elevation * AZIMUTH_BINS + azimuth
+
+    def reservoir(self):
+        """Returns the stored samples as an (n, 3) array."""
+        filled = np.minimum(self.counts, self.per_bin)
+        mask = np.arange(self.per_bin) < filled[:, None]
+        return self.samples[mask]
+
+    def fit(self):
+        """
+        Fits the calibration to the reservoir. The new fit replaces the current
+        one if its residual is small enough and it is not a sphere replacing an
+        ellipsoid. Returns True if it was accepted.
+        """
+        # Before the first fit the centre moves as the extents grow
+        if not self.calibrated:
+            self._rebin()
+        occupied = int(np.count_nonzero(self.counts))
+        if occupied >= self.min_bins_ellipsoid:
+            kind = FIT_ELLIPSOID
+        elif occupied >= self.min_bins_sphere:
+            kind = FIT_SPHERE
+        else:
+            return False
+        if kind < self.kind:
+            return False
+
+        data = self.reservoir()
+        try:
+            offset, matrix = _fit_ellipsoid(data) if kind == FIT_ELLIPSOID else _fit_sphere(data)
+        except (np.linalg.LinAlgError, ValueError) as e:
+            logging.debug(f"Magnetometer fit rejected: {e}")
+            return False
+
+        radius = np.linalg.norm((data - offset) @ matrix.T, axis=1)
+        residual = float(np.sqrt(np.mean((radius / np.mean(radius) - 1.0) ** 2)))
+        if residual > self.max_residual:
+            logging.debug(f"Magnetometer fit rejected: residual {residual:.3f}")
+            return False
+
+        self.offset, self.matrix, self.kind, self.residual = offset, matrix, kind, residual
+        self._rebin()
+        logging.info(f"Magnetometer calibration updated ({'ellipsoid' if kind == FIT_ELLIPSOID else 'sphere'}, "
+                     f"{occupied} bins, residual {residual:.3f})")
+        if self.path is not None and time.monotonic() - self.last_save >= self.save_interval:
+            # fit() runs inside the IMU read: a disk error must not look like a sensor error
+            try:
+                self.save()
+            except OSError as e:
+                logging.error(f"Error saving magnetometer calibration {self.path}: {e}")
+                self.last_save = time.monotonic()
+        return True
+
+    def save(self):
+        """Writes the calibration and the reservoir to `path` (atomically)."""
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as file:
+            np.savez(file, offset=self.offset, matrix=self.matrix, kind=self.kind,
+                     residual=np.nan if self.residual is None else self.residual,
+                     samples=self.samples, counts=self.counts)
+        os.replace(temp, self.path)
+        self.last_save = time.monotonic()
+
+    def load(self):
+        """Reads the calibration (and, if the size matches, the reservoir) from `path`."""
+        try:
+            with np.load(self.path) as data:
+                self.offset = data['offset']
+                self.matrix = data['matrix']
+                self.kind = int(data['kind'])
+                self.residual = None if np.isnan(data['residual']) else float(data['residual'])
+                if data['samples'].shape == self.samples.shape:
+                    self.samples = data['samples']
+                    self.counts = data['counts']
+                    stored = self.reservoir()
+                    if len(stored):
+                        self.low, self.high = stored.min(axis=0), stored.max(axis=0)
+        except (OSError, KeyError, ValueError) as e:
+            logging.error(f"Error loading magnetometer calibration {self.path}: {e}")
+            return False
+        logging.info(f"Magnetometer calibration loaded from {self.path}")
+        return True
+
+def _normalise(data):
+    """Centres the samples on their mean and scales them to unit mean radius."""
+    shift = data.mean(axis=0)
+    centred = data - shift
+    scale = np.mean(np.linalg.norm(centred, axis=1))
+    if scale == 0:
+        raise ValueError("no spread in the samples")
+    return centred / scale, shift, scale
+
+def _solve(design, target, min_condition):
+    """
+    Least-squares solution of design @ p = target. On normalised samples a
+    small singular value means a direction the samples do not constrain.
+    """
+    solution, _, rank, singular = np.linalg.lstsq(design, target, rcond=None)
+    if rank < design.shape[1] or singular[-1] < min_condition * singular[0]:
+        raise ValueError("samples do not cover enough directions")
+    return solution
+
+def _fit_sphere(data):
+    """Offset-only fit: |x|^2 = 2 c.x + k. Returns (offset, scale matrix)."""
+    data, shift, scale = _normalise(data)
+    design = np.hstack((2.0 * data, np.ones((len(data), 1))))
+    target = np.einsum('ij,ij->i', data, data)
+    solution = _solve(design, target, SPHERE_MIN_CONDITION)
+    offset = solution[:3]
+    if solution[3] + offset @ offset <= 0:
+        raise ValueError("degenerate sphere")
+    return shift + scale * offset, np.eye(3)
+
+def _fit_ellipsoid(data):
+    """
+    General quadric fit x^T A x + 2 b.x = 1. Returns (offset, soft-iron matrix)
+    with the matrix scaled so that the calibrated radius is the geometric mean
+    of the semi-axes (the field strength is preserved).
+    """
+    data, shift, scale = _normalise(data)
+    x, y, z = data.T
+    design = np.column_stack((x * x, y * y, z * z, 2 * y * z, 2 * x * z, 2 * x * y, 2 * x, 2 * y, 2 * z))
+    p = _solve(design, np.ones(len(data)), ELLIPSOID_MIN_CONDITION)
+    A = np.array(((p[0], p[5], p[4]),
+                  (p[5], p[1], p[3]),
+                  (p[4], p[3], p[2])))
+    offset = -np.linalg.solve(A, p[6:9])
+    k = 1.0 + offset @ A @ offset
+    eigenvalues, eigenvectors = np.linalg.eigh(A / k)
+    if np.any(eigenvalues <= 0):
+        raise ValueError("fit is not an ellipsoid")
+    # In normalised units; the same matrix maps raw readings to the raw field strength
+    radius = np.prod(eigenvalues) ** (-1.0 / 6.0)
+    matrix = radius * (eigenvectors * np.sqrt(eigenvalues)) @ eigenvectors.T
+    return shift + scale * offset, matrix
@@ -0,0 +1,97 @@
+"""* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+*                                                                            *
+*               Developed by Javier Bolañs & Javier Lendinez                 *
+*                  https://github.com/javierbolanosllano                     *
+*                        https://github.com/JaviLendi                        *
+*                                                                            *
+*                      UAXSAT IV Project - 2024                              *
+*                   https://github.com/UAXSat/UAXSat                         *
+*                                                                            *
+* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
+
+# Schedulermodule.py
+import time
+import logging
+import threading
+
+class SensorTask:
+    """
+    A sensor sampled by its own worker thread at its own rate.
+
+    `read` is called with no arguments every 1/rate_hz seconds; whatever it
+    returns is stored as the latest value of the sensor.
+    """
+
+    def __init__(self, name, read, rate_hz):
+        if rate_hz <= 0:
+            raise ValueError(f'rate_hz must be positive: {rate_hz}')
+        self.name = name
+        self.read = read
+        self.period = 1.0 / rate_hz
+        self.thread = None
+
+class SamplingScheduler:
+    """
+    Samples every registered sensor concurrently, each one at its own rate.
+
+    Each sensor runs in its own daemon thread, so a slow read (the 1 s CPU
+    usage interval, the AS7331 integration time, the DS18B20 conversion...)
+    only delays that sensor. Frames are assembled with snapshot() from the
+    latest value of every sensor.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.values = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def add(self, name, read, rate_hz):
+        """Registers a sensor to be sampled at rate_hz by calling read()."""
+        self.tasks[name] = SensorTask(name, read, rate_hz)
+        self.values[name] = (None, None)
+
+    def start(self):
+        """Starts one worker thread per registered sensor."""
+        self.stop_event.clear()
+        for task in self.tasks.values():
+            task.thread = threading.Thread(target=self._worker, args=(task,),
+                                           name=f"sampler-{task.name}", daemon=True)
+            task.thread.start()
+
+    def stop(self, timeout=None):
+        """Asks every worker to finish and waits for them."""
+        self.stop_event.set()
+        for task in self.tasks.values():
+            if task.thread is not None:
+                task.thread.join(timeout)
+                task.thread = None
+
+    def _worker(self, task):
+        next_time = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                value = task.read()
+            except Exception as e:
+                logging.error(f"Error sampling {task.name}: {e}")
+                value = None
+            with self.lock:
+                self.values[task.name] = (value, time.time())
+
+            # Keep a fixed rate; if a read overran its period, start again now
+            next_time += task.period
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                next_time = time.monotonic()
+                delay = 0
+            self.stop_event.wait(delay)
+
+    def latest(self, name):
+        """Returns (value, timestamp) of the last sample of `name`."""
+        with self.lock:
+            return self.values[name]
+
+    def snapshot(self):
+        """Returns a dict with the latest value of every sensor."""
+        with self.lock:
+            return {name: value for name, (value, _) in self.values.items()}
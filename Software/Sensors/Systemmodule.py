@@ -0,0 +1,174 @@
+"""* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+*                                                                            *
+*               Developed by Javier Bolañs & Javier Lendinez                 *
+*                  https://github.com/javierbolanosllano                     *
+*                        https://github.com/JaviLendi                        *
+*                                                                            *
+*                      UAXSAT IV Project - 2024                              *
+*                   https://github.com/UAXSat/UAXSat                         *
+*                                                                            *
+* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""
+
+# Systemmodule.py
+#
+# System metrics sampled in the background. SystemSampler reads /proc/stat,
+# /proc/meminfo, statvfs and the thermal zone at its own rate (the files are
+# opened once and read again with pread) and keeps a snapshot of the values,
+# which get() returns without waiting. CPU usage is the difference between two
+# samples, instead of the one-second wait of psutil.cpu_percent(interval=1).
+import os
+import time
+import threading
+
+PROC_STAT = '/proc/stat'
+PROC_MEMINFO = '/proc/meminfo'
+THERMAL_ZONE = '/sys/class/thermal/thermal_zone0/temp'
+READ_SIZE = 4096
+
+class SystemSampler:
+    """
+    Samples the system metrics every `interval` seconds in a thread.
+
+    Parameters:
+    - interval: Seconds between samples.
+    - disk_path: Mount point whose disk usage is measured.
+    - thermal_zone: Temperature file (millidegrees); None if there is none.
+    """
+
+    def __init__(self, interval=1.0, disk_path='/', thermal_zone=THERMAL_ZONE):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.stat_fd = os.open(PROC_STAT, os.O_RDONLY)
+        self.meminfo_fd = os.open(PROC_MEMINFO, os.O_RDONLY)
+        try:
+            self.thermal_fd = os.open(thermal_zone, os.O_RDONLY) if thermal_zone else None
+        except OSError:
+            self.thermal_fd = None
+        self.last_cpu = None
+        self.read_cpu()     # Counters since boot: the first usage is measured from here
+        self.snapshot = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def read_cpu(self):
+        """
+        CPU usage in percent since the previous sample. None until half an
+        interval has passed since the counters were first read, as a shorter
+        window holds too few clock ticks.
+        """
+        line = os.pread(self.stat_fd, 256, 0).split(b'\n', 1)[0]
+        # cpu user nice system idle iowait irq softirq steal (guest is already counted in user)
+        times = [int(value) for value in line.split()[1:9]]
+        idle = times[3] + times[4]
+        total = sum(times)
+        now = time.monotonic()
+        previous = self.last_cpu
+        if previous is None:
+            self.last_cpu = (idle, total, now)
+            return None
+        if now - previous[2] < self.interval / 2:
+            return None
+        self.last_cpu = (idle, total, now)
+        idle -= previous[0]
+        total -= previous[1]
+        return 100.0 * (total - idle) / total if total > 0 else None
+
+    def read_memory(self):
+        """(used, total) in bytes; used = total - available."""
+        data = os.pread(self.meminfo_fd, READ_SIZE, 0)
+        total = _meminfo_value(data, b'MemTotal:')
+        available = _meminfo_value(data, b'MemAvailable:')
+        return (total - available) * 1024, total * 1024
+
+    def read_disk(self):
+        """(used, total, percent) of the disk, like psutil.disk_usage()."""
+        stat = os.statvfs(self.disk_path)
+        total = stat.f_blocks * stat.f_frsize
+        used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+        available = stat.f_bavail * stat.f_frsize
+        return used, total, 100.0 * used / (used + available) if used + available else 0.0
+
+    def read_temperature(self):
+        """SoC temperature in degrees C (None without a thermal zone)."""
+        if self.thermal_fd is None:
+            return None
+        return int(os.pread(self.thermal_fd, 16, 0)) / 1000.0
+
+    def sample(self):
+        """Samples every metric and updates the snapshot."""
+        cpu = self.read_cpu()
+        ram_used, ram_total = self.read_memory()
+        disk_used, disk_total, disk_percent = self.read_disk()
+        try:
+            temperature = self.read_temperature()
+        except (OSError, ValueError):
+            temperature = None
+        snapshot = {
+            "CPU Usage (%)": cpu,
+            "RAM Usage (MB)": ram_used / (1024 ** 2),
+            "Total RAM (MB)": ram_total / (1024 ** 2),
+            "RAM Usage (%)": 100.0 * ram_used / ram_total if ram_total else None,
+            "Disk Usage (%)": disk_percent,
+            "Disk Usage (GB)": disk_used / (1024 ** 3),
+            "Total Disk (GB)": disk_total / (1024 ** 3),
+            "Temperature (°C)": temperature,
+            "Time": time.time(),
+        }
+        with self.lock:
+            self.snapshot = snapshot
+        return snapshot
+
+    def start(self):
+        """Takes a first sample and keeps sampling in the background."""
+        if self.thread is not None:
+            return
+        self.sample()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='SystemSampler', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except (OSError, ValueError) as e:
+                print(f"Error sampling system metrics: {e}")
+
+    def stop(self):
+        """Stops the background thread."""
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        """Stops sampling and closes the files."""
+        self.stop()
+        for fd in (self.stat_fd, self.meminfo_fd, self.thermal_fd):
+            if fd is not None:
+                os.close(fd)
+        self.stat_fd = self.meminfo_fd = self.thermal_fd = None
+
+    def get(self):
+        """Returns the latest snapshot of the metrics (without waiting)."""
+        with self.lock:
+            return dict(self.snapshot)
+
+def _meminfo_value(data, key):
+    """Value in kB of the `key` line of /proc/meminfo."""
+    start = data.index(key) + len(key)
+    return int(data[start:data.index(b'\n', start)].split()[0])
+
+def main():
+    sampler = SystemSampler()
+    sampler.start()
+    try:
+        while True:
+            time.sleep(1)
+            print(sampler.get())
+    finally:
+        sampler.close()
+
+if __name__ == '__main__':
+    main()
@@ -11,8 +11,10 @@
 
 # AS7331.py
 import time
-import board
+import math
+import struct
 from adafruit_bus_device.i2c_device import I2CDevice
+from Software.Sensors.I2Cbusmodule import get_i2c, PRIORITY_UV
 
 DEFAULT_I2C_ADDR = 0x74
 
@@ -35,11 +37,25 @@ _REG_ADDR_MRES3 = 0x04  # Channel C measurement result
 _REG_ADDR_OUTCONVL = 0x05  # Result of time conversion (lsb) 
 _REG_ADDR_OUTCONVH = 0x06  # Result of time conversion (msb)
 
+# Burst read of the output bank starting at OSR/STATUS: the address auto-increments,
+# so a single transaction returns OSR, STATUS, TEMP, MRES1, MRES2 and MRES3
+_OUTPUT_BURST = struct.Struct('<BBHHHH')
+
+# Polling of the status register while waiting for a result: starts at
+# _POLL_MIN_DT and doubles up to _POLL_MAX_DT (seconds)
+_POLL_MIN_DT = 0.001
+_POLL_MAX_DT = 0.016
+_RESULT_TIMEOUT_MARGIN = 0.1  # Extra wait over the integration time before giving up
+
+# Registers kept in the register shadow (CREG1..CREG3 are read in one burst)
+_CONFIG_REGS = (_REG_ADDR_CREG1, _REG_ADDR_CREG2, _REG_ADDR_CREG3)
+
 # OSR REG Masks (RW)
 _OSR_MASK_DOS = 0x07  # Device Operating State 
 _OSR_MASK_SW_RES = 0x08  # Software Reset 
 _OSR_MASK_PD = 0x40  # Power Down State Switch 
 _OSR_MASK_SS = 0x80  # Start/Stop measurement  
+_OSR_MASK_TRIGGERS = _OSR_MASK_SW_RES | _OSR_MASK_SS  # Action bits, not kept in the shadow
 
 # CREG1 Masks (RW)
 _CREG1_MASK_INTEGRATION_TIME = 0x0f  # Integration time
@@ -153,7 +169,7 @@ CCLK_FREQ_4096KHZ = 0x02
 CCLK_FREQ_8192KHZ = 0x03
 
 _CCLK_MIN_VAL = CCLK_FREQ_1024KHZ
-_CCKL_MAX_VAL = CCLK_FREQ_8192KHZ
+_CCLK_MAX_VAL = CCLK_FREQ_8192KHZ
 
 # Measurement divider min/max value
 _DIV_MIN_VAL = 0x00
@@ -164,6 +180,17 @@ _FSRA = 348160
 _FSRB = 387072
 _FSRC = 169984
 
+# Largest value of the MRES registers
+_MRES_MAX_COUNTS = 0xffff
+
+# Auto-ranging defaults: fraction of the full-scale counts that the largest
+# channel should stay within, and the level aimed for when changing range
+_AUTORANGE_LOW = 0.05
+_AUTORANGE_HIGH = 0.75
+_AUTORANGE_TARGET = 0.4
+_AUTORANGE_OVERFLOW_STEPS = 4  # Sensitivity is divided by 2**4 after an overflow
+_AUTORANGE_RETRIES = 2         # New measurements after an overflow before giving up
+
 class AS7331:
 
     """
@@ -174,31 +201,39 @@ class AS7331:
     def __init__(self, i2c_bus, address=DEFAULT_I2C_ADDR):
         self.i2c_device = I2CDevice(i2c_bus, address)
 
-        # Keep local copies of gain, integration_time, etc the  for conversion
-        # calculations that way we don't have request these each time we want
-        # to convert a measurement. 
+        # Preallocated buffers for the burst read of the measurement results
+        self._burst_obuffer = bytearray((_REG_ADDR_STATUS,))
+        self._burst_ibuffer = bytearray(_OUTPUT_BURST.size)
+
+        # Register shadow: cached copies of OSR and CREG1..CREG3. They only
+        # change when we write them, so the configuration getters (gain,
+        # integration_time, etc) are served from here without I2C traffic and
+        # writes that don't change a register are skipped.
+        self.shadow = {}
+        self._config_depth = 0  # Nesting of ConfigurationStateManager windows
+        self._chip_id = None
         self.software_reset()
-        self.state_copy = {
-                'gain'             : self.gain, 
-                'integration_time' : self.integration_time, 
-                'divider'          : self.divider, 
-                'divider_enabled'  : self.divider_enabled,
-                'measurement_mode' : self.measurement_mode,
-                'cclk'             : self.cclk,
-                }
         self.set_default_config()
         self.overflow_exception = False 
+        self.conversion_end = None  # Expected end of the conversion started with start_conversion()
+        self.lost_samples = 0       # Results overwritten before being read (LDATA) in continuous mode
+        self.last_status = 0        # STATUS and raw MRES counts of the last result
+        self.last_counts = (0, 0, 0)
+        self.auto_ranger = None
 
     def set_default_config(self):
         """
         Set the device configuration to default values
         """
-        self.measurement_mode = MEASUREMENT_MODE_COMMAND
-        self.integration_time = INTEGRATION_TIME_256MS
-        self.gain = GAIN_16X
-        self.standby_state = False
-        self.power_down_enable = False 
-        self.divider_enabled = False
+        with ConfigurationStateManager(self):
+            self.configure(
+                    measurement_mode = MEASUREMENT_MODE_COMMAND,
+                    integration_time = INTEGRATION_TIME_256MS,
+                    gain             = GAIN_16X,
+                    standby_state    = False,
+                    divider_enabled  = False,
+                    )
+            self.power_down_enabled = False
 
         # TO DO
         # ------------------------------------------------------------------
@@ -207,6 +242,84 @@ class AS7331:
 
         self.device_state = DEVICE_STATE_MEASUREMENT
 
+    def configure(self, gain=None, integration_time=None, divider=None, divider_enabled=None,
+                  time_measurement_enabled=None, measurement_mode=None, standby_state=None,
+                  cclk=None):
+        """
+        Changes several settings at once. The new register values are computed
+        from the shadow, and only the registers that change are written, all
+        within a single configuration state window. Settings left as None are
+        kept.
+        """
+        if gain is not None and (gain < _GAIN_MIN_VAL or gain > _GAIN_MAX_VAL):
+            raise ValueError(f'unknown gain {gain}')
+        if integration_time is not None and (integration_time < _INTEGRATION_TIME_MIN_VAL
+                                             or integration_time > _INTEGRATION_TIME_MAX_VAL):
+            raise ValueError(f'unknown integration time {integration_time}')
+        if divider is not None and (divider < _DIV_MIN_VAL or divider > _DIV_MAX_VAL):
+            raise ValueError(f'new_div out of range')
+        if measurement_mode is not None and not measurement_mode in ALLOWED_MEASUREMENT_MODES:
+            raise ValueError(f'unknown measurement mode: {measurement_mode}')
+        if cclk is not None and (cclk < _CCLK_MIN_VAL or cclk > _CCLK_MAX_VAL):
+            raise ValueError(f'cclk out of range: {cclk}')
+
+        creg1 = self.creg1
+        if gain is not None:
+            creg1 = (creg1 & ~_CREG1_MASK_GAIN) | (gain << _GAIN_BIT_SHIFT)
+        if integration_time is not None:
+            creg1 = (creg1 & ~_CREG1_MASK_INTEGRATION_TIME) | integration_time
+
+        creg2 = self.creg2
+        if divider is not None:
+            creg2 = (creg2 & ~_CREG2_MASK_DIV) | divider
+        if divider_enabled is not None:
+            creg2 = _set_bits(creg2, _CREG2_MASK_EN_DIV, divider_enabled)
+        if time_measurement_enabled is not None:
+            creg2 = _set_bits(creg2, _CREG2_MASK_EN_TM, time_measurement_enabled)
+
+        creg3 = self.creg3
+        if measurement_mode is not None:
+            creg3 = (creg3 & ~_CREG3_MASK_MMODE) | measurement_mode
+        if standby_state is not None:
+            creg3 = _set_bits(creg3, _CREG3_MASK_SB, standby_state)
+        if cclk is not None:
+            creg3 = (creg3 & ~_CREG3_MASK_CCLK) | cclk
+
+        new_values = dict(zip(_CONFIG_REGS, (creg1, creg2, creg3)))
+        if all(self.shadow[reg] == val for reg, val in new_values.items()):
+            return
+        with ConfigurationStateManager(self):
+            for reg, val in new_values.items():
+                self.write_config(reg, val)
+
+    def write_config(self, reg, val):
+        """ Writes a configuration register unless the shadow already holds `val` """
+        if self.shadow.get(reg) != val:
+            self.write_uint8(reg, val)
+            self.shadow[reg] = val
+
+    def refresh_registers(self):
+        """
+        Re-reads OSR and CREG1..CREG3 from the device into the register shadow.
+        Only needed if the device may have been changed behind our back.
+        """
+        self.shadow[_REG_ADDR_OSR] = self.read_uint8(_REG_ADDR_OSR) & ~_OSR_MASK_TRIGGERS
+        with ConfigurationStateManager(self):
+            cregs = self.read_block(_REG_ADDR_CREG1, len(_CONFIG_REGS))
+        self.shadow.update(zip(_CONFIG_REGS, cregs))
+
+    @property
+    def state_copy(self):
+        """ Current configuration, decoded from the register shadow """
+        return {
+                'gain'             : self.gain,
+                'integration_time' : self.integration_time,
+                'divider'          : self.divider,
+                'divider_enabled'  : self.divider_enabled,
+                'measurement_mode' : self.measurement_mode,
+                'cclk'             : self.cclk,
+                }
+
     def read_uint16(self, reg):
         """ Reads two bytes (uint16) from the specified register """
         obuffer = bytearray(1)
@@ -236,6 +349,14 @@ class AS7331:
             i2c.write_then_readinto(obuffer, ibuffer, out_end=1, in_end=1)
         return ibuffer[0]
 
+    def read_block(self, reg, count):
+        """ Reads `count` consecutive registers (auto-increment) starting at `reg` """
+        obuffer = bytearray((reg,))
+        ibuffer = bytearray(count)
+        with self.i2c_device as i2c:
+            i2c.write_then_readinto(obuffer, ibuffer)
+        return ibuffer
+
     def write_uint8(self, reg, val):
         """ Writes one byte (uint8) to the specified register """
         obuffer = bytearray(2)
@@ -244,15 +365,27 @@ class AS7331:
         with self.i2c_device as i2c:
             i2c.write(obuffer)
 
+    def read_results(self):
+        """
+        Reads OSR, STATUS, TEMP, MRES1, MRES2 and MRES3 in a single I2C
+        transaction. Only valid in the measurement state.
+
+        Returns (osr, status, temp, mres1, mres2, mres3) as integers.
+        """
+        with self.i2c_device as i2c:
+            i2c.write_then_readinto(self._burst_obuffer, self._burst_ibuffer)
+        return _OUTPUT_BURST.unpack_from(self._burst_ibuffer)
+
     @property
     def osr(self):
-        """ Reads the contents of the Operational State Register (OSR) """
-        return self.read_uint8(_REG_ADDR_OSR)
+        """ Contents of the Operational State Register (OSR), from the register shadow """
+        return self.shadow[_REG_ADDR_OSR]
 
     @osr.setter
     def osr(self, val):
         """ Writes to the Operational State Register (OSR) """
         self.write_uint8(_REG_ADDR_OSR, val)
+        self.shadow[_REG_ADDR_OSR] = val & ~_OSR_MASK_TRIGGERS
 
     @property
     def osr_and_status(self):
@@ -288,33 +421,33 @@ class AS7331:
 
     @property
     def creg1(self):
-        """ Reads the contents of the CREG1 configuration register """
-        return self.read_uint8(_REG_ADDR_CREG1)
+        """ Contents of the CREG1 configuration register, from the register shadow """
+        return self.shadow[_REG_ADDR_CREG1]
 
     @creg1.setter
     def creg1(self, val):
         """ Writes to the CREG1 configuration register """
-        self.write_uint8(_REG_ADDR_CREG1, val)
+        self.write_config(_REG_ADDR_CREG1, val)
 
     @property
     def creg2(self):
-        """ Reads the contents of the CREG2 configuration register """
-        return self.read_uint8(_REG_ADDR_CREG2)
+        """ Contents of the CREG2 configuration register, from the register shadow """
+        return self.shadow[_REG_ADDR_CREG2]
 
     @creg2.setter
     def creg2(self, val):
         """ Writes to the CREG2 configuration register """
-        self.write_uint8(_REG_ADDR_CREG2, val)
+        self.write_config(_REG_ADDR_CREG2, val)
 
     @property
     def creg3(self):
-        """ Reads the contents of the CREG3 configuration register """
-        return self.read_uint8(_REG_ADDR_CREG3)
+        """ Contents of the CREG3 configuration register, from the register shadow """
+        return self.shadow[_REG_ADDR_CREG3]
 
     @creg3.setter
     def creg3(self, val):
         """ Writes to the CREG3 configuratino register """
-        self.write_uint8(_REG_ADDR_CREG3, val)
+        self.write_config(_REG_ADDR_CREG3, val)
 
     @property
     def temp(self):
@@ -370,27 +503,26 @@ class AS7331:
 
     @property
     def power_down_enabled(self):
-        """ Reads the power down state of the device True/False via the OSR """
-        with ConfigurationStateManager(self):
-            val = bool(self.osr & _OSR_MASK_PD)
-        return val
+        """ Power down state of the device True/False, from the OSR shadow """
+        return bool(self.osr & _OSR_MASK_PD)
 
     @power_down_enabled.setter
     def power_down_enabled(self,val):
         """ Sets the power down state of the device True/False via the OSR """
+        if bool(val) == self.power_down_enabled:
+            return
         with ConfigurationStateManager(self):
-            if val:
-                self.osr = self.osr | _OSR_MASK_PD
-            else:
-                self.osr = self.osr & ~_OSR_MASK_PD
+            self.osr = _set_bits(self.osr, _OSR_MASK_PD, val)
 
     def software_reset(self):
-        self.osr = self.osr | _OSR_MASK_SW_RES
+        """ Resets the device and reloads the register shadow with its defaults """
+        self.write_uint8(_REG_ADDR_OSR, self.read_uint8(_REG_ADDR_OSR) | _OSR_MASK_SW_RES)
+        self.refresh_registers()
 
     @property
     def device_state(self):
         """ 
-        Reads the current device state from the Operational State Register (OSR).  
+        Gets the current device state from the Operational State Register (OSR) shadow.
 
         Returns either DEVICE_STATE_CONFIGURATION or DEVICE_STATE_MEASUREMENT. 
         """
@@ -405,7 +537,8 @@ class AS7331:
         """
         if not new_mode in ALLOWED_DEVICE_STATES: 
             raise ValueError(f'unknown mode {new_mode}')
-        self.osr = (self.osr & ~_OSR_MASK_DOS) | new_mode
+        if new_mode != self.device_state:
+            self.osr = (self.osr & ~_OSR_MASK_DOS) | new_mode
 
     @property
     def device_state_as_string(self):
@@ -434,6 +567,10 @@ class AS7331:
         """ Starts a one-shot measurement.  Used for measuremnts in command mode. """
         self.osr = self.osr | _OSR_MASK_SS
 
+    def stop_measurement(self):
+        """ Stops the measurement in progress (continuous and sync modes). """
+        self.osr = self.osr & ~_OSR_MASK_SS
+
     @property
     def gain(self):
         """ 
@@ -443,9 +580,7 @@ class AS7331:
         GAIN_256X, GAIN_128X, GAIN_64X, GAIN_32X, GAIN_16X, GAIN_8X, GAIN_4X,
         GAIN_2X, GAIN_1X.
         """
-        with ConfigurationStateManager(self):
-            val = (self.creg1 & _CREG1_MASK_GAIN) >> _GAIN_BIT_SHIFT
-        return val
+        return (self.creg1 & _CREG1_MASK_GAIN) >> _GAIN_BIT_SHIFT
 
     @property
     def gain_value(self):
@@ -474,11 +609,7 @@ class AS7331:
         '256x', '128x', '64x', '32x', '16x', '8x ', '4x', '2x', '1x' 
         """
 
-        with ConfigurationStateManager(self):
-            if new_gain < _GAIN_MIN_VAL or new_gain > _GAIN_MAX_VAL:
-                raise ValueError(f'unknown gain {new_gain}')
-            self.creg1 = (self.creg1 & ~_CREG1_MASK_GAIN) | (new_gain << _GAIN_BIT_SHIFT)
-            self.state_copy['gain'] = new_gain  
+        self.configure(gain=new_gain)
 
     @property
     def integration_time(self):
@@ -503,9 +634,7 @@ class AS7331:
             INTEGRATION_TIME_8192MS,
             INTEGRATION_TIME_16384MS,
         """
-        with ConfigurationStateManager(self):
-            val = self.creg1 & _CREG1_MASK_INTEGRATION_TIME
-        return val
+        return self.creg1 & _CREG1_MASK_INTEGRATION_TIME
 
     @property
     def integration_time_value(self):
@@ -548,64 +677,41 @@ class AS7331:
             INTEGRATION_TIME_8192MS,
             INTEGRATION_TIME_16384MS,
         """
-        with ConfigurationStateManager(self):
-            if new_time < _INTEGRATION_TIME_MIN_VAL or new_time > _INTEGRATION_TIME_MAX_VAL:
-                raise ValueError(f'unknown integration time {new_time}')
-            self.creg1 = (self.creg1 & ~_CREG1_MASK_INTEGRATION_TIME) | new_time
-            self.state_copy['integration_time'] = new_time 
+        self.configure(integration_time=new_time)
 
     @property
     def time_measurement_enabled(self):
         """
         Reads CREG2 and returns the time measurement enabled setting (True/False)
         """
-        with ConfigurationStateManager(self):
-            val = bool(self.creg2 & _CREG2_MASK_TM_EN)
-        return val
+        return bool(self.creg2 & _CREG2_MASK_EN_TM)
 
     @time_measurement_enabled.setter
     def time_measurement_enabled(self, val):
         """ Enables/disables the conversion time measurement """
-        with ConfigurationStateManager(self):
-            if val:
-                self.creg2 = self.creg2 | _CREG2_MASK_TM_ENV
-            else:
-                self.creg2 = self.creg2 & ~_CREG2_MASK_TM_EN
+        self.configure(time_measurement_enabled=val)
 
     @property
     def divider_enabled(self):
         """ 
         Reads CREG2 and return measurement divider enabled setting (True/False)
         """
-        with ConfigurationStateManager(self):
-            val = bool(self.creg2 & _CREG2_MASK_EN_DIV)
-        return val
+        return bool(self.creg2 & _CREG2_MASK_EN_DIV)
 
     @divider_enabled.setter
     def divider_enabled(self, val):
         """ Enables/disables the measurement divider """
-        with ConfigurationStateManager(self):
-            if val:
-                self.creg2 = self.creg2 | _CREG2_MASK_EN_DIV
-            else:
-                self.creg2 = self.creg2 & ~_CREG2_MASK_EN_DIV
-            self.state_copy['divider_enabled'] = self.divider_enabled
+        self.configure(divider_enabled=val)
 
     @property
     def divider(self):
         """ Reads CREG2 and returns the measurement divider """
-        with ConfigurationStateManager(self):
-            val = self.creg2 & _CREG2_MASK_DIV
-        return val
+        return self.creg2 & _CREG2_MASK_DIV
 
     @divider.setter
     def divider(self, new_div):
         """ Sets the measurement divider via CREG2 """
-        with ConfigurationStateManager(self):
-            if (new_div < _DIV_MIN_VAL) or (new_div > _DIV_MAX_VAL):
-                raise ValueError(f'new_div out of range')
-            self.creg2 = (self.creg2 & ~_CREG2_MASK_DIV) | new_div
-            self.state_copy['divider'] = self.divider
+        self.configure(divider=new_div)
 
     @property
     def measurement_mode(self):
@@ -618,9 +724,7 @@ class AS7331:
             MEASUREMENT_MODE_SYNC_START,
             MEASUREMENT_MODE_SYNC_START_AND_END,
         """
-        with ConfigurationStateManager(self):
-            val = self.creg3 & _CREG3_MASK_MMODE
-        return val
+        return self.creg3 & _CREG3_MASK_MMODE
 
     @measurement_mode.setter
     def measurement_mode(self, new_mmode):
@@ -633,11 +737,7 @@ class AS7331:
             MEASUREMENT_MODE_SYNC_START,
             MEASUREMENT_MODE_SYNC_START_AND_END,
         """
-        with ConfigurationStateManager(self):
-            if not new_mmode in ALLOWED_MEASUREMENT_MODES:
-                raise ValueError(f'unknown measurement mode: {new_mmode}')
-            self.creg3 = (self.creg3 & ~_CREG3_MASK_MMODE) | new_mmode
-            self.state_copy['measurement_mode'] = new_mmode
+        self.configure(measurement_mode=new_mmode)
 
     @property
     def measurement_mode_as_string(self):
@@ -659,9 +759,7 @@ class AS7331:
 
         Returns True or False
         """
-        with ConfigurationStateManager(self):
-            val = bool(self.creg3 & _CREG3_MASK_SB)
-        return val
+        return bool(self.creg3 & _CREG3_MASK_SB)
 
 
     @standby_state.setter
@@ -671,11 +769,7 @@ class AS7331:
 
         Can be set to either True or False
         """
-        with ConfigurationStateManager(self):
-            if val:
-                self.creg3 = self.creg3 | _CREG3_MASK_SB
-            else:
-                self.creg3 = self.creg3 & ~_CREG3_MASK_SB
+        self.configure(standby_state=val)
 
     @property
     def cclk(self):
@@ -688,9 +782,7 @@ class AS7331:
             CCLK_FREQ_4096KHZ
             CCLK_FREQ_8192KHZ
         """
-        with ConfigurationStateManager(self):
-            val = self.creg3 & _CREG3_MASK_CCLK
-        return val
+        return self.creg3 & _CREG3_MASK_CCLK
 
     @property
     def cclk_value(self):
@@ -717,69 +809,165 @@ class AS7331:
             CCLK_FREQ_4096KHZ
             CCLK_FREQ_8192KHZ
         """
-        with ConfigurationStateManager(self):
-            if new_cclk < _CCLK_MIN_VAL or new_cclk > _CCLK_MAX_VAL: 
-                raise ValueError(f'cclk out of range: {new_cclk}')
-            self.creg3 = (self.creg3 & ~_CREG3_MASK_CCLK) | new_cclk
-            self.state_copy['cclk'] = new_cclk
+        self.configure(cclk=new_cclk)
 
     @property
     def chip_id(self):
         """
-        Reads the value of the chip id from the AGEN Register.
+        Reads the value of the chip id from the AGEN Register (only the first
+        time; it never changes).
         """
-        with ConfigurationStateManager(self):
-            val = (self.read_uint8(_REG_ADDR_AGEN) & _AGEN_MASK_DEVID) >> _AGEN_SHIFT_DEVID 
-        return val
+        if self._chip_id is None:
+            with ConfigurationStateManager(self):
+                self._chip_id = (self.read_uint8(_REG_ADDR_AGEN) & _AGEN_MASK_DEVID) >> _AGEN_SHIFT_DEVID
+        return self._chip_id
 
     @property
     def conversion_factor(self):
-        gain_value = gain_to_value(self.state_copy['gain'])
-        time_value = integration_time_to_value(self.state_copy['integration_time'])
-        cclk_value =  cclk_to_value(self.state_copy['cclk'])
+        gain_value = gain_to_value(self.gain)
+        time_value = integration_time_to_value(self.integration_time)
+        cclk_value =  cclk_to_value(self.cclk)
         return 1.0/(gain_value*time_value*cclk_value)
 
     @property
     def divider_factor(self):
-        if self.state_copy['divider_enabled']:
-            div_factor = 1 << (1 + self.state_copy['divider'])
+        if self.divider_enabled:
+            div_factor = 1 << (1 + self.divider)
         else:
             div_factor = 1
         return div_factor
 
     @property
     def measurement_sleep_dt(self):
-        return 0.001*integration_time_to_value(self.state_copy['integration_time'])
+        return 0.001*integration_time_to_value(self.integration_time)
+
+    def wait_for_results(self, not_before, timeout=None):
+        """
+        Waits for new results (NDATA) and returns them as read_results() does.
+
+        Sleeps until `not_before` (time.monotonic()), when the conversion is
+        expected to end, and then polls the status with a backoff from
+        _POLL_MIN_DT to _POLL_MAX_DT. Each poll is a burst read, so the results
+        come in the same transaction that sees NDATA. Raises AS7331Timeout if
+        they are not ready `timeout` seconds after `not_before`.
+        """
+        if timeout is None:
+            timeout = self.measurement_sleep_dt + _RESULT_TIMEOUT_MARGIN
+        deadline = not_before + timeout
+        delay = not_before - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        poll_dt = _POLL_MIN_DT
+        while True:
+            results = self.read_results()
+            status = results[1]
+            if status & _STATUS_MASK_NDATA and not status & _STATUS_MASK_NOTREADY:
+                return results
+            now = time.monotonic()
+            if now >= deadline:
+                raise AS7331Timeout("measurement not ready")
+            time.sleep(min(poll_dt, deadline - now))
+            poll_dt = min(2*poll_dt, _POLL_MAX_DT)
+
+    def start_conversion(self):
+        """
+        Starts a one-shot measurement (command mode) and returns at once; the
+        result is read with collect(). Other work can be done meanwhile.
+        """
+        self.start_measurement()
+        self.conversion_end = time.monotonic() + self.measurement_sleep_dt
 
     @property
-    def raw_values(self):
+    def conversion_done(self):
+        """ True once the integration time of the current conversion has passed (no I2C access) """
+        return self.conversion_end is not None and time.monotonic() >= self.conversion_end
+
+    def collect(self, timeout=None):
+        """
+        Waits for the conversion started with start_conversion() and returns the
+        raw values (uva_raw, uvb_raw, uvc_raw, temp_raw).
+        """
+        if self.conversion_end is None:
+            raise RuntimeError("no conversion in progress")
+        results = self.wait_for_results(self.conversion_end, timeout)
+        self.conversion_end = None
+        return self.raw_from_results(results)
+
+    def stream(self):
+        """
+        Measures in continuous mode and yields (uva, uvb, uvc, temp) every time
+        a new result is available (once per integration time). The measurement
+        is stopped and command mode restored when the generator is closed.
+        """
+        self.measurement_mode = MEASUREMENT_MODE_CONTINUOUS
         self.start_measurement()
-        time.sleep(self.measurement_sleep_dt)
-        while self.notready:
-            pass
+        period = self.measurement_sleep_dt
+        next_result = time.monotonic() + period
+        try:
+            while True:
+                results = self.wait_for_results(next_result)
+                if results[1] & _STATUS_MASK_LDATA:
+                    self.lost_samples += 1
+                next_result = max(next_result + period, time.monotonic())
+                yield self.convert(self.raw_from_results(results))
+        finally:
+            self.stop_measurement()
+            self.measurement_mode = MEASUREMENT_MODE_COMMAND
 
+    @property
+    def raw_values(self):
+        self.start_conversion()
+        return self.collect()
+
+    def raw_from_results(self, results):
+        """ Applies the divider and overflow check to the output of read_results() """
+        _, status, temp_raw, mres1, mres2, mres3 = results
+        self.last_status = status
+        self.last_counts = (mres1, mres2, mres3)
         div_factor = self.divider_factor
-        uva_raw = self.mres1_as_uint16*div_factor 
-        uvb_raw = self.mres2_as_uint16*div_factor
-        uvc_raw = self.mres3_as_uint16*div_factor
-        temp_raw = self.temp_as_uint16
+        uva_raw = mres1*div_factor
+        uvb_raw = mres2*div_factor
+        uvc_raw = mres3*div_factor
 
         if self.overflow_exception:
-            if self.status_as_dict['mresof']:
+            if status & _STATUS_MASK_MRESOF:
                 raise AS7331Overflow("measurement register overflow")
 
         return uva_raw, uvb_raw, uvc_raw, temp_raw
 
     @property
     def values(self):
+        return self.convert(self.raw_values)
+
+    @property
+    def overflowed(self):
+        """ True if the last result had a measurement or ADC overflow """
+        return bool(self.last_status & (_STATUS_MASK_MRESOF | _STATUS_MASK_ADCOF))
+
+    @property
+    def full_scale_counts(self):
+        """
+        Largest count the current settings can produce: the counters stop at
+        integration time * clock frequency for short integration times.
+        """
+        counts = integration_time_to_value(self.integration_time)*cclk_to_value(self.cclk)
+        return min(_MRES_MAX_COUNTS, int(counts))
+
+    def enable_auto_range(self, **kwargs):
+        """ Adjusts gain and integration time after each read (see AutoRanger) """
+        self.auto_ranger = AutoRanger(self, **kwargs)
+        return self.auto_ranger
+
+    def convert(self, raw_values):
+        """ Converts raw values to uW/cm**2 (UVA, UVB, UVC) and deg C """
         # Get conversion factors
         common_factor = self.conversion_factor
         conv_factor_a = _FSRA*common_factor
         conv_factor_b = _FSRB*common_factor
         conv_factor_c = _FSRC*common_factor
 
-        # Get raw integer values and convert to uW/cm**2 or deg C
-        uva_raw, uvb_raw, uvc_raw, temp_raw = self.raw_values
+        uva_raw, uvb_raw, uvc_raw, temp_raw = raw_values
         uva = uva_raw*conv_factor_a
         uvb = uvb_raw*conv_factor_b
         uvc = uvc_raw*conv_factor_c
@@ -796,6 +984,13 @@ class AS7331Overflow(Exception):
     """
     pass
 
+class AS7331Timeout(Exception):
+    """
+    Raised when a measurement result is not ready well after its integration
+    time has passed.
+    """
+    pass
+
 
 # Context managers 
 # -----------------------------------------------------------------------------
@@ -805,6 +1000,9 @@ class ConfigurationStateManager:
     Context manager for device configuration.  Puts the device into the 
     configuration state on enter and puts into the measurement state on
     exit.
+
+    Windows can be nested; only the outermost one changes the device state,
+    so several changes made inside it share a single configuration window.
     """
 
     def __init__(self, obj):
@@ -812,11 +1010,86 @@ class ConfigurationStateManager:
         super().__init__()
 
     def __enter__(self):
-        self.obj.device_state = DEVICE_STATE_CONFIGURATION
+        self.obj._config_depth += 1
+        if self.obj._config_depth == 1:
+            self.obj.device_state = DEVICE_STATE_CONFIGURATION
 
     def __exit__(self, exc_type, exc_value, exc_tb):
-        self.obj.device_state = DEVICE_STATE_MEASUREMENT
+        self.obj._config_depth -= 1
+        if self.obj._config_depth == 0:
+            self.obj.device_state = DEVICE_STATE_MEASUREMENT
+
 
+# Auto-ranging
+# -----------------------------------------------------------------------------
+
+class AutoRanger:
+    """
+    Chooses gain and integration time from the last result so the largest
+    channel stays between `low` and `high` times the full-scale counts.
+
+    The settings form a ladder where each step doubles the sensitivity: first
+    every gain from 1x to 2048x at the shortest integration time that still
+    gives the full 16-bit range (64 ms at 1024 kHz), then longer integration
+    times at 2048x up to `max_time`. Gain is always raised before the
+    integration time, so samples stay as short as possible. After an overflow
+    (MRESOF/ADCOF) the sensitivity drops by 2**_AUTORANGE_OVERFLOW_STEPS;
+    otherwise it moves straight to the step closest to `target`.
+    """
+
+    def __init__(self, sensor, min_time=None, max_time=INTEGRATION_TIME_512MS,
+                 low=_AUTORANGE_LOW, high=_AUTORANGE_HIGH, target=_AUTORANGE_TARGET):
+        self.sensor = sensor
+        if min_time is None:
+            # Shortest time whose full scale is the whole MRES range
+            min_time = _INTEGRATION_TIME_MIN_VAL
+            while (integration_time_to_value(min_time)*cclk_to_value(sensor.cclk) <= _MRES_MAX_COUNTS
+                   and min_time < max_time):
+                min_time += 1
+        self.min_time = min_time
+        self.max_time = max_time
+        self.low = low
+        self.high = high
+        self.target = target
+        self.max_step = (_GAIN_MAX_VAL - _GAIN_MIN_VAL) + (max_time - min_time)
+
+    def step_to_settings(self, step):
+        """ Returns (gain, integration_time) of a step of the ladder """
+        gain_steps = _GAIN_MAX_VAL - _GAIN_MIN_VAL
+        gain = _GAIN_MAX_VAL - min(step, gain_steps)
+        integration_time = self.min_time + max(0, step - gain_steps)
+        return gain, integration_time
+
+    @property
+    def current_step(self):
+        """ Step of the ladder with the same sensitivity as the current settings """
+        gain_step = _GAIN_MAX_VAL - self.sensor.gain
+        time_step = max(0, self.sensor.integration_time - self.min_time)
+        return min(gain_step + time_step, self.max_step)
+
+    def update(self):
+        """
+        Looks at the last result and changes the settings if needed. Returns
+        True if they were changed.
+        """
+        sensor = self.sensor
+        step = self.current_step
+        level = max(sensor.last_counts)/sensor.full_scale_counts
+
+        if sensor.overflowed or level >= 1.0:
+            new_step = step - _AUTORANGE_OVERFLOW_STEPS
+        elif level > self.high or level < self.low:
+            level = max(level, 1.0/sensor.full_scale_counts)
+            new_step = step + math.floor(math.log2(self.target/level))
+        else:
+            new_step = step
+        new_step = min(max(new_step, 0), self.max_step)
+
+        gain, integration_time = self.step_to_settings(new_step)
+        if (gain, integration_time) == (sensor.gain, sensor.integration_time):
+            return False
+        sensor.configure(gain=gain, integration_time=integration_time)
+        return True
 
 # Utility functions
 # -----------------------------------------------------------------------------
@@ -846,6 +1119,12 @@ def temp_raw_to_celsius(val):
     """
     return 0.05*val - 66.9
 
+def _set_bits(reg_value, mask, enabled):
+    """
+    Sets (enabled=True) or clears the bits of `mask` in a register value.
+    """
+    return reg_value | mask if enabled else reg_value & ~mask
+
 def bytes_to_uint16(lo_byte, hi_byte):
     """
     Converts two bytes to a uint16
@@ -855,9 +1134,10 @@ def bytes_to_uint16(lo_byte, hi_byte):
 
 # Main
 def initialize_sensor():
-    sensor = AS7331(board.I2C())
-    sensor.gain = GAIN_512X
-    sensor.integration_time = INTEGRATION_TIME_128MS
+    sensor = AS7331(get_i2c(PRIORITY_UV))
+    # Starting point; the auto-ranger adapts gain and integration time to the UV level
+    sensor.configure(gain=GAIN_512X, integration_time=INTEGRATION_TIME_128MS)
+    sensor.enable_auto_range()
     #print("Sensor UV inicializado con éxito.")
     return sensor
 
@@ -869,17 +1149,43 @@ def get_sensor_status(sensor):
         'integration_time': sensor.integration_time_as_string,
         'divider_enabled': sensor.divider_enabled,
         'divider': sensor.divider,
-        'power_down_enable': sensor.power_down_enable,
+        'power_down_enable': sensor.power_down_enabled,
         'standby_state': sensor.standby_state
     }
 
 def read_sensor_data(sensor):
+    """
+    Reads the sensor and returns the UV values together with the gain and
+    integration time (ms) they were measured with. With auto-ranging, an
+    overflowed result is measured again with the new range; None is returned
+    if it still overflows.
+    """
     try:
-        uva, uvb, uvc, temp = sensor.values
-        return {'UVA': uva, 'UVB': uvb, 'UVC': uvc, 'UV Temp': temp}
+        for attempt in range(_AUTORANGE_RETRIES + 1):
+            gain, integration_time = sensor.gain_value, sensor.integration_time_value
+            uva, uvb, uvc, temp = sensor.values
+            ranger = sensor.auto_ranger
+            if ranger is None:
+                break
+            changed = ranger.update()
+            if not sensor.overflowed:
+                break
+            if not changed or attempt == _AUTORANGE_RETRIES:
+                raise AS7331Overflow("measurement overflow after auto-ranging")
+        return {'UVA': uva, 'UVB': uvb, 'UVC': uvc, 'UV Temp': temp,
+                'UV Gain': gain, 'UV Integration Time': integration_time}
     except AS7331Overflow as err:
         print('Sensor Overflow Error:', err)
         return None
+    except AS7331Timeout as err:
+        print('Sensor Timeout Error:', err)
+        return None
+
+def stream_sensor_data(sensor):
+    """ Yields a reading (same format as read_sensor_data) for every result in continuous mode """
+    for uva, uvb, uvc, temp in sensor.stream():
+        yield {'UVA': uva, 'UVB': uvb, 'UVC': uvc, 'UV Temp': temp,
+               'UV Gain': sensor.gain_value, 'UV Integration Time': sensor.integration_time_value}
 
 def main():
     sensor = initialize_sensor()
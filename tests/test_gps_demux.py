@@ -0,0 +1,79 @@
+# test_gps_demux.py
+import random
+from functools import reduce
+from operator import xor
+
+import pytest
+
+pytest.importorskip('serial')
+from Software.Sensors.GPSmodule import (UBX_NAV_ATT, UBX_NAV_HPPOSLLH, UBX_NAV_PVT, UBX_TYPES, StreamDemux,
+                                        ubx_frame)
+
+def nmea(body):
+    return f'${body}*{reduce(xor, body.encode(), 0):02X}\r\n'.encode()
+
+def random_ubx(rng):
+    msg = rng.choice((UBX_NAV_PVT, UBX_NAV_HPPOSLLH, UBX_NAV_ATT))
+    payload = bytes(rng.randrange(256) for _ in range(UBX_TYPES[msg][0].size))
+    return msg, payload
+
+def random_sentence(rng):
+    kind = rng.choice(('GNGGA', 'GNRMC', 'GPGSV'))
+    fields = ','.join(str(rng.randrange(100000)) for _ in range(rng.randrange(3, 12)))
+    return kind, nmea(f'{kind},{fields}')
+
+def garbage(rng):
+    """Noise with false starts: UBX syncs with impossible headers and stray '$'."""
+    noise = bytearray(rng.choice(b'0123456789ABCDEF,.*\r\n\x00\xff') for _ in range(rng.randrange(12)))
+    false_start = rng.randrange(5)
+    if false_start == 0:
+        # Unknown class with a huge length
+        noise += b'\xb5\x62' + bytes((0x77, rng.randrange(256))) + (4000).to_bytes(2, 'little')
+    elif false_start == 1:
+        # Known message with the wrong length
+        noise += b'\xb5\x62\x01\x07' + (3000).to_bytes(2, 'little')
+    elif false_start == 2:
+        noise += b'$' * rng.randrange(1, 4)
+    return bytes(noise)
+
+@pytest.mark.parametrize('seed', range(300))
+def test_mixed_stream_in_random_chunks(seed):
+    rng = random.Random(seed)
+    expected_ubx = []
+    expected_nmea = []
+    stream = bytearray()
+    for _ in range(40):
+        stream += garbage(rng)
+        if rng.random() < 0.5:
+            msg, payload = random_ubx(rng)
+            stream += ubx_frame(msg, payload)
+            expected_ubx.append((msg, payload))
+        else:
+            kind, sentence = random_sentence(rng)
+            stream += sentence
+            expected_nmea.append(sentence.decode()[:-2])
+
+    demux = StreamDemux()
+    got_ubx = []
+    got_nmea = []
+    demux.default_ubx = lambda msg, payload: got_ubx.append((msg, payload))
+    demux.default_nmea = lambda sentence: got_nmea.append(sentence.raw)
+    position = 0
+    while position < len(stream):
+        size = rng.randrange(1, 300)
+        demux.feed(bytes(stream[position:position + size]))
+        position += size
+
+    assert got_ubx == expected_ubx
+    assert got_nmea == expected_nmea
+
+def test_typed_messages_are_dispatched_by_subscription():
+    demux = StreamDemux()
+    got = []
+    demux.subscribe(UBX_NAV_ATT, got.append)
+    demux.subscribe('GGA', got.append)
+    payload = UBX_TYPES[UBX_NAV_ATT][0].pack(1000, 0, 150000, -250000, 9000000, 1, 2, 3)
+    demux.feed(b'$$' + nmea('GNGGA,123519,4807.038,N') + ubx_frame(UBX_NAV_ATT, payload))
+    attitude, gga = got[1], got[0]
+    assert (attitude.roll, attitude.pitch, attitude.heading) == (150000, -250000, 9000000)
+    assert (gga.talker, gga.type, gga.fields) == ('GN', 'GGA', ('123519', '4807.038', 'N'))
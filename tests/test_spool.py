@@ -0,0 +1,58 @@
+# test_spool.py
+import os
+
+from Software.Lora.spool import SLOT_SIZE, FrameSpool
+
+def payload(seq):
+    return f'frame {seq}'.encode() * 3
+
+def test_unsent_frames_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'telemetry.spool')
+    spool = FrameSpool(path, capacity=16)
+    for seq in range(6):
+        assert spool.put(payload(seq)) == seq
+    spool.ack(1)
+    spool.ack(4)
+    spool.close()
+
+    spool = FrameSpool(path, capacity=16)
+    assert list(spool.pending) == [0, 2, 3, 5]
+    # Recovered frames are the backlog: the oldest goes first
+    assert spool.next_frame(timeout=0) == (0, payload(0))
+    spool.ack(0)
+    # New frames continue the sequence and are sent live before the backlog
+    assert spool.put(payload(6)) == 6
+    assert spool.next_frame(timeout=0) == (6, payload(6))
+    spool.ack(6)
+    assert spool.next_frame(timeout=0) == (2, payload(2))
+    spool.close()
+
+def test_torn_slot_is_ignored_on_recovery(tmp_path):
+    path = str(tmp_path / 'telemetry.spool')
+    spool = FrameSpool(path, capacity=8)
+    for seq in range(3):
+        spool.put(payload(seq))
+    spool.close()
+
+    # A power loss in the middle of writing slot 1
+    with open(path, 'r+b') as file:
+        file.seek(1 * SLOT_SIZE + 12)
+        file.write(b'\xff' * 4)
+
+    spool = FrameSpool(path, capacity=8)
+    assert sorted(spool.pending) == [0, 2]
+    assert spool.next_frame(timeout=0) == (0, payload(0))
+    spool.close()
+
+def test_full_spool_keeps_the_newest_frames(tmp_path):
+    path = str(tmp_path / 'telemetry.spool')
+    spool = FrameSpool(path, capacity=4)
+    for seq in range(10):
+        spool.put(payload(seq))
+    assert list(spool.pending) == [6, 7, 8, 9]
+    spool.close()
+
+    spool = FrameSpool(path, capacity=4)
+    assert list(spool.pending) == [6, 7, 8, 9]
+    assert os.path.getsize(path) == 4 * SLOT_SIZE
+    spool.close()
@@ -0,0 +1,83 @@
+# test_telemetry.py
+import json
+import random
+
+import pytest
+
+from Software.Lora.telemetry import (FIELD_NAMES, LINK_BINARY, LINK_TEXT, FrameParser, MissingKeyframe,
+                                     TelemetryDecoder, TelemetryEncoder, fixed_to_row, pack_frame,
+                                     row_to_fixed)
+
+def make_row(i):
+    """A full telemetry row whose values drift slowly, like consecutive samples."""
+    row = dict.fromkeys(FIELD_NAMES)
+    row.update({
+        'timestamp': 1700000000 + i,
+        'acelx': 0.01 * i, 'acely': -0.02 * i, 'acelz': 9.81,
+        'girox': 0.001 * (i % 7), 'giroy': 0.0, 'giroz': -0.003,
+        'magx': 20.0 + 0.1 * i, 'magy': -5.0, 'magz': 40.0,
+        'uva': 12.5 + i, 'uvb': 3.25, 'uvc': 0.5, 'uv_temp': 24.0,
+        'lat': 40.4 + 1e-6 * i, 'lon': -3.6, 'alt': 650.0 + i,
+        'heading': 123.45, 'cpu_usage': 17.0 + i % 5, 'temperature': 48.3,
+        'dallas_id_0': 0x280123456789AB, 'dallas_temp_0': 21.5 + 0.25 * i,
+        'nmea': f'$GNGGA,1235{i % 10},4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47',
+    })
+    return row
+
+def quantised(row):
+    """The row as it comes out of the fixed-point encoding."""
+    return fixed_to_row(row_to_fixed(row))
+
+def test_keyframe_delta_round_trip():
+    encoder = TelemetryEncoder(keyframe_interval=5)
+    decoder = TelemetryDecoder()
+    for i in range(23):
+        row = make_row(i)
+        seq, decoded = decoder.decode(encoder.encode(row))
+        assert seq == i
+        assert decoded == quantised(row)
+
+def test_delta_without_its_keyframe_is_rejected_until_the_next_one():
+    encoder = TelemetryEncoder(keyframe_interval=4)
+    payloads = [encoder.encode(make_row(i)) for i in range(10)]
+    decoder = TelemetryDecoder()
+    decoder.decode(payloads[0])
+    # Frames 4..7 depend on keyframe 4, which is lost
+    for payload in payloads[5:8]:
+        with pytest.raises(MissingKeyframe):
+            decoder.decode(payload)
+    seq, decoded = decoder.decode(payloads[8])
+    assert seq == 8 and decoded == quantised(make_row(8))
+    assert decoder.decode(payloads[9])[1] == quantised(make_row(9))
+
+def test_frame_parser_resyncs_on_random_chunks():
+    rng = random.Random(4)
+    encoder = TelemetryEncoder(keyframe_interval=5)
+    expected = []
+    stream = bytearray()
+    for i in range(60):
+        # Garbage between frames, without the bytes that start a frame
+        stream += bytes(rng.choice(b'0123456789abcdefxyz \r\n') for _ in range(rng.randrange(8)))
+        if i % 10 == 3:
+            text = json.dumps({'seq': i})
+            stream += b'<<<' + text.encode() + b'>>>'
+            expected.append((LINK_TEXT, text))
+        elif i % 10 == 7:
+            # Corrupted CRC: dropped, the next frame is still found
+            frame = bytearray(pack_frame(encoder.encode(make_row(i))))
+            frame[-1] ^= 0xFF
+            stream += frame
+        else:
+            payload = encoder.encode(make_row(i), keyframe=True)
+            stream += pack_frame(payload)
+            expected.append((LINK_BINARY, payload))
+
+    parser = FrameParser()
+    frames = []
+    position = 0
+    while position < len(stream):
+        size = rng.randrange(1, 64)
+        frames += parser.feed(bytes(stream[position:position + size]))
+        position += size
+    assert [(kind, bytes(data) if kind == LINK_BINARY else data) for kind, data in frames] == expected
+    assert parser.crc_errors == 6